@@ -1,14 +1,27 @@
 # agents/base_agent.py
-from memory.shared_memory import shared_memory_instance
+from memory.shared_memory import get_shared_memory
 
 class BaseAgent:
-    def __init__(self, agent_name: str):
+    def __init__(self, agent_name: str, memory=None):
         self.agent_name = agent_name
-        self.memory = shared_memory_instance # All agents use the same memory instance
+        # All agents share the process-wide memory unless one is injected (e.g. a temporary store in tests)
+        self._memory = memory
+
+    @property
+    def memory(self):
+        if self._memory is None:
+            self._memory = get_shared_memory() # Opened on first use, not when the agent is built
+        return self._memory
 
     def process(self, data, thread_id: str = None, **kwargs):
         raise NotImplementedError("Each agent must implement the 'process' method.")
 
+    async def aprocess(self, data, thread_id: str = None, **kwargs):
+        """Async counterpart of `process`. Agents with LLM calls override it to await them on the
+        event loop; this fallback runs the blocking `process` on a worker thread."""
+        import asyncio
+        return await asyncio.to_thread(self.process, data, thread_id=thread_id, **kwargs)
+
     def _log_to_memory(self, source_identifier: str, source_type: str,
                        classified_format: str = None, classified_intent: str = None,
                        extracted_data: dict = None, thread_id: str = None, notes: str = None):
@@ -22,4 +35,19 @@ class BaseAgent:
             extracted_data=extracted_data,
             thread_id=thread_id,
             notes=notes
+        )
+
+    async def _alog_to_memory(self, source_identifier: str, source_type: str,
+                              classified_format: str = None, classified_intent: str = None,
+                              extracted_data: dict = None, thread_id: str = None, notes: str = None):
+        """_log_to_memory for async agents (see SharedMemory.aadd_entry)."""
+        return await self.memory.aadd_entry(
+            source_identifier=source_identifier,
+            source_type=source_type,
+            classified_format=classified_format,
+            classified_intent=classified_intent,
+            agent_processed=self.agent_name,
+            extracted_data=extracted_data,
+            thread_id=thread_id,
+            notes=notes
         )
\ No newline at end of file
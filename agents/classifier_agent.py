@@ -2,45 +2,123 @@
 import os
 from .base_agent import BaseAgent
 from .json_agent import JSONAgent
-from .email_agent import EmailAgent
-from utils.llm_utils import call_gemini
+from .email_agent import EmailAgent, EMAIL_ANALYSIS_SCHEMA, SINGLE_CALL_MODE
+from utils.llm_utils import call_gemini, call_gemini_async, call_gemini_json, call_gemini_json_async, fresh_answers, \
+    is_llm_error
+from utils.metrics import span, timed, trace
+from utils.prompt_budget import PROMPT_BUDGETS, fit_to_budget
+from utils.prompt_group import PromptGroup
+from utils.dedup import DedupIndex, content_signature, DEDUP_ENABLED, DEDUP_MODE
+from utils.local_classifier import LocalIntentClassifier, TfidfCentroidModel, history_examples
+import asyncio
 import json
-import io # For handling byte streams from Streamlit
-try:
-    from PyPDF2 import PdfReader # For PDF text extraction
-except ImportError:
-    print("PyPDF2 not installed. PDF processing will be limited to filename detection.")
-    PdfReader = None
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from utils.pdf_extract import pdf_support_available, extract_pdf_prefix, extract_pdf_text
+from utils.json_stream import JSONDocumentStream, json_prompt_text, JSON_EXTENSIONS
 
+# PDF text handed to intent classification and routing. Downstream prompts keep at most
+# ~500 tokens (utils.prompt_budget) picked from this text, so extraction stops after the pages that cover it.
+PDF_CONTENT_CHARS = int(os.getenv("PDF_CONTENT_CHARS", "4000"))
 
-# Initialize child agents here or pass them during instantiation
-json_agent_instance = JSONAgent()
-email_agent_instance = EmailAgent()
+LOCAL_CLASSIFIER_ENABLED = os.getenv("LOCAL_CLASSIFIER_ENABLED", "1") == "1"
+LOCAL_CLASSIFIER_TRAIN_FROM_HISTORY = os.getenv("LOCAL_CLASSIFIER_TRAIN_FROM_HISTORY", "0") == "1"
+
+# Placeholder texts produced when no real content could be read; never deduplicated
+EXTRACTION_FAILURE_PREFIXES = ("Error ", "PDF text extraction skipped", "No text found in PDF", "Content of PDF file:")
+
+EMAIL_ROUTED_FORMATS = ["Email", "Text/Email", "PDF"]
+INTENTS = ["Invoice", "RFQ", "Complaint", "Regulation", "General Inquiry", "Order Confirmation", "Other"]
+
+# Stage checkpoint written once the input is read (see ClassifierAgent._prepare)
+EXTRACTED_FIELDS = ("input_data", "content", "format", "dedup_signature")
+
+# Indexes of failed records kept in a JSON stream's summary; the 'errors' count covers all of them
+STREAM_FAILED_RECORDS_LISTED = 100
+
+# Single-call mode: intent plus the EmailAgent fields in one structured request
+COMBINED_ANALYSIS_SCHEMA = dict(EMAIL_ANALYSIS_SCHEMA, intent={"type": str, "enum": INTENTS})
+
+# Shared child agents, created on first use (see _default_agent) rather than at import
+_default_agents = {}
+_default_agents_lock = threading.Lock()
+
+
+def _default_agent(name: str, factory):
+    with _default_agents_lock:
+        if name not in _default_agents:
+            _default_agents[name] = factory()
+        return _default_agents[name]
+
+
+def __getattr__(name):
+    # The former module-level singletons stay importable but are built lazily
+    if name == "json_agent_instance":
+        return _default_agent("json", JSONAgent)
+    if name == "email_agent_instance":
+        return _default_agent("email", EmailAgent)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 class ClassifierAgent(BaseAgent):
-    def __init__(self):
-        super().__init__("ClassifierAgent")
-        self.json_agent = json_agent_instance
-        self.email_agent = email_agent_instance
+    def __init__(self, single_call: bool = None, memory=None, json_agent: JSONAgent = None,
+                 email_agent: EmailAgent = None):
+        super().__init__("ClassifierAgent", memory=memory)
+        # Child agents can be injected; otherwise they share this agent's memory
+        if memory is None:
+            self.json_agent = json_agent or _default_agent("json", JSONAgent)
+            self.email_agent = email_agent or _default_agent("email", EmailAgent)
+        else:
+            self.json_agent = json_agent or JSONAgent(memory=memory)
+            self.email_agent = email_agent or EmailAgent(memory=memory)
+        # single_call: for email-like content, classify intent and run the EmailAgent analysis in one request
+        self.single_call = SINGLE_CALL_MODE if single_call is None else single_call
+        # Local tier answers obvious intents (JSON key signatures, subject keywords) without an LLM call
+        self.local_classifier = self._build_local_classifier() if LOCAL_CLASSIFIER_ENABLED else None
+        self._dedup_index = None
+        self._dedup_index_lock = threading.Lock()
+
+    @property
+    def dedup_index(self):
+        """Content signatures of earlier threads, to reuse their results for re-ingested documents.
+        Built from the memory log on first use; None when dedup is disabled."""
+        if DEDUP_ENABLED and self._dedup_index is None:
+            with self._dedup_index_lock:
+                if self._dedup_index is None:
+                    index = DedupIndex()
+                    index.build_from_entries(self.memory.log)
+                    self._dedup_index = index
+        return self._dedup_index
+
+    def _build_local_classifier(self) -> LocalIntentClassifier:
+        model = None
+        if LOCAL_CLASSIFIER_TRAIN_FROM_HISTORY:
+            examples = history_examples(self.memory.log)
+            if examples:
+                texts, labels = zip(*examples)
+                model = TfidfCentroidModel().fit(list(texts), list(labels))
+                print(f"Local classifier trained on {len(examples)} labelled history entries.")
+        return LocalIntentClassifier(schemas=self.json_agent.target_schemas, model=model)
 
     def _extract_text_from_pdf_bytes(self, pdf_bytes: bytes) -> str:
-        """Extracts text from PDF bytes."""
-        if not PdfReader:
+        """Extracts the full text from PDF bytes."""
+        return self._extract_pdf_text(pdf_bytes)
+
+    @timed("pdf_extract")
+    def _extract_pdf_text(self, source, max_chars: int = None) -> str:
+        """Extracts text from PDF bytes or a file path (memory-mapped).
+        With `max_chars`, pages are read lazily and extraction stops once enough text is
+        available; without it the whole document is extracted, page-parallel for large files."""
+        if not pdf_support_available():
             return "PDF text extraction skipped (PyPDF2 not available)."
         try:
-            pdf_file = io.BytesIO(pdf_bytes)
-            reader = PdfReader(pdf_file)
-            text = ""
-            for page in reader.pages:
-                page_text = page.extract_text()
-                if page_text:
-                    text += page_text + "\n"
-            return text.strip() if text else "No text found in PDF."
+            text = extract_pdf_prefix(source, max_chars) if max_chars else extract_pdf_text(source)
+            return text if text else "No text found in PDF."
         except Exception as e:
             print(f"Error extracting text from PDF: {e}")
             return f"Error extracting PDF text: {e}"
 
+    @timed("format_classification")
     def _classify_format(self, data: any, filename: str = None, is_uploaded_file: bool = False) -> str:
         """Classifies the format of the input data.
         `is_uploaded_file` indicates if 'data' is a file object from an uploader.
@@ -48,20 +126,22 @@ class ClassifierAgent(BaseAgent):
         if isinstance(data, dict):
             return "JSON"
         if isinstance(data, str): # Could be raw text, or path to file
-            try:
-                json.loads(data)
-                return "JSON"
-            except json.JSONDecodeError:
-                if filename and filename.lower().endswith(".pdf"):
-                    return "PDF"
-                if "@" in data and ("Subject:" in data or "From:" in data or "To:" in data):
-                    return "Email"
-                return "Text/Email"
+            if data.lstrip()[:1] in ("{", "["): # Plain text is never parsed as JSON
+                try:
+                    json.loads(data)
+                    return "JSON"
+                except json.JSONDecodeError:
+                    pass
+            if filename and filename.lower().endswith(".pdf"):
+                return "PDF"
+            if "@" in data and ("Subject:" in data or "From:" in data or "To:" in data):
+                return "Email"
+            return "Text/Email"
         # Handling uploaded files (like from Streamlit)
         if hasattr(data, 'name') and hasattr(data, 'getvalue'): # Likely an uploaded file object
             if data.name.lower().endswith(".pdf"):
                 return "PDF"
-            if data.name.lower().endswith(".json"):
+            if data.name.lower().endswith(JSON_EXTENSIONS):
                 return "JSON"
             if data.name.lower().endswith((".txt", ".eml")):
                 return "Text/Email" # Or just "Text" and let intent figure it out
@@ -70,97 +150,401 @@ class ClassifierAgent(BaseAgent):
             return "PDF"
         return "Unknown"
 
-    def _classify_intent(self, text_content: str, source_format: str) -> str:
-        # ... (no changes to this method needed for now)
-        intents = ["Invoice", "RFQ", "Complaint", "Regulation", "General Inquiry", "Order Confirmation", "Other"]
-        prompt = f"""
+    def _budgeted(self, text_content: str, source_format: str, step: str, keep_signature: bool = False) -> str:
+        """Content trimmed to the token budget of `step`. Header, quote and signature
+        stripping only applies to email-like text; PDFs and JSON keep their own layout."""
+        return fit_to_budget(text_content, PROMPT_BUDGETS[step], email=source_format in ("Email", "Text/Email"),
+                             keep_signature=keep_signature, agent=f"{self.agent_name}.{step}")
+
+    def _local_intent(self, text_content: str, source_format: str, data: dict = None):
+        """(intent, intent source) from the local tier, or None when the LLM has to answer."""
+        if self.local_classifier:
+            local_intent, confidence, method = self.local_classifier.classify(text_content, source_format, data)
+            if local_intent:
+                print(f"Local classifier: Intent={local_intent} ({method}, confidence {confidence:.2f}). Skipping LLM.")
+                return local_intent, f"local:{method}"
+        return None
+
+    def _intent_prompt(self, text_content: str, source_format: str) -> str:
+        content = self._budgeted(text_content, source_format, "intent")
+        return f"""
         Given the following {source_format} content, classify its primary intent.
-        Choose one of the following intents: {', '.join(intents)}.
+        Choose one of the following intents: {', '.join(INTENTS)}.
         If none seem to fit well, choose 'General Inquiry'.
 
         Content:
         ---
-        {text_content[:2000]}
+        {content}
         ---
         Primary Intent:
         """
-        classified_intent = call_gemini(prompt, temperature=0.2)
+
+    @staticmethod
+    def _parse_intent(classified_intent: str) -> str:
+        """One of INTENTS ('Other' for an unexpected answer); a failed LLM call is passed
+        through as its error string, for _checkpoint_intent."""
+        intents = INTENTS
+        if is_llm_error(classified_intent):
+            return classified_intent
         valid_intents_lower = [i.lower() for i in intents]
         if classified_intent.lower() in valid_intents_lower:
             return intents[valid_intents_lower.index(classified_intent.lower())]
         print(f"Warning: LLM returned an unexpected intent '{classified_intent}'. Defaulting to 'Other'.")
         return "Other"
 
+    @timed("intent")
+    def _classify_intent(self, text_content: str, source_format: str, data: dict = None) -> tuple:
+        """(intent, intent source): 'local:<method>' or 'llm'."""
+        local = self._local_intent(text_content, source_format, data)
+        if local:
+            return local
+        prompt = self._intent_prompt(text_content, source_format)
+        return self._parse_intent(call_gemini(prompt, temperature=0.2, agent=f"{self.agent_name}.intent")), "llm"
+
+    @timed("intent")
+    async def _aclassify_intent(self, text_content: str, source_format: str, data: dict = None) -> tuple:
+        local = self._local_intent(text_content, source_format, data)
+        if local:
+            return local
+        prompt = self._intent_prompt(text_content, source_format)
+        answer = await call_gemini_async(prompt, temperature=0.2, agent=f"{self.agent_name}.intent")
+        return self._parse_intent(answer), "llm"
+
+    def _combined_prompt(self, text_content: str, source_format: str) -> str:
+        content = self._budgeted(text_content, source_format, "analysis", keep_signature=True)
+        return f"""
+        Analyze the following {source_format} content and respond with a single JSON object with exactly these keys:
+        - "intent": the primary intent, one of {', '.join(INTENTS)}. If none seem to fit well, use 'General Inquiry'.
+        - "urgency": one of Low, Medium, High.
+        - "sender": the primary sender's full email address or name, or "Unknown" if none.
+        - "summary": a concise summary suitable for a CRM system covering the main topic/request,
+          key entities mentioned (people, companies, products if applicable) and any explicit
+          action items or deadlines.
+
+        Content:
+        ---
+        {content}
+        ---
+        JSON:
+        """
+
+    @timed("intent", "single_call")
+    def _classify_and_analyze(self, text_content: str, source_format: str):
+        """Single structured request returning intent, urgency, sender and summary.
+        Returns None when the response is unusable; callers then use the per-field prompts."""
+        return call_gemini_json(self._combined_prompt(text_content, source_format), COMBINED_ANALYSIS_SCHEMA,
+                                temperature=0.3, agent=f"{self.agent_name}.analysis")
+
+    @timed("intent", "single_call")
+    async def _aclassify_and_analyze(self, text_content: str, source_format: str):
+        return await call_gemini_json_async(self._combined_prompt(text_content, source_format), COMBINED_ANALYSIS_SCHEMA,
+                                            temperature=0.3, agent=f"{self.agent_name}.analysis")
+
+    def _estimated_llm_calls(self, classified_format: str, text_content: str) -> int:
+        """LLM calls a full run would make for this content (intent plus routed agent steps)."""
+        if classified_format not in EMAIL_ROUTED_FORMATS:
+            return 1
+        if self.single_call:
+            return 1
+        group = PromptGroup()
+        self.email_agent.add_analysis_steps(group, text_content)
+        return 1 + len(group)
+
+    def _reuse_duplicate(self, match, text_content: str, source_identifier: str, source_type: str,
+                         classified_format: str, thread_id: str = None):
+        """Answers a re-ingested document from the matching earlier thread instead of calling
+        the LLM again. Returns (thread_id, result), or None if the earlier thread has no usable
+        result yet (still in flight or failed)."""
+        prior_thread_id, match_kind, similarity = match
+        history = self.memory.get_full_thread_history(prior_thread_id)
+        prior_classification = next((e for e in history if e["agent_processed"] == self.agent_name), None)
+        if prior_classification and self._llm_errors(prior_classification["extracted_data"]):
+            return None # Its intent is the 'Other' fallback of a failed classification
+        prior_result = next((e for e in reversed(history)
+                             if e["agent_processed"] != self.agent_name and self._usable_result(e["extracted_data"])),
+                            None)
+        if not prior_classification or not prior_result:
+            return None
+        self.dedup_index.record(match, self._estimated_llm_calls(classified_format, text_content))
+        duplicate_info = {"duplicate_of": prior_thread_id, "match": match_kind, "similarity": similarity}
+        if DEDUP_MODE == "link":
+            current_thread_id = self._log_to_memory(
+                source_identifier, source_type, classified_format, prior_classification["classified_intent"],
+                extracted_data=duplicate_info, thread_id=prior_thread_id,
+                notes=f"Duplicate ({match_kind}) received; linked to existing thread.")
+        else:
+            current_thread_id = self._log_to_memory(
+                source_identifier, source_type, classified_format, prior_classification["classified_intent"],
+                extracted_data=dict(duplicate_info, reused_result=prior_result["extracted_data"]), thread_id=thread_id,
+                notes=f"Duplicate ({match_kind}) of thread {prior_thread_id}; reused prior results.")
+        print(f"Classifier: {match_kind} duplicate of thread {prior_thread_id} (similarity {similarity}). Skipping LLM processing.")
+        return current_thread_id, prior_result["extracted_data"]
+
+    @timed("intent", "with_email_steps")
+    def _classify_with_email_steps(self, text_content: str, source_format: str, checkpoint: dict):
+        """Runs intent classification concurrently with the EmailAgent steps that do not need
+        the intent (sender, urgency); only the CRM summary waits for the intent.
+        Returns (intent, analysis) where analysis is passed to EmailAgent as `prefetched`.
+        Each step is checkpointed as soon as it finishes; steps already checkpointed by an
+        earlier attempt are not repeated."""
+        saved = self.email_agent.checkpointed_steps(checkpoint)
+        group = PromptGroup()
+        group.add("intent", lambda r: self._checkpoint_intent(checkpoint,
+                                                              *self._classify_intent(text_content, source_format)))
+        self.email_agent.add_analysis_steps(group, text_content, intent_step="intent", skip=saved,
+                                            checkpoint=checkpoint)
+        analysis = dict(saved, **group.run())
+        return analysis.pop("intent"), analysis
+
+    @timed("intent", "with_email_steps")
+    async def _aclassify_with_email_steps(self, text_content: str, source_format: str, checkpoint: dict):
+        async def intent_step(results):
+            return self._checkpoint_intent(checkpoint, *await self._aclassify_intent(text_content, source_format))
+
+        saved = self.email_agent.checkpointed_steps(checkpoint)
+        group = PromptGroup()
+        group.add("intent", intent_step)
+        self.email_agent.add_analysis_steps(group, text_content, intent_step="intent", skip=saved, use_async=True,
+                                            checkpoint=checkpoint)
+        analysis = dict(saved, **await group.arun())
+        return analysis.pop("intent"), analysis
+
+    @staticmethod
+    def _checkpoint_intent(checkpoint: dict, intent: str, source: str) -> str:
+        """Checkpoints a classified intent and where it came from ('llm' or 'local:<method>',
+        recorded in the classification entry). A failed LLM call falls back to 'Other' without
+        checkpointing it, so a retried job classifies again; the error is saved as
+        'intent_error' and reported in the result's llm_errors."""
+        if is_llm_error(intent):
+            print(f"Warning: Intent classification failed ({intent}). Defaulting to 'Other'.")
+            checkpoint["intent_error"] = intent
+            return "Other"
+        checkpoint["intent_source"] = source
+        checkpoint["intent"] = intent
+        return intent
+
+    def _checkpoint_logged(self, checkpoint: dict, durable: bool, stage: str, value):
+        """Checkpoints a stage that wrote memory entries; with a caller's checkpoint the entries
+        are flushed first, so a resumed job never skips an entry that was only buffered."""
+        if durable:
+            self.memory.save_to_file()
+        checkpoint[stage] = value
+
+    def _combined_answer(self, analysis, checkpoint: dict):
+        """Checkpoints a usable single-call answer; returns (intent, analysis) or None."""
+        if not analysis:
+            return None
+        self.email_agent.save_steps(checkpoint, analysis)
+        return self._checkpoint_intent(checkpoint, analysis.pop("intent"), "llm"), analysis
+
+    def _classify(self, content: str, classified_format: str, input_data, checkpoint: dict):
+        """(intent, prefetched EmailAgent analysis or None)."""
+        if classified_format in EMAIL_ROUTED_FORMATS:
+            # Email-like content is routed to EmailAgent, so its LLM steps can start now
+            if self.single_call:
+                classified = self._combined_answer(self._classify_and_analyze(content, classified_format), checkpoint)
+                if classified:
+                    return classified
+            return self._classify_with_email_steps(content, classified_format, checkpoint)
+        return self._checkpoint_intent(checkpoint, *self._classify_intent(
+            content, classified_format, data=input_data if isinstance(input_data, dict) else None)), None
+
+    async def _aclassify(self, content: str, classified_format: str, input_data, checkpoint: dict):
+        if classified_format in EMAIL_ROUTED_FORMATS:
+            if self.single_call:
+                classified = self._combined_answer(await self._aclassify_and_analyze(content, classified_format),
+                                                   checkpoint)
+                if classified:
+                    return classified
+            return await self._aclassify_with_email_steps(content, classified_format, checkpoint)
+        return self._checkpoint_intent(checkpoint, *await self._aclassify_intent(
+            content, classified_format, data=input_data if isinstance(input_data, dict) else None)), None
+
+    def process(self, input_data: any, source_identifier: str, source_type: str = "unknown_source", thread_id: str = None,
+                checkpoint=None, force: bool = False):
+        """Classifies and routes one document. `checkpoint` (a utils.job_queue.JobCheckpoint, or
+        any dict) records each completed stage: extracted content, intent, every LLM step, the
+        classification entry and the final result. Stages already in it are not repeated, so a
+        retried job resumes where the previous attempt stopped. Memory entries are flushed
+        before a stage that depends on them is checkpointed. With `force`, an exact duplicate is
+        not answered from its earlier thread and every LLM call bypasses the response cache."""
+        durable = checkpoint is not None
+        checkpoint = {} if checkpoint is None else checkpoint
+        # One metrics trace per document; its spans are tied to the thread once it is logged
+        with trace(source_identifier, thread_id), span("pipeline", self.agent_name), fresh_answers(force):
+            if checkpoint.get("result"):
+                return tuple(checkpoint["result"])
+            extracted = checkpoint.get("extracted")
+            if extracted is None:
+                outcome, extracted = self._prepare(input_data, source_identifier, source_type, thread_id,
+                                                   checkpoint if durable else None, force)
+                if outcome:
+                    return outcome
+                checkpoint["extracted"] = extracted
+            input_data, content, classified_format, dedup_signature = (extracted[k] for k in EXTRACTED_FIELDS)
 
-    def process(self, input_data: any, source_identifier: str, source_type: str = "unknown_source", thread_id: str = None):
+            classified_intent = checkpoint.get("intent")
+            if classified_intent is None:
+                classified_intent, prefetched_analysis = self._classify(content, classified_format, input_data, checkpoint)
+            else:
+                prefetched_analysis = self.email_agent.checkpointed_steps(checkpoint)
+            intent_error = None if "intent" in checkpoint else checkpoint.get("intent_error")
+            current_thread_id = checkpoint.get("thread_id")
+            if current_thread_id is None:
+                current_thread_id = self._log_to_memory(**self._classification_entry(
+                    source_identifier, source_type, classified_format, classified_intent, dedup_signature, thread_id,
+                    extracted.get("near_duplicate_of"), intent_error, checkpoint.get("intent_source")))
+                self._checkpoint_logged(checkpoint, durable, "thread_id", current_thread_id)
+            self._classified(current_thread_id, classified_format, classified_intent)
+
+            agent, data = self._route(input_data, content, classified_format, source_identifier, source_type,
+                                      classified_intent, current_thread_id)
+            if agent is None:
+                entry, result = data
+                self._log_to_memory(**entry)
+            else:
+                result = agent.process(data, **self._agent_kwargs(
+                    agent, source_identifier, current_thread_id, classified_intent, prefetched_analysis, checkpoint))
+            result = self._with_intent_error(result, intent_error)
+            if not self._llm_errors(result):
+                self._checkpoint_logged(checkpoint, durable, "result", [current_thread_id, result])
+            self._index_result(current_thread_id, dedup_signature, result)
+            return current_thread_id, result
+
+    async def aprocess(self, input_data: any, source_identifier: str, source_type: str = "unknown_source",
+                       thread_id: str = None, checkpoint=None, force: bool = False):
+        """Async `process`. Reading (file and PDF I/O) runs on a worker thread; the LLM calls,
+        the routed agent and memory writes are awaited on the caller's event loop."""
+        durable = checkpoint is not None
+        checkpoint = {} if checkpoint is None else checkpoint
+        with trace(source_identifier, thread_id), span("pipeline", self.agent_name), fresh_answers(force):
+            if checkpoint.get("result"):
+                return tuple(checkpoint["result"])
+            extracted = checkpoint.get("extracted")
+            if extracted is None:
+                outcome, extracted = await asyncio.to_thread(self._prepare, input_data, source_identifier,
+                                                             source_type, thread_id, checkpoint if durable else None,
+                                                             force)
+                if outcome:
+                    return outcome
+                checkpoint["extracted"] = extracted
+            input_data, content, classified_format, dedup_signature = (extracted[k] for k in EXTRACTED_FIELDS)
+
+            classified_intent = checkpoint.get("intent")
+            if classified_intent is None:
+                classified_intent, prefetched_analysis = await self._aclassify(content, classified_format, input_data,
+                                                                               checkpoint)
+            else:
+                prefetched_analysis = self.email_agent.checkpointed_steps(checkpoint)
+            intent_error = None if "intent" in checkpoint else checkpoint.get("intent_error")
+            current_thread_id = checkpoint.get("thread_id")
+            if current_thread_id is None:
+                current_thread_id = await self._alog_to_memory(**self._classification_entry(
+                    source_identifier, source_type, classified_format, classified_intent, dedup_signature, thread_id,
+                    extracted.get("near_duplicate_of"), intent_error, checkpoint.get("intent_source")))
+                await asyncio.to_thread(self._checkpoint_logged, checkpoint, durable, "thread_id", current_thread_id)
+            self._classified(current_thread_id, classified_format, classified_intent)
+
+            agent, data = self._route(input_data, content, classified_format, source_identifier, source_type,
+                                      classified_intent, current_thread_id)
+            if agent is None:
+                entry, result = data
+                await self._alog_to_memory(**entry)
+            else:
+                result = await agent.aprocess(data, **self._agent_kwargs(
+                    agent, source_identifier, current_thread_id, classified_intent, prefetched_analysis, checkpoint))
+            result = self._with_intent_error(result, intent_error)
+            if not self._llm_errors(result):
+                await asyncio.to_thread(self._checkpoint_logged, checkpoint, durable, "result",
+                                        [current_thread_id, result])
+            self._index_result(current_thread_id, dedup_signature, result)
+            return current_thread_id, result
+
+    def _prepare(self, input_data: any, source_identifier: str, source_type: str, thread_id: str,
+                 checkpoint=None, force: bool = False):
+        """Reads the input, classifies its format and checks for duplicates.
+        Returns (outcome, None) when the document is already answered (multi-document JSON
+        streams, reused duplicates), else (None, extracted) where `extracted` holds the
+        EXTRACTED_FIELDS (input_data only for parsed JSON, so it can be checkpointed).
+        A multi-document stream records its finished records in `checkpoint`. With `force`, an
+        exact duplicate is processed in full instead of reusing the earlier thread."""
         print(f"\nClassifierAgent processing: {source_identifier}")
 
         content_for_intent_classification = ""
-        # `input_data` can now also be a Streamlit UploadedFile object
-        is_uploaded_file_object = hasattr(input_data, 'name') and hasattr(input_data, 'getvalue')
-
-        if is_uploaded_file_object:
-            filename_for_format_classification = input_data.name
-            # Determine format based on uploaded file's name first
-            classified_format = self._classify_format(input_data, filename=input_data.name, is_uploaded_file=True)
-
-            if classified_format == "PDF":
-                pdf_bytes = input_data.getvalue()
-                content_for_intent_classification = self._extract_text_from_pdf_bytes(pdf_bytes)
-                if not content_for_intent_classification.startswith("Error extracting PDF text") and \
-                   content_for_intent_classification != "No text found in PDF." and \
-                   content_for_intent_classification != "PDF text extraction skipped (PyPDF2 not available).":
-                    print(f"Extracted text from PDF '{source_identifier}': {len(content_for_intent_classification)} chars")
-                else:
-                    print(f"Warning/Error with PDF '{source_identifier}': {content_for_intent_classification}")
-            elif classified_format == "JSON":
-                try:
-                    json_content_bytes = input_data.getvalue()
-                    loaded_json = json.loads(json_content_bytes.decode('utf-8'))
-                    content_for_intent_classification = json.dumps(loaded_json, indent=2)
-                    input_data = loaded_json # Replace file obj with parsed dict for JSON agent
-                except Exception as e:
-                    content_for_intent_classification = f"Error reading/parsing uploaded JSON: {e}"
-                    print(f"Error processing uploaded JSON {source_identifier}: {e}")
-                    # We might want to handle this error more gracefully, e.g., by logging and returning
-            else: # Text/Email from uploaded file
-                try:
-                    text_bytes = input_data.getvalue()
-                    content_for_intent_classification = text_bytes.decode('utf-8')
-                except Exception as e:
-                    content_for_intent_classification = f"Error reading uploaded text file: {e}"
-                    print(f"Error processing uploaded text file {source_identifier}: {e}")
-        else: # Handling for string data or file paths (original logic)
-            filename_for_format_classification = None
-            if isinstance(input_data, str) and source_identifier.lower().endswith((".txt", ".eml")):
-                content_for_intent_classification = input_data
-                filename_for_format_classification = source_identifier
-            elif isinstance(input_data, dict):
-                content_for_intent_classification = json.dumps(input_data, indent=2)
-            elif isinstance(input_data, str) and os.path.exists(input_data): # File path
-                filename_for_format_classification = input_data
-                if input_data.lower().endswith(".pdf"):
-                    # This path might be less used with Streamlit, but keep for compatibility
-                    if PdfReader:
-                        try:
-                            with open(input_data, 'rb') as f_pdf:
-                                content_for_intent_classification = self._extract_text_from_pdf_bytes(f_pdf.read())
-                        except Exception as e:
-                            content_for_intent_classification = f"Error reading PDF file {input_data}: {e}"
+        with span("read") as read_span:
+            # `input_data` can now also be a Streamlit UploadedFile object
+            is_uploaded_file_object = hasattr(input_data, 'name') and hasattr(input_data, 'getvalue')
+
+            if is_uploaded_file_object:
+                filename_for_format_classification = input_data.name
+                # Determine format based on uploaded file's name first
+                classified_format = self._classify_format(input_data, filename=input_data.name, is_uploaded_file=True)
+
+                if classified_format == "PDF":
+                    pdf_bytes = input_data.getvalue()
+                    content_for_intent_classification = self._extract_pdf_text(pdf_bytes, max_chars=PDF_CONTENT_CHARS)
+                    if not content_for_intent_classification.startswith("Error extracting PDF text") and \
+                       content_for_intent_classification != "No text found in PDF." and \
+                       content_for_intent_classification != "PDF text extraction skipped (PyPDF2 not available).":
+                        print(f"Extracted text from PDF '{source_identifier}': {len(content_for_intent_classification)} chars")
                     else:
-                        content_for_intent_classification = f"Content of PDF file: {input_data} (PyPDF2 not available)"
-                    print(f"NOTE: PDF content extraction from path: {input_data}")
-                elif input_data.lower().endswith(".json"):
-                    with open(input_data, 'r') as f:
-                        loaded_json = json.load(f)
-                        content_for_intent_classification = json.dumps(loaded_json, indent=2)
+                        print(f"Warning/Error with PDF '{source_identifier}': {content_for_intent_classification}")
+                elif classified_format == "JSON":
+                    try:
+                        documents = JSONDocumentStream(input_data, filename=input_data.name)
+                        if documents.is_multi_document:
+                            read_span.finish() # Each record is traced on its own
+                            return self.process_json_stream(documents, source_identifier, source_type,
+                                                                checkpoint=checkpoint, force=force), None
+                        loaded_json = documents.load_single()
+                        content_for_intent_classification = json_prompt_text(loaded_json)
+                        input_data = loaded_json # Replace file obj with parsed dict for JSON agent
+                    except Exception as e:
+                        content_for_intent_classification = f"Error reading/parsing uploaded JSON: {e}"
+                        print(f"Error processing uploaded JSON {source_identifier}: {e}")
+                        # We might want to handle this error more gracefully, e.g., by logging and returning
+                else: # Text/Email from uploaded file
+                    try:
+                        text_bytes = input_data.getvalue()
+                        content_for_intent_classification = text_bytes.decode('utf-8')
+                    except Exception as e:
+                        content_for_intent_classification = f"Error reading uploaded text file: {e}"
+                        print(f"Error processing uploaded text file {source_identifier}: {e}")
+            else: # Handling for string data or file paths (original logic)
+                filename_for_format_classification = None
+                if isinstance(input_data, str) and source_identifier.lower().endswith((".txt", ".eml")):
+                    content_for_intent_classification = input_data
+                    filename_for_format_classification = source_identifier
+                elif isinstance(input_data, dict):
+                    content_for_intent_classification = json_prompt_text(input_data)
+                elif isinstance(input_data, str) and os.path.exists(input_data): # File path
+                    filename_for_format_classification = input_data
+                    if input_data.lower().endswith(".pdf"):
+                        # This path might be less used with Streamlit, but keep for compatibility
+                        if pdf_support_available():
+                            content_for_intent_classification = self._extract_pdf_text(input_data, max_chars=PDF_CONTENT_CHARS)
+                        else:
+                            content_for_intent_classification = f"Content of PDF file: {input_data} (PyPDF2 not available)"
+                        print(f"NOTE: PDF content extraction from path: {input_data}")
+                    elif input_data.lower().endswith(JSON_EXTENSIONS):
+                        documents = JSONDocumentStream(input_data)
+                        try:
+                            if documents.is_multi_document:
+                                read_span.finish() # Each record is traced on its own
+                                return self.process_json_stream(documents, source_identifier, source_type,
+                                                                checkpoint=checkpoint, force=force), None
+                            loaded_json = documents.load_single()
+                        finally:
+                            documents.close()
+                        content_for_intent_classification = json_prompt_text(loaded_json)
                         input_data = loaded_json
-                else:
-                    with open(input_data, 'r') as f:
-                        content_for_intent_classification = f.read()
-            else: # Raw string input
-                content_for_intent_classification = str(input_data)
-            classified_format = self._classify_format(input_data, filename_for_format_classification)
+                    else:
+                        with open(input_data, 'r') as f:
+                            content_for_intent_classification = f.read()
+                else: # Raw string input
+                    content_for_intent_classification = str(input_data)
+                classified_format = self._classify_format(input_data, filename_for_format_classification)
+            read_span.set(input_chars=len(content_for_intent_classification), format=classified_format)
 
 
         # If format still unknown from file object, try content (less reliable for binary)
@@ -168,50 +552,285 @@ class ClassifierAgent(BaseAgent):
              classified_format = self._classify_format(content_for_intent_classification, filename_for_format_classification)
 
 
-        classified_intent = self._classify_intent(content_for_intent_classification, classified_format)
+        dedup_signature = None
+        near_duplicate = None
+        if self.dedup_index is not None and not content_for_intent_classification.startswith(EXTRACTION_FAILURE_PREFIXES):
+            dedup_signature = content_signature(content_for_intent_classification)
+            match = self.dedup_index.find(dedup_signature) if dedup_signature else None
+            if match and match[1] == "exact" and not force:
+                duplicate = self._reuse_duplicate(match, content_for_intent_classification, source_identifier,
+                                                  source_type, classified_format, thread_id)
+                if duplicate:
+                    return duplicate, None
+            elif match and classified_format != "JSON":
+                # A near duplicate may differ exactly where it matters (sender, quantity, date), so it
+                # is processed in full and only references the earlier thread. JSON records differing
+                # only in ids or amounts are distinct documents and get no reference at all.
+                near_duplicate = {"thread_id": match[0], "similarity": match[2]}
+                print(f"Classifier: near duplicate of thread {match[0]} (similarity {match[2]}). Processing in full.")
+            self.dedup_index.record(match if near_duplicate else None)
 
-        current_thread_id = self._log_to_memory(
+        return None, {
+            "input_data": input_data if isinstance(input_data, dict) else None,
+            "content": content_for_intent_classification,
+            "format": classified_format,
+            "dedup_signature": dedup_signature,
+            "near_duplicate_of": near_duplicate,
+        }
+
+    def _classification_entry(self, source_identifier: str, source_type: str, classified_format: str,
+                              classified_intent: str, dedup_signature, thread_id: str,
+                              near_duplicate_of: dict = None, intent_error: str = None,
+                              intent_source: str = None) -> dict:
+        extracted_data = {"dedup_signature": dedup_signature} if dedup_signature else {}
+        if intent_source and not intent_error:
+            extracted_data["intent_source"] = intent_source
+        if near_duplicate_of:
+            extracted_data["near_duplicate_of"] = near_duplicate_of
+        if intent_error:
+            extracted_data["llm_errors"] = {"intent": intent_error}
+        return dict(
             source_identifier=source_identifier,
             source_type=source_type,
             classified_format=classified_format,
             classified_intent=classified_intent,
+            extracted_data=extracted_data or None,
             thread_id=thread_id,
             notes="Initial classification"
         )
+
+    @staticmethod
+    def _llm_errors(result) -> dict:
+        """Failed LLM steps of a result, if any. Such a result is not checkpointed, so a
+        retried job re-runs the failed steps (and only those)."""
+        return result.get("llm_errors") if isinstance(result, dict) else None
+
+    @staticmethod
+    def _with_intent_error(result, intent_error: str):
+        if intent_error and isinstance(result, dict):
+            return dict(result, llm_errors={"intent": intent_error, **(result.get("llm_errors") or {})})
+        return result
+
+    @classmethod
+    def _usable_result(cls, result) -> bool:
+        """False for results a duplicate must not reuse: errors, failed LLM steps, or a JSON
+        stream summary with failed records."""
+        if not isinstance(result, dict):
+            return False
+        if "error" in result or cls._llm_errors(result):
+            return False
+        return not ("stream_layout" in result and result.get("errors"))
+
+    def _index_result(self, current_thread_id: str, dedup_signature, result):
+        """Makes a thread findable as a duplicate once its result succeeded; a failed thread is
+        never indexed, so a re-ingested copy is processed in full instead."""
+        if dedup_signature and self._usable_result(result):
+            self.dedup_index.add(current_thread_id, dedup_signature)
+
+    def _classified(self, current_thread_id: str, classified_format: str, classified_intent: str):
         print(f"Classifier: Format={classified_format}, Intent={classified_intent}, ThreadID={current_thread_id}")
 
+    def _route(self, input_data, content: str, classified_format: str, source_identifier: str, source_type: str,
+               classified_intent: str, current_thread_id: str):
+        """(agent, data to process) for the classified format, or (None, (memory entry, result))
+        when the document is not routed; the caller logs the entry and returns the result."""
         if classified_format == "JSON":
             # input_data should be a dict here. If it came from an uploaded file, it was converted.
             if not isinstance(input_data, dict):
                 try: # Last attempt to parse if it's a string
-                    input_data_parsed = json.loads(content_for_intent_classification) # Use content_for_intent
+                    input_data = json.loads(content) # Use content_for_intent
                 except json.JSONDecodeError:
                     print(f"Error: Could not parse as JSON for {source_identifier} before routing.")
-                    self._log_to_memory(source_identifier, source_type, classified_format, classified_intent,
-                                        extracted_data={"error": "Failed to parse JSON string/content"},
-                                        thread_id=current_thread_id, notes="JSON parsing error before routing")
-                    return current_thread_id, {"error": "Failed to parse JSON content"}
-                return current_thread_id, self.json_agent.process(input_data_parsed, source_identifier=source_identifier, thread_id=current_thread_id, initial_intent=classified_intent)
-            return current_thread_id, self.json_agent.process(input_data, source_identifier=source_identifier, thread_id=current_thread_id, initial_intent=classified_intent)
+                    entry = dict(source_identifier=source_identifier, source_type=source_type,
+                                 classified_format=classified_format, classified_intent=classified_intent,
+                                 extracted_data={"error": "Failed to parse JSON string/content"},
+                                 thread_id=current_thread_id, notes="JSON parsing error before routing")
+                    return None, (entry, {"error": "Failed to parse JSON content"})
+            return self.json_agent, input_data
         elif classified_format in ["Email", "Text/Email"]:
-            return current_thread_id, self.email_agent.process(content_for_intent_classification, source_identifier=source_identifier, thread_id=current_thread_id, initial_intent=classified_intent)
+            return self.email_agent, content
         elif classified_format == "PDF":
             # For PDF, EmailAgent might be suitable if text is extracted
             # Or you could have a dedicated PDF summary agent
             # We will pass the extracted text to EmailAgent as a generic text processor for now
             print(f"PDF detected for {source_identifier}. Routing extracted text to EmailAgent for general processing.")
-            # Note: If content_for_intent_classification is an error message, EmailAgent will process that.
-            return current_thread_id, self.email_agent.process(content_for_intent_classification, source_identifier=source_identifier, thread_id=current_thread_id, initial_intent=classified_intent)
-        else:
-            print(f"Unknown format for {source_identifier}. No specific agent to route to. Content preview: {content_for_intent_classification[:100]}")
-            extracted_data = {"status": f"Unknown format: {classified_format}"}
-            self._log_to_memory(
-                source_identifier=source_identifier,
-                source_type=source_type,
-                classified_format=classified_format,
-                classified_intent=classified_intent,
-                extracted_data=extracted_data,
-                thread_id=current_thread_id,
-                notes="Unknown format, not routed."
-            )
-            return current_thread_id, extracted_data    
\ No newline at end of file
+            # Note: If content is an error message, EmailAgent will process that.
+            return self.email_agent, content
+        print(f"Unknown format for {source_identifier}. No specific agent to route to. Content preview: {content[:100]}")
+        extracted_data = {"status": f"Unknown format: {classified_format}"}
+        entry = dict(
+            source_identifier=source_identifier,
+            source_type=source_type,
+            classified_format=classified_format,
+            classified_intent=classified_intent,
+            extracted_data=extracted_data,
+            thread_id=current_thread_id,
+            notes="Unknown format, not routed."
+        )
+        return None, (entry, extracted_data)
+
+    def _agent_kwargs(self, agent, source_identifier: str, current_thread_id: str, classified_intent: str,
+                      prefetched_analysis, checkpoint: dict) -> dict:
+        kwargs = dict(source_identifier=source_identifier, thread_id=current_thread_id, initial_intent=classified_intent)
+        if agent is self.email_agent:
+            kwargs["prefetched"] = prefetched_analysis
+            kwargs["checkpoint"] = checkpoint
+        return kwargs
+
+    def process_json_stream(self, documents, source_identifier: str, source_type: str = "json_stream",
+                            max_concurrency: int = 4, progress_callback=None, checkpoint=None, force: bool = False):
+        """Routes every record of a JSON Lines file or top-level JSON array as its own document,
+        reading records only as fast as the workers consume them. Record i is logged as
+        '<source_identifier>#i'. Returns (None, summary) since each record gets its own thread;
+        the summary holds counts and the first and last record's thread_id, so memory stays flat
+        however long the stream is. A record counts as an error when it raised or an LLM step
+        failed; the summary then lists up to STREAM_FAILED_RECORDS_LISTED of their indexes in
+        'failed_records'. With `checkpoint`, each record that finished cleanly is checkpointed as
+        'record#<i>' (its thread_id), and a resumed stream skips those records.
+        `progress_callback` (as in process_batch) receives every processed record's outcome.
+        `force` is passed on to every record's `process`."""
+        print(f"ClassifierAgent streaming {documents.layout} records from: {source_identifier}")
+        counts = {"documents": 0, "errors": 0, "resumed": 0}
+        ends = {} # "first" / "last" -> (record index, thread_id)
+        failed = []
+        lock = threading.Lock() # Records are skipped on the reading thread and collected on workers
+
+        def count(index, thread_id, error: bool):
+            counts["documents"] += 1
+            counts["errors"] += error
+            if error and len(failed) < STREAM_FAILED_RECORDS_LISTED:
+                failed.append(index)
+            if "first" not in ends or index < ends["first"][0]:
+                ends["first"] = (index, thread_id)
+            if "last" not in ends or index > ends["last"][0]:
+                ends["last"] = (index, thread_id)
+
+        def collect(completed, index, record_identifier, outcome):
+            error = outcome[0] is None or bool(self._llm_errors(outcome[1]))
+            if checkpoint is not None and not error:
+                self._checkpoint_logged(checkpoint, True, f"record#{index}", outcome[0])
+            with lock:
+                count(index, outcome[0], error)
+            if progress_callback:
+                progress_callback(completed, index, record_identifier, outcome)
+
+        def records():
+            for i, document in enumerate(documents):
+                done = checkpoint.get(f"record#{i}") if checkpoint is not None else None
+                if done:
+                    with lock:
+                        counts["resumed"] += 1
+                        count(i, done, False)
+                    continue
+                yield {"input_data": document, "source_identifier": f"{source_identifier}#{i}",
+                       "source_type": source_type, "force": force}
+
+        try:
+            self.process_batch(records(), max_concurrency=max_concurrency, progress_callback=collect,
+                               keep_results=False)
+        finally:
+            documents.close()
+        summary = {
+            "stream_layout": documents.layout,
+            "documents": counts["documents"],
+            "errors": counts["errors"],
+            "skipped_records": documents.skipped,
+            "first_thread_id": ends["first"][1] if ends else None,
+            "last_thread_id": ends["last"][1] if ends else None,
+        }
+        if counts["resumed"]:
+            summary["resumed_records"] = counts["resumed"]
+        if failed:
+            summary["failed_records"] = sorted(failed)
+        print(f"Stream {source_identifier}: {summary['documents']} records routed, {summary['errors']} failed, "
+              f"{documents.skipped} skipped.")
+        return None, summary
+
+    def process_batch(self, inputs, max_concurrency: int = 4, progress_callback=None, keep_results: bool = True):
+        """Processes many inputs concurrently with at most `max_concurrency` in flight.
+        `inputs` is an iterable of dicts holding `process` keyword arguments (input_data,
+        source_identifier and optionally source_type / thread_id); it is consumed lazily, so
+        a generator is never read further ahead than the free worker slots allow.
+        A failing item does not affect the others: its slot holds (None, {"error": ...}).
+        `progress_callback(completed, index, source_identifier, result)` is called as each item finishes.
+        An exception raised by the callback does not stop the other items; the first one is
+        re-raised once every item has finished.
+        Returns [(thread_id, result), ...] in input order, or an empty list with keep_results=False
+        (for long streams where only the callback needs the outcomes)."""
+        results = {}
+        completed = 0
+        callback_errors = []
+        slots = threading.BoundedSemaphore(max_concurrency)
+        progress_lock = threading.Lock()
+
+        def run_one(index, item):
+            nonlocal completed
+            try:
+                outcome = self.process(**item)
+            except Exception as e:
+                print(f"Error processing {item.get('source_identifier')} in batch: {e}")
+                outcome = (None, {"error": str(e)})
+            finally:
+                slots.release()
+            if keep_results:
+                results[index] = outcome
+            if progress_callback:
+                with progress_lock:
+                    completed += 1
+                    try:
+                        progress_callback(completed, index, item.get("source_identifier"), outcome)
+                    except Exception as e:
+                        print(f"Error in progress callback for {item.get('source_identifier')}: {e}")
+                        callback_errors.append(e)
+
+        with ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="classifier-batch") as pool:
+            count = 0
+            for index, item in enumerate(inputs):
+                slots.acquire() # Backpressure: wait for a free worker before reading the next input
+                pool.submit(run_one, index, item)
+                count += 1
+        if callback_errors:
+            raise callback_errors[0]
+        return [results[i] for i in range(count)] if keep_results else []
+
+    async def aprocess_batch(self, inputs, max_concurrency: int = 16, progress_callback=None, keep_results: bool = True):
+        """process_batch for event loops: up to `max_concurrency` documents are in flight as tasks
+        on the running loop instead of worker threads, so their LLM calls overlap without a
+        thread per document. Same arguments, failure handling and return value as process_batch."""
+        results = {}
+        completed = 0
+        callback_errors = []
+        slots = asyncio.Semaphore(max_concurrency)
+        running = set()
+
+        async def run_one(index, item):
+            nonlocal completed
+            try:
+                outcome = await self.aprocess(**item)
+            except Exception as e:
+                print(f"Error processing {item.get('source_identifier')} in batch: {e}")
+                outcome = (None, {"error": str(e)})
+            finally:
+                slots.release()
+            if keep_results:
+                results[index] = outcome
+            if progress_callback:
+                completed += 1
+                try:
+                    progress_callback(completed, index, item.get("source_identifier"), outcome)
+                except Exception as e:
+                    print(f"Error in progress callback for {item.get('source_identifier')}: {e}")
+                    callback_errors.append(e)
+
+        count = 0
+        for index, item in enumerate(inputs):
+            await slots.acquire() # Backpressure: wait for a free slot before reading the next input
+            task = asyncio.create_task(run_one(index, item))
+            running.add(task)
+            task.add_done_callback(running.discard)
+            count += 1
+        if running:
+            await asyncio.gather(*running)
+        if callback_errors:
+            raise callback_errors[0]
+        return [results[i] for i in range(count)] if keep_results else []
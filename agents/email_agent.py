@@ -1,43 +1,62 @@
 # agents/email_agent.py
 from .base_agent import BaseAgent
-from utils.llm_utils import call_gemini
+from utils.llm_utils import call_gemini, call_gemini_async, call_gemini_json, call_gemini_json_async, is_llm_error
+from utils.metrics import timed
+from utils.prompt_budget import PROMPT_BUDGETS, fit_to_budget
+from utils.prompt_group import PromptGroup
+import os
 import re
 
+SINGLE_CALL_MODE = os.getenv("LLM_SINGLE_CALL_MODE", "0") == "1"
+URGENCY_LEVELS = ["Low", "Medium", "High"]
+
+# Fields requested from the LLM in single-call mode
+EMAIL_ANALYSIS_SCHEMA = {
+    "sender": {"type": str},
+    "urgency": {"type": str, "enum": URGENCY_LEVELS},
+    "summary": {"type": str},
+}
+
 class EmailAgent(BaseAgent):
-    def __init__(self):
-        super().__init__("EmailAgent")
+    def __init__(self, single_call: bool = None, memory=None):
+        super().__init__("EmailAgent", memory=memory)
+        # single_call: ask for sender, urgency and summary in one structured request
+        self.single_call = SINGLE_CALL_MODE if single_call is None else single_call
 
     def _extract_basic_sender(self, email_content: str) -> str:
         """Basic regex to find 'From:' line. LLM can be more robust."""
         match = re.search(r"From:\s*([^\n]+)", email_content, re.IGNORECASE)
         return match.group(1).strip() if match else "Unknown"
 
-    def process(self, email_content: str, source_identifier: str, thread_id: str, initial_intent: str = "Unknown"):
-        """Processes email content."""
-        print(f"EmailAgent processing: {source_identifier} (Intent: {initial_intent})")
+    def _budgeted(self, email_content: str, step: str, keep_signature: bool = False) -> str:
+        """Email content trimmed to the token budget of `step` (see utils.prompt_budget)."""
+        return fit_to_budget(email_content, PROMPT_BUDGETS[step], keep_signature=keep_signature,
+                             agent=f"{self.agent_name}.{step}")
 
-        # 1. Extract Sender (can be basic regex or LLM for robustness)
-        sender = self._extract_basic_sender(email_content)
-        if sender == "Unknown": # Fallback to LLM if regex fails
-            sender_prompt = f"Extract the sender's full email address or name from the following email content. If multiple are present, pick the primary sender. If none, respond with 'Unknown'.\n\nEmail Content:\n{email_content[:1000]}\n\nSender:"
-            sender = call_gemini(sender_prompt, temperature=0.1)
+    def _sender_prompt(self, email_content: str) -> str:
+        # The sign-off often names the sender when there is no 'From:' header
+        content = self._budgeted(email_content, "sender", keep_signature=True)
+        return f"Extract the sender's full email address or name from the following email content. If multiple are present, pick the primary sender. If none, respond with 'Unknown'.\n\nEmail Content:\n{content}\n\nSender:"
 
-        # 2. Refine Intent (optional, classifier might be enough)
-        # For this example, we'll use the initial_intent from the classifier.
-        # If needed, you could ask LLM to refine:
-        # refine_intent_prompt = f"The email was initially classified as '{initial_intent}'. Based on the full content, refine this intent or confirm it. Content: {email_content[:1500]}"
-        # refined_intent = call_gemini(refine_intent_prompt)
-        refined_intent = initial_intent # Using classifier's intent
+    def _urgency_prompt(self, email_content: str) -> str:
+        content = self._budgeted(email_content, "urgency")
+        return f"Assess the urgency of the following email content as Low, Medium, or High. Provide only the urgency level.\n\nEmail Content:\n{content}\n\nUrgency:"
 
-        # 3. Assess Urgency
-        urgency_prompt = f"Assess the urgency of the following email content as Low, Medium, or High. Provide only the urgency level.\n\nEmail Content:\n{email_content[:1500]}\n\nUrgency:"
-        urgency = call_gemini(urgency_prompt, temperature=0.2)
-        if urgency.lower() not in ["low", "medium", "high"]:
-            urgency = "Medium" # Default if LLM gives weird output
+    @staticmethod
+    def _normalize_urgency(urgency: str) -> str:
+        """Maps a valid answer onto URGENCY_LEVELS. LLM errors are returned unchanged so they
+        are reported in llm_errors instead of being stored as an urgency."""
+        if is_llm_error(urgency):
+            return urgency
+        urgency = urgency.strip().capitalize()
+        if urgency not in URGENCY_LEVELS:
+            return "Medium" # Default if LLM gives weird output
+        return urgency
 
-        # 4. Format for CRM-style usage (Summary, Key Points)
-        crm_summary_prompt = f"""
-        Analyze the following email content, which has been identified as related to '{refined_intent}'.
+    def _summary_prompt(self, email_content: str, intent: str) -> str:
+        content = self._budgeted(email_content, "summary")
+        return f"""
+        Analyze the following email content, which has been identified as related to '{intent}'.
         Provide a concise summary suitable for a CRM system.
         Include:
         - Main topic/request.
@@ -46,27 +65,171 @@ class EmailAgent(BaseAgent):
 
         Email Content:
         ---
-        {email_content[:2000]}
+        {content}
         ---
         CRM Summary:
         """
-        crm_summary = call_gemini(crm_summary_prompt, temperature=0.5)
+
+    def _single_call_prompt(self, email_content: str, intent: str) -> str:
+        content = self._budgeted(email_content, "analysis", keep_signature=True)
+        return f"""
+        Analyze the following email content, which has been identified as related to '{intent}'.
+        Respond with a single JSON object with exactly these keys:
+        - "sender": the primary sender's full email address or name, or "Unknown" if none.
+        - "urgency": one of {', '.join(URGENCY_LEVELS)}.
+        - "summary": a concise summary suitable for a CRM system covering the main topic/request,
+          key entities mentioned (people, companies, products if applicable) and any explicit
+          action items or deadlines.
+
+        Email Content:
+        ---
+        {content}
+        ---
+        JSON:
+        """
+
+    def _step_request(self, step: str, email_content: str, intent: str = None):
+        """(prompt, temperature) of a per-field LLM step."""
+        if step == "sender":
+            return self._sender_prompt(email_content), 0.1
+        if step == "urgency":
+            return self._urgency_prompt(email_content), 0.2
+        return self._summary_prompt(email_content, intent), 0.5
+
+    def _finish_step(self, step: str, answer: str, checkpoint=None) -> str:
+        if checkpoint is not None and not is_llm_error(answer):
+            checkpoint[f"{self.agent_name}.{step}"] = answer
+        return self._normalize_urgency(answer) if step == "urgency" else answer
+
+    def _llm_step(self, step: str, email_content: str, intent: str = None, checkpoint=None) -> str:
+        prompt, temperature = self._step_request(step, email_content, intent)
+        answer = call_gemini(prompt, temperature=temperature, agent=f"{self.agent_name}.{step}")
+        return self._finish_step(step, answer, checkpoint)
+
+    async def _allm_step(self, step: str, email_content: str, intent: str = None, checkpoint=None) -> str:
+        prompt, temperature = self._step_request(step, email_content, intent)
+        answer = await call_gemini_async(prompt, temperature=temperature, agent=f"{self.agent_name}.{step}")
+        return self._finish_step(step, answer, checkpoint)
+
+    def checkpointed_steps(self, checkpoint) -> dict:
+        """Step answers saved in `checkpoint` by an earlier attempt, usable as `prefetched`."""
+        if not checkpoint:
+            return {}
+        saved = {step: checkpoint.get(f"{self.agent_name}.{step}") for step in EMAIL_ANALYSIS_SCHEMA}
+        return {step: answer for step, answer in saved.items() if answer}
+
+    def save_steps(self, checkpoint, analysis: dict):
+        if checkpoint is not None:
+            for step, answer in analysis.items():
+                if step in EMAIL_ANALYSIS_SCHEMA and answer and not is_llm_error(answer):
+                    checkpoint[f"{self.agent_name}.{step}"] = answer
+
+    def _analyze_single_call(self, email_content: str, intent: str):
+        """One structured request for sender, urgency and summary. Returns None if the
+        response cannot be parsed or validated, so the caller falls back to per-field prompts."""
+        return call_gemini_json(self._single_call_prompt(email_content, intent), EMAIL_ANALYSIS_SCHEMA,
+                                temperature=0.3, agent=f"{self.agent_name}.analysis")
+
+    async def _aanalyze_single_call(self, email_content: str, intent: str):
+        return await call_gemini_json_async(self._single_call_prompt(email_content, intent), EMAIL_ANALYSIS_SCHEMA,
+                                            temperature=0.3, agent=f"{self.agent_name}.analysis")
+
+    def add_analysis_steps(self, group: PromptGroup, email_content: str, intent: str = None,
+                           intent_step: str = None, skip=(), use_async: bool = False, checkpoint=None):
+        """Declares the LLM steps of `process` on a PromptGroup. Sender (only needed when the
+        regex finds no 'From:' line) and urgency are independent; the summary needs the intent,
+        either passed as `intent` or produced by the group step named `intent_step`.
+        With `use_async` the steps are coroutines, for PromptGroup.arun. Successful answers are
+        saved to `checkpoint` as each step finishes."""
+        run = self._allm_step if use_async else self._llm_step
+        if "sender" not in skip and self._extract_basic_sender(email_content) == "Unknown":
+            group.add("sender", lambda r: run("sender", email_content, checkpoint=checkpoint))
+        if "urgency" not in skip:
+            group.add("urgency", lambda r: run("urgency", email_content, checkpoint=checkpoint))
+        if "summary" not in skip:
+            if intent_step:
+                group.add("summary", lambda r: run("summary", email_content, r[intent_step], checkpoint=checkpoint),
+                          depends_on=[intent_step])
+            else:
+                group.add("summary", lambda r: run("summary", email_content, intent, checkpoint=checkpoint))
+
+    def _result(self, email_content: str, source_identifier: str, thread_id: str, intent: str, analysis: dict):
+        """(extracted_info, memory entry fields) from the collected LLM answers."""
+        # Failed LLM steps are recorded as errors instead of being stored as if they were answers
+        llm_errors = {step: value for step, value in analysis.items() if is_llm_error(value)}
+
+        # Extract Sender (basic regex first, LLM answer as fallback)
+        sender = self._extract_basic_sender(email_content)
+        if sender == "Unknown" and "sender" not in llm_errors:
+            sender = analysis.get("sender") or "Unknown"
+        urgency = None if "urgency" in llm_errors else self._normalize_urgency(analysis["urgency"])
+        crm_summary = None if "summary" in llm_errors else analysis["summary"]
 
         extracted_info = {
             "sender": sender,
-            "intent": refined_intent,
-            "urgency": urgency.capitalize(),
+            "intent": intent,
+            "urgency": urgency,
             "crm_summary": crm_summary,
             "original_content_preview": email_content[:200] + "..."
         }
+        if llm_errors:
+            extracted_info["llm_errors"] = llm_errors
 
-        self._log_to_memory(
+        entry = dict(
             source_identifier=source_identifier,
             source_type="email_content",
             classified_format="Email", # Assuming it's an email
-            classified_intent=refined_intent,
+            classified_intent=intent,
             extracted_data=extracted_info,
             thread_id=thread_id,
-            notes="Processed by EmailAgent."
+            notes="Processed by EmailAgent." if not llm_errors else
+                  f"Processed by EmailAgent with failed LLM steps: {', '.join(llm_errors)}."
         )
-        return extracted_info
\ No newline at end of file
+        return extracted_info, entry
+
+    @timed("agent")
+    def process(self, email_content: str, source_identifier: str, thread_id: str, initial_intent: str = "Unknown",
+                prefetched: dict = None, checkpoint=None):
+        """Processes email content.
+        `prefetched` may carry 'sender', 'urgency' and 'summary' already produced upstream
+        (see ClassifierAgent); the remaining LLM steps run concurrently. Answers found in
+        `checkpoint` (see utils.job_queue.JobCheckpoint) are reused, new ones are saved to it."""
+        print(f"EmailAgent processing: {source_identifier} (Intent: {initial_intent})")
+
+        # 2. Refine Intent (optional, classifier might be enough)
+        # For this example, we'll use the initial_intent from the classifier.
+        refined_intent = initial_intent # Using classifier's intent
+
+        analysis = {k: v for k, v in (prefetched or {}).items() if v}
+        analysis.update(self.checkpointed_steps(checkpoint))
+        if self.single_call and not analysis:
+            analysis = self._analyze_single_call(email_content, refined_intent) or {}
+            self.save_steps(checkpoint, analysis)
+
+        # 1. Sender, 3. Urgency and 4. CRM summary are independent of each other
+        group = PromptGroup()
+        self.add_analysis_steps(group, email_content, intent=refined_intent, skip=analysis.keys(), checkpoint=checkpoint)
+        analysis.update(group.run())
+
+        extracted_info, entry = self._result(email_content, source_identifier, thread_id, refined_intent, analysis)
+        self._log_to_memory(**entry)
+        return extracted_info
+
+    @timed("agent")
+    async def aprocess(self, email_content: str, source_identifier: str, thread_id: str,
+                       initial_intent: str = "Unknown", prefetched: dict = None, checkpoint=None):
+        """Async `process`: the LLM steps run as tasks on the caller's event loop."""
+        print(f"EmailAgent processing: {source_identifier} (Intent: {initial_intent})")
+        analysis = {k: v for k, v in (prefetched or {}).items() if v}
+        analysis.update(self.checkpointed_steps(checkpoint))
+        if self.single_call and not analysis:
+            analysis = await self._aanalyze_single_call(email_content, initial_intent) or {}
+            self.save_steps(checkpoint, analysis)
+        group = PromptGroup()
+        self.add_analysis_steps(group, email_content, intent=initial_intent, skip=analysis.keys(), use_async=True,
+                                checkpoint=checkpoint)
+        analysis.update(await group.arun())
+
+        extracted_info, entry = self._result(email_content, source_identifier, thread_id, initial_intent, analysis)
+        await self._alog_to_memory(**entry)
+        return extracted_info
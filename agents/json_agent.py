@@ -1,70 +1,59 @@
 # agents/json_agent.py
 from .base_agent import BaseAgent
 from utils.llm_utils import call_gemini
+from utils.metrics import timed
+from utils.schema_validation import compile_schemas
+from utils.json_stream import preview_document
 
 class JSONAgent(BaseAgent):
-    def __init__(self):
-        super().__init__("JSONAgent")
+    def __init__(self, memory=None):
+        super().__init__("JSONAgent", memory=memory)
         self.target_schemas = {
             "Invoice": {
                 "required_fields": ["invoice_id", "customer_name", "total_amount", "items"],
                 "optional_fields": ["due_date", "invoice_date"],
-                "item_schema": {"name": str, "quantity": int, "unit_price": float}
+                "field_types": {"total_amount": {"type": float, "min": 0}},
+                "item_schema": {
+                    "name": str,
+                    "quantity": {"type": int, "min": 0},
+                    "unit_price": {"type": float, "min": 0}
+                },
+                "total_check": {"total_field": "total_amount", "quantity": "quantity", "unit_price": "unit_price"}
             },
             "RFQ": {
                 "required_fields": ["rfq_id", "product_description", "quantity_needed"],
-                "optional_fields": ["deadline", "contact_person"]
+                "optional_fields": ["deadline", "contact_person"],
+                "field_types": {"quantity_needed": {"type": int, "min": 1}}
             }
         }
+        self.refresh_validators()
 
-    def _validate_and_reformat(self, data: dict, intent: str) -> (dict, list):
-        schema = self.target_schemas.get(intent)
-        if not schema:
-            return data, [f"No specific schema defined for intent '{intent}'. Passing through data."]
-        reformatted_data = {}
-        anomalies = []
-        for field in schema["required_fields"]:
-            if field in data:
-                reformatted_data[field] = data[field]
-            else:
-                anomalies.append(f"Missing required field: {field}")
-        for field in schema.get("optional_fields", []):
-            if field in data:
-                reformatted_data[field] = data[field]
-        if intent == "Invoice" and "items" in reformatted_data:
-            if not isinstance(reformatted_data["items"], list):
-                anomalies.append("Field 'items' should be a list.")
-            else:
-                for i, item in enumerate(reformatted_data["items"]):
-                    if not isinstance(item, dict):
-                        anomalies.append(f"Item at index {i} is not a dictionary.")
-                        continue
-                    for key, item_type in schema["item_schema"].items():
-                        if key not in item:
-                            anomalies.append(f"Item at index {i} missing field: {key}")
-                        elif not isinstance(item[key], item_type):
-                            anomalies.append(f"Item at index {i}, field '{key}': Expected type {item_type.__name__}, got {type(item[key]).__name__}")
-        for key in data:
-            if key not in reformatted_data:
-                reformatted_data[key] = data[key]
-                anomalies.append(f"Unexpected field found: {key} (included as-is)")
-        if not anomalies and not reformatted_data:
-             anomalies.append("Input JSON does not match any fields in the target schema.")
-        return reformatted_data, anomalies
+    def refresh_validators(self):
+        """Compiles target_schemas into validators; call again after editing the schemas."""
+        self.validators = compile_schemas(self.target_schemas)
 
-    def process(self, data: dict, source_identifier: str, thread_id: str, initial_intent: str = "Unknown"):
-        print(f"JSONAgent processing: {source_identifier} for intent: {initial_intent}")
-        reformatted_data, anomalies = self._validate_and_reformat(data, initial_intent)
+    def _validate_and_reformat(self, data: dict, intent: str) -> (dict, list, dict):
+        validator = self.validators.get(intent)
+        if not validator:
+            return data, [f"No specific schema defined for intent '{intent}'. Passing through data."], {}
+        result = validator.validate(data)
+        return result.data, result.anomalies, result.derived
+
+    def _result(self, data: dict, source_identifier: str, thread_id: str, initial_intent: str):
+        """(extracted_info, memory entry fields) for a validated payload."""
+        reformatted_data, anomalies, derived_totals = self._validate_and_reformat(data, initial_intent)
         if anomalies:
             print(f"Anomalies found in JSON for {source_identifier}: {anomalies}")
             reformatted_data["_anomalies"] = anomalies
         extracted_info = {
-            "original_data_preview": {k: str(v)[:100] + '...' if len(str(v)) > 100 else v for k, v in data.items()},
+            "original_data_preview": preview_document(data),
             "reformatted_data": reformatted_data,
             "schema_applied": initial_intent,
             "anomalies_detected": anomalies if anomalies else "None"
         }
-        self._log_to_memory(
+        if derived_totals:
+            extracted_info["derived_totals"] = derived_totals
+        entry = dict(
             source_identifier=source_identifier,
             source_type="json_payload",
             classified_format="JSON",
@@ -73,4 +62,22 @@ class JSONAgent(BaseAgent):
             thread_id=thread_id,
             notes="Processed by JSONAgent."
         )
-        return extracted_info
\ No newline at end of file
+        return extracted_info, entry
+
+    @timed("agent")
+    def process(self, data: dict, source_identifier: str, thread_id: str, initial_intent: str = "Unknown"):
+        print(f"JSONAgent processing: {source_identifier} for intent: {initial_intent}")
+        extracted_info, entry = self._result(data, source_identifier, thread_id, initial_intent)
+        self._log_to_memory(**entry)
+        return extracted_info
+
+    @timed("agent")
+    async def aprocess(self, data: dict, source_identifier: str, thread_id: str, initial_intent: str = "Unknown"):
+        """Async `process`. Validation makes no LLM calls but is CPU-bound on large payloads,
+        so it runs on a worker thread instead of the event loop."""
+        import asyncio
+        print(f"JSONAgent processing: {source_identifier} for intent: {initial_intent}")
+        extracted_info, entry = await asyncio.to_thread(self._result, data, source_identifier, thread_id,
+                                                        initial_intent)
+        await self._alog_to_memory(**entry)
+        return extracted_info
@@ -0,0 +1,89 @@
+# benchmarks/bench_import_time.py
+"""Measures cold-start cost: `python -X importtime` of the agent modules, wall time of a fresh
+interpreter importing them, and optionally the first ClassifierAgent() with the offline model.
+Exits non-zero when the median import time is above the target, so it can guard CI.
+
+Usage: python -m benchmarks.bench_import_time [--module agents.classifier_agent] [--runs 5]
+                                              [--target-ms 250] [--top 15] [--construct]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Cold-start target for importing the agents: no SDK import, no API key check, no store load.
+DEFAULT_TARGET_MS = 250.0
+CONSTRUCT_SNIPPET = "from agents.classifier_agent import ClassifierAgent; ClassifierAgent()"
+
+
+def _env(workdir: str) -> dict:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    env["LLM_BACKEND"] = "fake" # The import must not need credentials
+    env["MEMORY_STORE_PATH"] = os.path.join(workdir, "memory.d") # Keep the repo's store untouched
+    env.pop("GOOGLE_API_KEY", None)
+    return env
+
+
+def parse_importtime(stderr: str) -> list:
+    """[(cumulative_us, self_us, module)] from -X importtime output."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, module = (part.strip() for part in line[len("import time:"):].split("|"))
+        rows.append((int(cumulative_us), int(self_us), module))
+    return rows
+
+
+def importtime_profile(module: str, workdir: str) -> list:
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=workdir, env=_env(workdir), capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+    return parse_importtime(result.stderr)
+
+
+def wall_time_ms(code: str, workdir: str) -> float:
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", code], cwd=workdir, env=_env(workdir),
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--module", default="agents.classifier_agent")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--target-ms", type=float, default=DEFAULT_TARGET_MS,
+                        help="Maximum median import time (fresh interpreter, including startup)")
+    parser.add_argument("--top", type=int, default=15, help="Slowest imports to list")
+    parser.add_argument("--construct", action="store_true", help="Also time the first ClassifierAgent()")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bench_import_") as workdir:
+        rows = importtime_profile(args.module, workdir)
+        total_us = next((c for c, _, m in rows if m.strip() == args.module), max(c for c, _, _ in rows))
+        print(f"-X importtime: {args.module} cumulative {total_us / 1000:.1f} ms; slowest imports (self time):")
+        for cumulative_us, self_us, module in sorted(rows, reverse=True, key=lambda r: r[1])[:args.top]:
+            print(f"  {self_us / 1000:8.1f} ms self {cumulative_us / 1000:8.1f} ms cumulative  {module.strip()}")
+
+        baseline = statistics.median(wall_time_ms("pass", workdir) for _ in range(args.runs))
+        imports = statistics.median(wall_time_ms(f"import {args.module}", workdir) for _ in range(args.runs))
+        print(f"\nFresh interpreter: {baseline:.1f} ms bare, {imports:.1f} ms with `import {args.module}` "
+              f"(median of {args.runs})")
+        if args.construct:
+            construct = statistics.median(wall_time_ms(CONSTRUCT_SNIPPET, workdir) for _ in range(args.runs))
+            print(f"Import + first ClassifierAgent(): {construct:.1f} ms")
+
+    within = imports <= args.target_ms
+    print(f"Target {args.target_ms:.0f} ms: {'OK' if within else 'EXCEEDED'}")
+    sys.exit(0 if within else 1)
+
+
+if __name__ == "__main__":
+    main()
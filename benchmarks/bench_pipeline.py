@@ -0,0 +1,335 @@
+# benchmarks/bench_pipeline.py
+"""Offline benchmarks of the full pipeline (ClassifierAgent -> EmailAgent/JSONAgent -> SharedMemory)
+against the fake Gemini backend, on a seeded synthetic corpus (benchmarks/corpus.py).
+
+Scenarios:
+  single  per-document latency by kind and size, plus the per-stage breakdown from utils.metrics
+  batch   process_batch throughput at several concurrency levels
+  async   aprocess_batch throughput (one event loop, no worker threads) at the same levels
+  memory  RSS and SharedMemory working set while processing a long stream of documents
+  imap    drain time of a burst of messages through EmailIngestor and FakeMailbox
+
+Results are written as JSON; --compare reports headline metrics that regressed against an
+earlier results file (exit status 1).
+
+Usage: python -m benchmarks.bench_pipeline [--scenarios single batch async memory imap] [--docs 100]
+           [--latency lognormal:0.3,0.5] [--error-rate 0.02] [--output results.json] [--compare baseline.json]
+"""
+import argparse
+import asyncio
+import contextlib
+import datetime
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Offline and uncached by default: every document pays for its LLM calls
+os.environ.setdefault("LLM_BACKEND", "fake")
+os.environ.setdefault("LLM_CACHE_ENABLED", "0")
+# The stub model has no quota; the client-side limiter would only measure its own pacing
+os.environ.setdefault("GEMINI_REQUESTS_PER_MINUTE", "0")
+os.environ.setdefault("GEMINI_TOKENS_PER_MINUTE", "0")
+
+from agents.classifier_agent import ClassifierAgent
+from benchmarks.corpus import generate_corpus, raw_email_messages
+from memory.shared_memory import SharedMemory
+from memory.storage import create_storage
+from utils import llm_utils
+from utils.fake_model import FakeGenerativeModel, pipeline_responses
+from utils.metrics import metrics
+
+SCENARIOS = ("single", "batch", "async", "memory", "imap")
+
+
+def _percentiles(samples: list) -> dict:
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {
+        "count": len(ordered),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3),
+        "p50_ms": round(pick(0.5) * 1000, 3),
+        "p95_ms": round(pick(0.95) * 1000, 3),
+        "p99_ms": round(pick(0.99) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+def _rss_kb() -> int:
+    """Current resident set size (Linux /proc), falling back to the peak from getrusage."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class Bench:
+    """Shared setup: the fake model configuration, a scratch directory and fresh pipelines."""
+
+    def __init__(self, args, workdir: str):
+        self.args = args
+        self.workdir = workdir
+        self.model = None
+        self._stores = 0
+
+    def install_model(self, latency=None) -> FakeGenerativeModel:
+        self.model = FakeGenerativeModel(responses=pipeline_responses, seed=self.args.seed, keep_calls=False,
+                                         latency=self.args.latency if latency is None else latency,
+                                         error_rate=self.args.error_rate)
+        llm_utils.set_model(self.model)
+        return self.model
+
+    def classifier(self) -> ClassifierAgent:
+        """A ClassifierAgent over an empty store of its own, so scenarios do not share history."""
+        self._stores += 1
+        path = os.path.join(self.workdir, f"store-{self._stores}" + (".db" if self.args.backend == "sqlite" else ""))
+        memory = SharedMemory(storage=create_storage(self.args.backend, path), legacy_file=None)
+        return ClassifierAgent(memory=memory)
+
+    def corpus(self, count: int, name: str) -> list:
+        return generate_corpus(os.path.join(self.workdir, name), count, seed=self.args.seed)
+
+    @staticmethod
+    def batch_item(entry: dict) -> dict:
+        # Text files are passed as content (as main.py does); JSON and PDF files by path
+        if entry["path"].endswith(".txt"):
+            with open(entry["path"], "r", encoding="utf-8") as f:
+                input_data = f.read()
+        else:
+            input_data = entry["path"]
+        return {"input_data": input_data, "source_identifier": os.path.basename(entry["path"]),
+                "source_type": entry["source_type"]}
+
+
+def scenario_single(bench: Bench) -> dict:
+    manifest = bench.corpus(bench.args.docs, "single")
+    model = bench.install_model()
+    classifier = bench.classifier()
+    metrics.reset()
+    by_group, durations, failures = {}, [], 0
+    for entry in manifest:
+        started = time.perf_counter()
+        thread_id, _ = classifier.process(**bench.batch_item(entry))
+        elapsed = time.perf_counter() - started
+        durations.append(elapsed)
+        failures += thread_id is None
+        by_group.setdefault(f"{entry['kind']}/{entry['size']}", []).append(elapsed)
+    classifier.memory.save_to_file()
+    overall = _percentiles(durations)
+    return {
+        "documents": len(manifest),
+        "failures": failures,
+        "llm_calls": model.call_count,
+        "injected_errors": model.injected_errors,
+        "overall": overall,
+        "by_kind": {group: _percentiles(samples) for group, samples in sorted(by_group.items())},
+        "stages": metrics.stage_summary(),
+        "summary": {"p50_ms": overall["p50_ms"], "p95_ms": overall["p95_ms"], "p99_ms": overall["p99_ms"]},
+    }
+
+
+def scenario_batch(bench: Bench, use_async: bool = False) -> dict:
+    manifest = bench.corpus(bench.args.docs, "batch")
+    items = [bench.batch_item(entry) for entry in manifest]
+    runs, summary = [], {}
+    for concurrency in bench.args.concurrency:
+        model = bench.install_model()
+        classifier = bench.classifier()
+        started = time.perf_counter()
+        if use_async:
+            outcomes = asyncio.run(classifier.aprocess_batch(iter(items), max_concurrency=concurrency))
+        else:
+            outcomes = classifier.process_batch(iter(items), max_concurrency=concurrency)
+        elapsed = time.perf_counter() - started
+        classifier.memory.save_to_file()
+        failures = sum(1 for thread_id, _ in outcomes if thread_id is None)
+        runs.append({
+            "concurrency": concurrency,
+            "documents": len(items),
+            "seconds": round(elapsed, 3),
+            "docs_per_s": round(len(items) / elapsed, 2),
+            "failures": failures,
+            "llm_calls": model.call_count,
+        })
+        summary[f"c{concurrency}_docs_per_s"] = runs[-1]["docs_per_s"]
+    return {"runs": runs, "summary": summary}
+
+
+def scenario_async(bench: Bench) -> dict:
+    return scenario_batch(bench, use_async=True)
+
+
+def scenario_memory(bench: Bench) -> dict:
+    # Distinct documents (no PDFs, whose extraction dominates otherwise), so dedup never
+    # short-circuits; latency only stretches this run, growth depends on the document count
+    total = bench.args.memory_docs
+    manifest = generate_corpus(os.path.join(bench.workdir, "memory"), total, seed=bench.args.seed,
+                               kinds=("rfq", "complaint", "regulation", "invoice"))
+    bench.install_model(latency=0)
+    classifier = bench.classifier()
+    checkpoints = []
+    started = time.perf_counter()
+    baseline_rss = _rss_kb()
+
+    def record(completed, index, source_identifier, outcome):
+        if completed % max(1, total // 10) == 0:
+            usage = classifier.memory.memory_usage()
+            checkpoints.append({"documents": completed, "seconds": round(time.perf_counter() - started, 3),
+                                "rss_kb": _rss_kb(), "log_entries": usage["entries"],
+                                "resident_entries": usage["resident_entries"],
+                                "resident_kb": usage["resident_bytes"] // 1024})
+
+    classifier.process_batch((bench.batch_item(entry) for entry in manifest), max_concurrency=4,
+                             progress_callback=record, keep_results=False)
+    classifier.memory.save_to_file()
+    first, last = checkpoints[0], checkpoints[-1]
+    span_docs = max(1, last["documents"] - first["documents"])
+    growth = (last["rss_kb"] - first["rss_kb"]) * 1000 / span_docs
+    return {
+        "documents": total,
+        "baseline_rss_kb": baseline_rss,
+        "cache_capacity": classifier.memory.cache_entries,
+        "checkpoints": checkpoints,
+        "rss_growth_kb_per_1000_docs": round(growth, 1),
+        "summary": {"rss_growth_kb_per_1000_docs": round(growth, 1), "peak_rss_kb": max(c["rss_kb"] for c in checkpoints)},
+    }
+
+
+def scenario_imap(bench: Bench) -> dict:
+    try:
+        from email_automation_service import EmailIngestor, UIDCheckpoint
+    except ImportError as e: # The service needs python-dotenv
+        return {"skipped": f"email_automation_service not importable: {e}", "summary": {}}
+    from utils.fake_imap import FakeMailbox
+
+    messages = raw_email_messages(bench.args.imap_messages, seed=bench.args.seed)
+    model = bench.install_model()
+    mailbox = FakeMailbox(fetch_latency=bench.args.fetch_latency)
+    for raw in messages:
+        mailbox.deliver(raw)
+    ingestor = EmailIngestor(mailbox, bench.classifier(), UIDCheckpoint(os.path.join(bench.workdir, "checkpoint.json")),
+                             workers=bench.args.imap_workers)
+    ingestor.start()
+    started = time.perf_counter()
+    ingestor.drain_once()
+    enqueued_at = time.perf_counter() - started
+    ingestor.queue.join() # Every queued message has been processed
+    elapsed = time.perf_counter() - started
+    ingestor.stop()
+    ingestor.classifier.memory.save_to_file()
+    return {
+        "messages": len(messages),
+        "workers": bench.args.imap_workers,
+        "processed": ingestor.processed,
+        "failed": ingestor.failed,
+        "fetch_calls": mailbox.fetch_calls,
+        "enqueue_seconds": round(enqueued_at, 3),
+        "drain_seconds": round(elapsed, 3),
+        "messages_per_s": round(len(messages) / elapsed, 2),
+        "llm_calls": model.call_count,
+        "summary": {"messages_per_s": round(len(messages) / elapsed, 2)},
+    }
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Headline metrics that got worse by more than `tolerance` (relative). Metrics ending in
+    _per_s are better when higher, all others when lower."""
+    regressions = []
+    for name, scenario in results["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name, {}).get("summary", {})
+        for metric, value in scenario.get("summary", {}).items():
+            old = before.get(metric)
+            if not isinstance(old, (int, float)) or not isinstance(value, (int, float)) or old == 0:
+                continue
+            change = (value - old) / abs(old)
+            worse = -change if metric.endswith("_per_s") else change
+            status = "REGRESSION" if worse > tolerance else "ok"
+            print(f"{name:<8} {metric:<32} {old:>12} -> {value:<12} {change:+.1%}  {status}")
+            if worse > tolerance:
+                regressions.append(f"{name}.{metric}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=SCENARIOS)
+    parser.add_argument("--docs", type=int, default=100, help="corpus size for single and batch")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency", default="lognormal:0.05,0.5",
+                        help="fake LLM latency per call (see utils.fake_model.latency_distribution)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of LLM calls failing with 429/503")
+    parser.add_argument("--retry-base-delay", type=float, default=0.05,
+                        help="backoff base in seconds for injected errors (production default is 1.0)")
+    parser.add_argument("--backend", choices=["jsonl", "sqlite"], default="jsonl")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--memory-docs", type=int, default=2000)
+    parser.add_argument("--imap-messages", type=int, default=200)
+    parser.add_argument("--imap-workers", type=int, default=4)
+    parser.add_argument("--fetch-latency", type=float, default=0.02, help="simulated IMAP round trip in seconds")
+    parser.add_argument("--output", help="write results JSON here")
+    parser.add_argument("--compare", help="earlier results JSON to compare headline metrics against")
+    parser.add_argument("--tolerance", type=float, default=0.10)
+    parser.add_argument("--verbose", action="store_true", help="show pipeline output")
+    args = parser.parse_args()
+
+    llm_utils.retry_policy.base_delay = args.retry_base_delay
+    runners = {"single": scenario_single, "batch": scenario_batch, "async": scenario_async, "memory": scenario_memory,
+               "imap": scenario_imap}
+    results = {
+        "meta": {
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "git_revision": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": vars(args),
+        },
+        "scenarios": {},
+    }
+    workdir = tempfile.mkdtemp(prefix="bench_pipeline_")
+    try:
+        bench = Bench(args, workdir)
+        for name in args.scenarios:
+            print(f"Running {name}...", flush=True)
+            started = time.perf_counter()
+            with open(os.devnull, "w") as devnull, \
+                    contextlib.redirect_stdout(sys.stdout if args.verbose else devnull):
+                results["scenarios"][name] = runners[name](bench)
+            result = results["scenarios"][name]
+            print(f"  {round(time.perf_counter() - started, 1)}s  "
+                  f"{result.get('skipped') or json.dumps(result['summary'])}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"Regressed beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+# benchmarks/bench_shared_memory.py
+"""Times SharedMemory.add_entry against each storage backend at growing history sizes,
+and reports the resident working set, which should stay flat as the history grows, and the
+size on disk. The "plain" columns are the same entries held as dicts and stored as JSON lines
+(the layout before MemoryRecord), estimated from the resident sample.
+
+The entries replayed are those the agents write for a generated corpus (benchmarks/corpus.py),
+processed offline with the stub model, so their content shares nothing with the payload
+compression dictionary. A payload table compares the codecs on them.
+
+Usage: python -m benchmarks.bench_shared_memory [--sizes 10000 100000 1000000] [--backends jsonl sqlite]
+                                                [--corpus-docs 200]
+"""
+import argparse
+import contextlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# The corpus is processed offline and uncached, without client-side rate limits
+os.environ.setdefault("LLM_BACKEND", "fake")
+os.environ.setdefault("LLM_CACHE_ENABLED", "0")
+os.environ.setdefault("FAKE_LLM_RESPONSES", "pipeline")
+os.environ.setdefault("GEMINI_REQUESTS_PER_MINUTE", "0")
+os.environ.setdefault("GEMINI_TOKENS_PER_MINUTE", "0")
+
+from benchmarks.corpus import generate_corpus
+from memory.record import PAYLOAD_DICTIONARY, encode_payload
+from memory.shared_memory import SharedMemory, _deep_sizeof
+from memory.storage import create_storage
+
+
+def disk_bytes(path: str) -> int:
+    """Size of a store: every file of a JSONL directory, or a SQLite file with its WAL."""
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+    return sum(os.path.getsize(p) for p in (path, path + "-wal") if os.path.exists(p))
+
+
+ENTRY_KEYS = ("source_type", "classified_format", "classified_intent", "agent_processed", "extracted_data", "notes")
+
+
+def corpus_entries(count: int, workdir: str) -> list:
+    """Fields of every memory entry written while processing `count` corpus documents."""
+    from agents.classifier_agent import ClassifierAgent
+    corpus_dir = os.path.join(workdir, "corpus")
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        memory = SharedMemory(storage=create_storage("jsonl", os.path.join(workdir, "corpus-store")), legacy_file=None)
+        classifier = ClassifierAgent(memory=memory)
+        for document in generate_corpus(corpus_dir, count):
+            path = document["path"]
+            if path.endswith(".txt"):
+                with open(path, 'r', encoding='utf-8') as f:
+                    classifier.process(f.read(), path, document["source_type"])
+            else:
+                classifier.process(path, path, document["source_type"])
+        entries = [{key: entry[key] for key in ENTRY_KEYS} for entry in memory.log]
+    memory.storage.close()
+    return entries
+
+
+def _deflate(raw: bytes, dictionary: bytes = None) -> int:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15, **({"zdict": dictionary} if dictionary else {}))
+    return len(compressor.compress(raw) + compressor.flush())
+
+
+def payload_sizes(entries: list) -> dict:
+    """Total extracted_data bytes as compact JSON, deflated without and with the
+    payload dictionary, and as encode_payload stores them."""
+    raws = [json.dumps(e["extracted_data"] or {}, ensure_ascii=False, separators=(",", ":")).encode('utf-8')
+            for e in entries]
+    return {
+        "json": sum(map(len, raws)),
+        "zlib": sum(_deflate(raw) for raw in raws),
+        "zlib_dict": sum(_deflate(raw, PAYLOAD_DICTIONARY) for raw in raws),
+        "stored": sum(len(encode_payload(e["extracted_data"])) for e in entries),
+    }
+
+
+def run(backend: str, size: int, workdir: str, entries: list) -> dict:
+    path = os.path.join(workdir, f"{backend}-{size}") + (".db" if backend == "sqlite" else "")
+    storage = create_storage(backend, path)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        memory = SharedMemory(storage=storage, legacy_file=None)
+        checkpoints = {}
+        start = time.perf_counter()
+        window_start = start
+        for i in range(1, size + 1):
+            memory.add_entry(source_identifier=f"document_{i}", thread_id=None, **entries[i % len(entries)])
+            if i % (size // 10 or 1) == 0:
+                now = time.perf_counter()
+                checkpoints[i] = (now - window_start) / (size // 10 or 1)
+                window_start = now
+        memory.save_to_file()
+        total = time.perf_counter() - start
+        usage = memory.memory_usage()
+        sample = memory.get_entries(range(max(0, size - usage["resident_entries"]), size))
+    storage.close()
+    plain_resident = sum(_deep_sizeof(entry) for entry in sample)
+    plain_disk = sum(len(json.dumps(entry, ensure_ascii=False).encode('utf-8')) + 1 for entry in sample)
+    return {
+        "backend": backend,
+        "entries": size,
+        "total_seconds": round(total, 3),
+        "mean_add_entry_us": round(total / size * 1e6, 2),
+        # Per-entry cost in the last tenth of the run; stays flat if writes are O(1).
+        "tail_add_entry_us": round(checkpoints[max(checkpoints)] * 1e6, 2),
+        "resident_entries": usage["resident_entries"],
+        "resident_kb": round(usage["resident_bytes"] / 1024),
+        "locator_kb": round(usage["locator_bytes"] / 1024),
+        "plain_resident_kb": round(plain_resident / 1024),
+        "disk_kb": round(disk_bytes(path) / 1024),
+        "plain_disk_kb": round(plain_disk / len(sample) * size / 1024),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--backends", nargs="+", default=["jsonl", "sqlite"])
+    parser.add_argument("--corpus-docs", type=int, default=200, help="corpus documents whose entries are replayed")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_shared_memory_")
+    try:
+        entries = corpus_entries(args.corpus_docs, workdir)
+        sizes = payload_sizes(entries)
+        print(f"{len(entries)} entries from {args.corpus_docs} corpus documents; extracted_data bytes: " +
+              ", ".join(f"{name} {total} ({sizes['json'] / total:.2f}x)" for name, total in sizes.items()))
+        print(f"{'backend':<8} {'entries':>10} {'total s':>10} {'mean us':>10} {'tail us':>10} "
+              f"{'resident':>10} {'res. KB':>10} {'plain KB':>10} {'loc. KB':>10} {'disk KB':>10} {'plain KB':>10}")
+        for backend in args.backends:
+            for size in args.sizes:
+                r = run(backend, size, workdir, entries)
+                print(f"{r['backend']:<8} {r['entries']:>10} {r['total_seconds']:>10} "
+                      f"{r['mean_add_entry_us']:>10} {r['tail_add_entry_us']:>10} "
+                      f"{r['resident_entries']:>10} {r['resident_kb']:>10} {r['plain_resident_kb']:>10} "
+                      f"{r['locator_kb']:>10} {r['disk_kb']:>10} {r['plain_disk_kb']:>10}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+# benchmarks/corpus.py
+"""Synthetic corpus for pipeline benchmarks, modelled on sample_inputs/: RFQ and complaint
+emails (optionally with quoted replies and signatures), regulation notices, JSON invoices
+with a varying number of items, and text PDFs with a varying number of pages.
+Generation is seeded, so the same arguments always produce the same files.
+
+Usage: python -m benchmarks.corpus --out /tmp/corpus [--count 50] [--seed 0]
+"""
+import argparse
+import json
+import os
+import random
+
+FIRST_NAMES = ["John", "Jane", "Priya", "Carlos", "Mei", "Olu", "Anna", "Tom", "Sara", "Ivan"]
+LAST_NAMES = ["Doe", "Smith", "Patel", "Garcia", "Chen", "Adeyemi", "Novak", "Brown", "Khan", "Petrov"]
+COMPANIES = ["ABC Corp", "Tech Solutions Ltd.", "Northwind Traders", "Globex", "Initech", "Umbrella Supplies"]
+PRODUCTS = ["Model X Widgets", "Cloud Server Hosting - Basic", "Domain Registration (.com)", "Steel Brackets",
+            "USB-C Docking Stations", "Industrial Sensors", "Office Chairs", "Safety Gloves"]
+FILLER = ("We have reviewed the documentation you shared last quarter and discussed it with the wider team. "
+          "Several colleagues raised questions about onboarding, support hours and the reporting format. "
+          "Our finance department also asked whether consolidated billing across sites would be possible. "
+          "We would appreciate a short call to walk through the remaining open points next week. ").split(". ")
+
+# Size classes: extra body paragraphs for text, invoice line items, PDF pages
+SIZE_CLASSES = {
+    "small": {"paragraphs": 0, "items": 2, "pages": 1},
+    "medium": {"paragraphs": 6, "items": 40, "pages": 5},
+    "large": {"paragraphs": 40, "items": 2000, "pages": 30},
+}
+KINDS = ("rfq", "complaint", "regulation", "invoice", "pdf")
+
+
+def _person(rng: random.Random):
+    first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+    company = rng.choice(COMPANIES)
+    domain = company.lower().replace(" ", "").replace(".", "").replace(",", "") + ".com"
+    return f"{first} {last}", f"{first.lower()}.{last.lower()}@{domain}", company
+
+
+def _filler(rng: random.Random, paragraphs: int) -> str:
+    return "\n\n".join(". ".join(rng.sample(FILLER, 3)).strip() + "." for _ in range(paragraphs))
+
+
+def _quoted_reply(rng: random.Random, name: str, body: str) -> str:
+    quoted = "\n".join("> " + line for line in body.splitlines())
+    return f"On Mon, {rng.randint(1, 28)} Jun 2024, {name} wrote:\n{quoted}"
+
+
+def make_email(rng: random.Random, kind: str, size: str, index: int) -> str:
+    name, address, company = _person(rng)
+    product = rng.choice(PRODUCTS)
+    quantity = rng.choice([10, 50, 250, 1000, 5000])
+    if kind == "rfq":
+        subject = f"RFQ - Bulk Order of {product}"
+        body = (f"Dear Sales Team,\n\nWe are interested in placing a bulk order for your {product}.\n"
+                f"Could you please provide a quotation for {quantity} units?\n"
+                f"We would also like to know the estimated delivery time to Zip Code {rng.randint(10000, 99999)}.\n"
+                f"Our deadline for receiving quotes is {rng.choice(['next Friday, EOD', '2024-09-30', 'June 14th'])}.")
+    else:
+        order = rng.randint(10000, 99999)
+        subject = f"{rng.choice(['Urgent: ', ''])}Issue with recent order #{order}"
+        body = (f"Hi Support,\n\nI am writing to complain about my recent order #{order}. "
+                f"The {product} arrived damaged, and it's not functioning as expected.\n"
+                "This is extremely frustrating as I needed it for an important project.\n"
+                f"I demand a replacement or a full refund immediately! Please contact me on 555-{rng.randint(100, 999)}-{rng.randint(1000, 9999)}.")
+    extra = _filler(rng, SIZE_CLASSES[size]["paragraphs"])
+    signature = f"Regards,\n{name}\n{rng.choice(['Procurement Manager', 'Operations Lead', 'Customer'])}\n{company}"
+    text = f"From: {address}\nTo: {'sales' if kind == 'rfq' else 'support'}@mycompany.com\nSubject: {subject}\n\n{body}\n\n"
+    if extra:
+        text += extra + "\n\n"
+    text += f"{signature}\n-- \nThis email and any attachments are confidential. Ref {index}"
+    if size != "small":
+        text += "\n\n" + _quoted_reply(rng, "Sales Team", "Thank you for your interest.\nCould you share more details?")
+    return text
+
+
+def make_regulation(rng: random.Random, size: str, index: int) -> str:
+    year = rng.choice([2025, 2026])
+    hours = rng.choice([24, 48, 72])
+    text = (f"Subject: New Data Privacy Regulation Update - Notice {index}\n\n"
+            f"Effective January 1st, {year}, all companies handling EU citizen data must adhere to the updated "
+            f"General Data Protection Regulation (GDPR) addendum {rng.randint(1, 9)}.{rng.randint(0, 9)}.\n"
+            f"This includes stricter consent management protocols and mandatory data breach notifications within {hours} hours.\n"
+            f"Non-compliance can result in fines up to {rng.choice([2, 4])}% of global annual turnover.")
+    extra = _filler(rng, SIZE_CLASSES[size]["paragraphs"])
+    return text + ("\n\n" + extra if extra else "")
+
+
+def make_invoice(rng: random.Random, size: str, index: int) -> dict:
+    _, _, company = _person(rng)
+    items = [{"name": rng.choice(PRODUCTS), "quantity": rng.randint(1, 20),
+              "unit_price": round(rng.uniform(5, 500), 2)} for _ in range(SIZE_CLASSES[size]["items"])]
+    return {
+        "invoice_id": f"INV-2024-{index:05d}",
+        "customer_name": company,
+        "invoice_date": f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        "due_date": f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        "items": items,
+        "total_amount": round(sum(i["quantity"] * i["unit_price"] for i in items), 2),
+        "currency": rng.choice(["USD", "EUR"]),
+    }
+
+
+def _pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def make_pdf(pages: list) -> bytes:
+    """Minimal uncompressed PDF with one Helvetica text stream per page (list of line lists)."""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None,
+               b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for lines in pages:
+        commands = ["BT", "/F1 10 Tf", "13 TL", "50 780 Td"]
+        commands += [f"({_pdf_escape(line)}) Tj T*" for line in lines]
+        commands.append("ET")
+        stream = "\n".join(commands).encode("latin-1", "replace")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content_ref = len(objects)
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_ref)
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % k for k in kids), len(kids))
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def _wrap(text: str, width: int = 90) -> list:
+    lines = []
+    for paragraph in text.splitlines():
+        words, line = paragraph.split(), ""
+        for word in words:
+            if line and len(line) + len(word) + 1 > width:
+                lines.append(line)
+                line = word
+            else:
+                line = f"{line} {word}".strip()
+        lines.append(line)
+    return lines
+
+
+def make_pdf_document(rng: random.Random, size: str, index: int) -> bytes:
+    page_count = SIZE_CLASSES[size]["pages"]
+    first = make_regulation(rng, "small", index) if rng.random() < 0.5 else make_email(rng, "rfq", "small", index)
+    pages = [_wrap(first)] + [_wrap(_filler(rng, 8)) for _ in range(page_count - 1)]
+    return make_pdf(pages)
+
+
+def generate_corpus(out_dir: str, count: int = 50, seed: int = 0, kinds=KINDS,
+                    sizes=("small", "medium", "large"), size_weights=(0.7, 0.25, 0.05)) -> list:
+    """Writes `count` documents to `out_dir` and returns a manifest of dicts with path,
+    kind, size and source_type, in generation order."""
+    rng = random.Random(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = []
+    for index in range(count):
+        kind = kinds[index % len(kinds)]
+        size = rng.choices(sizes, weights=size_weights[:len(sizes)])[0]
+        if kind in ("rfq", "complaint"):
+            path, source_type = os.path.join(out_dir, f"{index:05d}_{kind}_{size}.txt"), "file_upload_text_email"
+            content = make_email(rng, kind, size, index).encode("utf-8")
+        elif kind == "regulation":
+            path, source_type = os.path.join(out_dir, f"{index:05d}_{kind}_{size}.txt"), "file_upload_text_document"
+            content = make_regulation(rng, size, index).encode("utf-8")
+        elif kind == "invoice":
+            path, source_type = os.path.join(out_dir, f"{index:05d}_{kind}_{size}.json"), "file_upload_json"
+            content = json.dumps(make_invoice(rng, size, index), indent=2).encode("utf-8")
+        elif kind == "pdf":
+            path, source_type = os.path.join(out_dir, f"{index:05d}_{kind}_{size}.pdf"), "file_upload_pdf"
+            content = make_pdf_document(rng, size, index)
+        else:
+            raise ValueError(f"Unknown document kind '{kind}'. Use one of: {', '.join(KINDS)}")
+        with open(path, "wb") as f:
+            f.write(content)
+        manifest.append({"path": path, "kind": kind, "size": size, "bytes": len(content), "source_type": source_type})
+    return manifest
+
+
+def raw_email_messages(count: int, seed: int = 0, sizes=("small", "medium")) -> list:
+    """RFC 822 bytes for IMAP burst scenarios (FakeMailbox.deliver)."""
+    rng = random.Random(seed)
+    messages = []
+    for index in range(count):
+        text = make_email(rng, rng.choice(["rfq", "complaint"]), rng.choice(sizes), index)
+        headers, _, body = text.partition("\n\n")
+        messages.append((headers.replace("\n", "\r\n") + "\r\nContent-Type: text/plain; charset=utf-8\r\n\r\n"
+                         + body.replace("\n", "\r\n")).encode("utf-8"))
+    return messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--out", required=True)
+    parser.add_argument("--count", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--kinds", nargs="+", default=list(KINDS), choices=KINDS)
+    args = parser.parse_args()
+    manifest = generate_corpus(args.out, args.count, args.seed, kinds=tuple(args.kinds))
+    with open(os.path.join(args.out, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    print(f"Wrote {len(manifest)} documents ({sum(m['bytes'] for m in manifest) // 1024} KB) to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
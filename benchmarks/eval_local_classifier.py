@@ -0,0 +1,96 @@
+# benchmarks/eval_local_classifier.py
+"""Measures how many intent LLM calls the local classifier tier avoids, and how often it agrees
+with the LLM, on a held-out split of the labelled SharedMemory history. Intents answered by the
+local tier never count as labels; entries written before intent_source was recorded were all
+classified by the LLM and are used.
+
+Usage: python -m benchmarks.eval_local_classifier [--log shared_memory_log.json] [--threshold 0.85]
+           [--tfidf-threshold 0.25]
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.json_agent import JSONAgent
+from memory.storage import create_storage
+from utils.local_classifier import LocalIntentClassifier, TfidfCentroidModel, history_examples, llm_labelled, \
+    LOCAL_CLASSIFIER_THRESHOLD, LOCAL_CLASSIFIER_TFIDF_THRESHOLD
+
+
+def load_entries(path: str) -> list:
+    if path.endswith(".json"):
+        with open(path, 'r') as f:
+            return json.load(f)
+    return create_storage("sqlite" if path.endswith(".db") else "jsonl", path).load_all()
+
+
+def labelled_samples(entries) -> list:
+    """(text, json_data, llm_intent, thread_id) for every agent entry with an LLM intent
+    (see llm_labelled)."""
+    samples = []
+    for entry in llm_labelled(entries):
+        data = entry.get("extracted_data") or {}
+        intent = entry.get("classified_intent")
+        if not intent:
+            continue
+        if entry.get("agent_processed") == "EmailAgent" and data.get("original_content_preview"):
+            samples.append((data["original_content_preview"], None, intent, entry["thread_id"]))
+        elif entry.get("agent_processed") == "JSONAgent" and isinstance(data.get("original_data_preview"), dict):
+            preview = data["original_data_preview"]
+            samples.append((json.dumps(preview), preview, intent, entry["thread_id"]))
+    return samples
+
+
+def in_holdout(thread_id: str, holdout_percent: int) -> bool:
+    # Split by thread so one document never lands on both sides
+    return int(hashlib.sha256(thread_id.encode()).hexdigest(), 16) % 100 < holdout_percent
+
+
+def evaluate(classifier: LocalIntentClassifier, samples) -> dict:
+    answered = agreed = 0
+    for text, data, llm_intent, _ in samples:
+        local_intent, _, _ = classifier.classify(text, data=data)
+        if local_intent:
+            answered += 1
+            agreed += local_intent == llm_intent
+    return {
+        "samples": len(samples),
+        "answered_locally": answered,
+        "llm_call_reduction": round(answered / len(samples), 4) if samples else 0.0,
+        "agreement_with_llm": round(agreed / answered, 4) if answered else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--log", default="shared_memory_log.json",
+                        help="Legacy JSON log, JSONL store directory or SQLite store")
+    parser.add_argument("--threshold", type=float, default=LOCAL_CLASSIFIER_THRESHOLD)
+    parser.add_argument("--tfidf-threshold", type=float, default=LOCAL_CLASSIFIER_TFIDF_THRESHOLD)
+    parser.add_argument("--holdout-percent", type=int, default=30)
+    args = parser.parse_args()
+
+    entries = load_entries(args.log)
+    samples = labelled_samples(entries)
+    train_threads = {e["thread_id"] for e in entries if not in_holdout(e["thread_id"], args.holdout_percent)}
+    holdout = [s for s in samples if s[3] not in train_threads]
+    examples = history_examples(e for e in entries if e["thread_id"] in train_threads)
+
+    schemas = JSONAgent().target_schemas
+    report = {"history_entries": len(entries), "llm_labelled_samples": len(samples), "train_examples": len(examples),
+              "threshold": args.threshold, "tfidf_threshold": args.tfidf_threshold,
+              "rules_only": evaluate(LocalIntentClassifier(schemas, threshold=args.threshold), holdout)}
+    if examples:
+        texts, labels = zip(*examples)
+        model = TfidfCentroidModel().fit(list(texts), list(labels))
+        report["rules_and_tfidf"] = evaluate(LocalIntentClassifier(schemas, model, threshold=args.threshold,
+                                                                   tfidf_threshold=args.tfidf_threshold), holdout)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
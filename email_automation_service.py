@@ -1,115 +1,356 @@
 import imaplib
 import email
-from email.header import decode_header
 import time
 import os
-from dotenv import load_dotenv
+import re
+import json
+import queue
+import selectors
+import threading
 from agents.classifier_agent import ClassifierAgent
-from memory.shared_memory import shared_memory_instance
+from utils.email_parse import decode_subject, fetch_email_body
+from utils.job_queue import JobQueue, JobWorker, JOB_QUEUE_PATH
+from utils.metrics import serve_metrics
 
-load_dotenv()
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except ImportError:
+    pass # python-dotenv is optional when the settings are already in the environment
 
 IMAP_SERVER = os.getenv("IMAP_SERVER")
 EMAIL_USER = os.getenv("EMAIL_AUTOMATION_USER")
 EMAIL_PASS = os.getenv("EMAIL_AUTOMATION_APP_PASSWORD")
 MAILBOX_TO_MONITOR = "INBOX"
-POLL_INTERVAL_SECONDS = 60
-
-classifier = ClassifierAgent()
-
-def decode_subject(msg):
-    subject_parts = decode_header(msg["Subject"])
-    subject = ""
-    for part, charset in subject_parts:
-        if isinstance(part, bytes):
-            subject += part.decode(charset if charset else 'utf-8', errors='ignore')
-        else:
-            subject += part
-    return subject
-
-def fetch_email_body(msg):
-    if msg.is_multipart():
-        for part in msg.walk():
-            content_type = part.get_content_type()
-            content_disposition = str(part.get("Content-Disposition"))
-            if "attachment" not in content_disposition:
-                if content_type == "text/plain":
-                    try:
-                        return part.get_payload(decode=True).decode(part.get_content_charset() or 'utf-8', errors='ignore')
-                    except:
-                        pass
-                elif content_type == "text/html":
-                    try:
-                        html_body = part.get_payload(decode=True).decode(part.get_content_charset() or 'utf-8', errors='ignore')
-                        return html_body
-                    except:
-                        pass
-    else:
-        if msg.get_content_type() == "text/plain":
-            try:
-                return msg.get_payload(decode=True).decode(msg.get_content_charset() or 'utf-8', errors='ignore')
-            except:
-                return "Could not decode plain text body."
-    return "No suitable text body found."
-
-def process_new_emails(mail):
-    status, messages = mail.search(None, 'UNSEEN')
-    if status != 'OK':
-        print("Error searching for emails.")
-        return
-    email_ids = messages[0].split()
-    print(f"Found {len(email_ids)} new email(s).")
-    for email_id in email_ids:
-        print(f"\nFetching email ID: {email_id.decode()}")
-        status, msg_data = mail.fetch(email_id, '(RFC822)')
+POLL_INTERVAL_SECONDS = 60 # Used when the server does not support IDLE
+IDLE_TIMEOUT_SECONDS = 300 # Re-issue IDLE well before the 29 minute limit of RFC 2177
+RECONNECT_DELAY_SECONDS = 30
+FETCH_BATCH_SIZE = int(os.getenv("EMAIL_FETCH_BATCH_SIZE", "25"))
+CLASSIFIER_MAX_CONCURRENCY = int(os.getenv("CLASSIFIER_MAX_CONCURRENCY", "4"))
+CHECKPOINT_FILE = os.getenv("EMAIL_CHECKPOINT_FILE", "email_checkpoint.json")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0")) # Prometheus scrape endpoint; 0 disables it
+
+class IMAPMailbox:
+    """A long-lived IMAP connection exposing the few UID-based operations the ingestor needs.
+    utils/fake_imap.FakeMailbox implements the same interface for local testing."""
+
+    _UID_RE = re.compile(rb"UID (\d+)")
+
+    def __init__(self, server: str, user: str, password: str, mailbox: str = "INBOX"):
+        self.server = server
+        self.user = user
+        self.password = password
+        self.mailbox = mailbox
+        self.conn = None
+        self.uidvalidity = None
+
+    def connect(self):
+        self.conn = imaplib.IMAP4_SSL(self.server)
+        self.conn.login(self.user, self.password)
+        status, data = self.conn.select(self.mailbox)
         if status != 'OK':
-            print(f"Error fetching email ID {email_id.decode()}")
-            continue
-        for response_part in msg_data:
-            if isinstance(response_part, tuple):
-                msg = email.message_from_bytes(response_part[1])
-                subject = decode_subject(msg)
-                sender = msg.get("From")
-                body = fetch_email_body(msg)
-                print(f"  From: {sender}")
-                print(f"  Subject: {subject}")
-                print(f"  Body Preview: {body[:100]}...")
-                email_content_for_classification = f"Subject: {subject}\n\nFrom: {sender}\n\n{body}"
-                source_identifier = f"Email: {subject} (from {sender})"
-                try:
-                    thread_id, result = classifier.process(
-                        input_data=email_content_for_classification,
-                        source_identifier=source_identifier,
-                        source_type="automated_email_ingestion"
-                    )
-                    print(f"  Processed by system. Thread ID: {thread_id}")
-                except Exception as e:
-                    print(f"  Error processing email with ClassifierAgent: {e}")
+            raise imaplib.IMAP4.error(f"Could not select mailbox {self.mailbox}: {data}")
+        _, uidvalidity = self.conn.response('UIDVALIDITY')
+        self.uidvalidity = int(uidvalidity[0]) if uidvalidity and uidvalidity[0] else None
+
+    @property
+    def supports_idle(self) -> bool:
+        return self.conn is not None and 'IDLE' in self.conn.capabilities
+
+    def search_uids(self, after_uid: int = None) -> list:
+        """UIDs of unseen messages (first run) or of every message after `after_uid`."""
+        criteria = ('UNSEEN',) if after_uid is None else ('UID', f'{after_uid + 1}:*')
+        status, data = self.conn.uid('search', None, *criteria)
+        if status != 'OK':
+            raise imaplib.IMAP4.error(f"UID search failed: {data}")
+        uids = sorted(int(u) for u in data[0].split())
+        # "n:*" always matches the highest UID, even when it is below n
+        return [u for u in uids if after_uid is None or u > after_uid]
+
+    def fetch(self, uids: list) -> list:
+        """Fetches a batch of messages in one round trip. Returns [(uid, raw_bytes), ...]."""
+        status, data = self.conn.uid('fetch', ','.join(str(u) for u in uids), '(UID RFC822)')
+        if status != 'OK':
+            raise imaplib.IMAP4.error(f"UID fetch failed: {data}")
+        messages = []
+        for part in data:
+            if isinstance(part, tuple):
+                match = self._UID_RE.search(part[0])
+                if match:
+                    messages.append((int(match.group(1)), part[1]))
+        return sorted(messages)
+
+    def wait_for_changes(self, timeout: float) -> bool:
+        """Blocks until the server reports new mail (IDLE) or `timeout` passes.
+        Falls back to sleeping and a NOOP keep-alive when IDLE is unavailable."""
+        if not self.supports_idle:
+            time.sleep(min(timeout, POLL_INTERVAL_SECONDS))
+            self.conn.noop()
+            return True
+        tag = b"IDLE1"
+        self.conn.send(tag + b" IDLE\r\n")
+        if not self.conn.readline().startswith(b"+"):
+            raise imaplib.IMAP4.error("Server refused IDLE")
+        # Wait for readability with select instead of a socket timeout: a timed-out read leaves
+        # imaplib's file object unusable, which would break the DONE exchange below. Untagged
+        # responses already buffered with the '+' line are missed, but the caller searches for
+        # new UIDs after every wait anyway.
+        changed = False
+        deadline = time.monotonic() + timeout
+        with selectors.DefaultSelector() as selector:
+            selector.register(self.conn.sock, selectors.EVENT_READ)
+            try:
+                while not changed:
+                    pending = getattr(self.conn.sock, "pending", lambda: 0)() # Bytes decrypted but unread (SSL)
+                    remaining = deadline - time.monotonic()
+                    if not pending and (remaining <= 0 or not selector.select(remaining)):
+                        break
+                    line = self.conn.readline()
+                    if not line:
+                        raise imaplib.IMAP4.abort("Connection closed during IDLE")
+                    changed = line.startswith(b"*") and (b"EXISTS" in line or b"RECENT" in line)
+            finally:
+                self.conn.send(b"DONE\r\n")
+                while not self.conn.readline().startswith(tag):
+                    pass
+        return changed
+
+    def close(self):
+        if self.conn is not None:
+            try:
+                self.conn.logout()
+            except Exception:
+                pass
+            self.conn = None
+
+
+class UIDCheckpoint:
+    """Persists the highest UID below which every message has been processed.
+    Workers finish out of order, so the checkpoint only advances past a UID once all
+    lower in-flight UIDs are done; a restart may repeat in-flight mail but never skips any."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.last_uid = None
+        self.uidvalidity = None
+        self._in_flight = set()
+        self._highest_enqueued = None
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                saved = json.load(f)
+            self.last_uid = saved.get("last_uid")
+            self.uidvalidity = saved.get("uidvalidity")
+
+    def check_uidvalidity(self, uidvalidity):
+        """UIDs are only meaningful within one UIDVALIDITY; start over if the server changed it."""
+        with self._lock:
+            if self.uidvalidity is not None and uidvalidity != self.uidvalidity:
+                print(f"UIDVALIDITY changed ({self.uidvalidity} -> {uidvalidity}). Resetting checkpoint.")
+                self.last_uid = None
+                self._highest_enqueued = None
+            self.uidvalidity = uidvalidity
+            self._save()
+
+    def next_after(self):
+        """Highest UID already handed to workers, so searches do not enqueue it twice."""
+        with self._lock:
+            return self._highest_enqueued if self._highest_enqueued is not None else self.last_uid
+
+    def started(self, uid: int):
+        with self._lock:
+            self._in_flight.add(uid)
+            self._highest_enqueued = max(uid, self._highest_enqueued or 0)
+
+    def done(self, uid: int):
+        with self._lock:
+            self._in_flight.discard(uid)
+            committed = min(self._in_flight) - 1 if self._in_flight else self._highest_enqueued
+            if committed is not None and (self.last_uid is None or committed > self.last_uid):
+                self.last_uid = committed
+                self._save()
+
+    def abandon(self, uid: int):
+        """Drops an in-flight UID that was never handed over (e.g. enqueueing failed) without
+        advancing past it: the next search starts below it, so it is fetched again."""
+        with self._lock:
+            self._in_flight.discard(uid)
+            if self._highest_enqueued is not None and self._highest_enqueued >= uid:
+                self._highest_enqueued = uid - 1
+
+    def _save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({"last_uid": self.last_uid, "uidvalidity": self.uidvalidity}, f)
+        os.replace(tmp_path, self.path)
+
+
+class EmailIngestor:
+    """Fetches new mail over one persistent connection and feeds a bounded queue drained by
+    classifier worker threads, so network fetches overlap with LLM processing.
+
+    With a `job_queue` (utils.job_queue.JobQueue), fetched messages become durable jobs
+    instead: the UID checkpoint advances as soon as a message is enqueued, and jobs are
+    processed with stage checkpoints by this service's workers and any `job_worker.py`
+    processes sharing the queue, so a crash neither loses a message nor repeats its finished
+    LLM calls."""
+
+    _STOP = object()
+
+    def __init__(self, mailbox, classifier_agent, checkpoint: UIDCheckpoint,
+                 workers: int = CLASSIFIER_MAX_CONCURRENCY, batch_size: int = FETCH_BATCH_SIZE,
+                 queue_size: int = None, job_queue: JobQueue = None):
+        self.mailbox = mailbox
+        self.classifier = classifier_agent
+        self.checkpoint = checkpoint
+        self.batch_size = batch_size
+        self.queue = queue.Queue(maxsize=queue_size or batch_size * 2)
+        self.job_queue = job_queue
+        self.job_worker = JobWorker(job_queue, classifier_agent, threads=workers) if job_queue else None
+        self.processed = 0
+        self.failed = 0
+        self._stats_lock = threading.Lock()
+        self._workers = [] if job_queue else [
+            threading.Thread(target=self._worker, name=f"email-worker-{i}", daemon=True) for i in range(workers)]
+        self._started = False
+
+    def start(self):
+        if not self._started:
+            for worker in self._workers:
+                worker.start()
+            if self.job_worker:
+                self.job_worker.start()
+            self._started = True
+
+    def stop(self):
+        """Lets the workers finish everything already queued, then stops them.
+        Durable jobs not yet claimed stay in the job queue for the next start."""
+        for _ in self._workers:
+            self.queue.put(self._STOP)
+        for worker in self._workers:
+            worker.join()
+        if self.job_worker:
+            self.job_worker.stop()
+        self._started = False
+
+    def drain_once(self) -> int:
+        """Enqueues every message newer than the checkpoint, fetching `batch_size` UIDs per
+        round trip. Blocks when the queue is full (backpressure). Returns the number enqueued."""
+        uids = self.mailbox.search_uids(self.checkpoint.next_after())
+        if uids:
+            print(f"Found {len(uids)} new email(s).")
+        enqueued = 0
+        for i in range(0, len(uids), self.batch_size):
+            for uid, raw_message in self.mailbox.fetch(uids[i:i + self.batch_size]):
+                self.checkpoint.started(uid)
+                if self.job_queue is not None:
+                    if not self._enqueue_message(uid, raw_message):
+                        return enqueued # This UID and the rest are fetched again by the next drain
+                else:
+                    self.queue.put((uid, raw_message))
+                enqueued += 1
+        return enqueued
+
+    def _enqueue_message(self, uid: int, raw_message: bytes) -> bool:
+        """Turns a message into a durable job. Returns False if the job queue could not take
+        it (e.g. still locked); the UID is then released for the next drain to fetch again."""
+        try:
+            job = self._parse_message(uid, raw_message)
+        except Exception as e:
+            with self._stats_lock:
+                self.failed += 1
+            print(f"  Error parsing email UID {uid}: {e}")
+            self.checkpoint.done(uid)
+            return True
+        try:
+            # The UIDVALIDITY/UID key makes a re-fetched message map to its existing job
+            job_id = self.job_queue.enqueue(**job, dedup_key=f"imap:{self.mailbox.uidvalidity}:{uid}")
+        except Exception as e:
+            print(f"  Error queueing email UID {uid}: {e}. It will be fetched again.")
+            self.checkpoint.abandon(uid)
+            return False
+        self.checkpoint.done(uid) # Durable in the job queue from here on
+        print(f"  Queued email UID {uid} as job {job_id}")
+        return True
+
+    def _worker(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is self._STOP:
+                    return
+                self._process_message(*item)
+            finally:
+                self.queue.task_done()
+
+    @staticmethod
+    def _parse_message(uid: int, raw_message: bytes) -> dict:
+        """ClassifierAgent.process arguments for a raw message."""
+        msg = email.message_from_bytes(raw_message)
+        subject = decode_subject(msg) if msg["Subject"] else "(no subject)"
+        sender = msg.get("From")
+        body = fetch_email_body(msg)
+        print(f"\nProcessing email UID {uid}")
+        print(f"  From: {sender}")
+        print(f"  Subject: {subject}")
+        print(f"  Body Preview: {body[:100]}...")
+        return {
+            "input_data": f"Subject: {subject}\n\nFrom: {sender}\n\n{body}",
+            "source_identifier": f"Email: {subject} (from {sender})",
+            "source_type": "automated_email_ingestion"
+        }
+
+    def _process_message(self, uid: int, raw_message: bytes):
+        try:
+            thread_id, _ = self.classifier.process(**self._parse_message(uid, raw_message))
+            with self._stats_lock:
+                self.processed += 1
+            print(f"  Processed by system. UID {uid}, Thread ID: {thread_id}")
+        except Exception as e:
+            with self._stats_lock:
+                self.failed += 1
+            print(f"  Error processing email UID {uid} with ClassifierAgent: {e}")
+        finally:
+            self.checkpoint.done(uid)
+
+    def run_forever(self):
+        self.start()
+        while True:
+            try:
+                self.mailbox.connect()
+                self.checkpoint.check_uidvalidity(self.mailbox.uidvalidity)
+                print(f"Successfully connected. Monitoring '{self.mailbox.mailbox}' "
+                      f"({'IDLE' if self.mailbox.supports_idle else f'polling every {POLL_INTERVAL_SECONDS}s'}).")
+                while True:
+                    self.drain_once()
+                    self.mailbox.wait_for_changes(IDLE_TIMEOUT_SECONDS)
+            except imaplib.IMAP4.abort as e:
+                print(f"IMAP connection aborted: {e}. Reconnecting in {RECONNECT_DELAY_SECONDS}s...")
+            except imaplib.IMAP4.error as e:
+                print(f"IMAP error: {e}. Reconnecting in {RECONNECT_DELAY_SECONDS}s...")
+            except (ConnectionRefusedError, OSError) as e:
+                print(f"Connection error: {e}. Check server/port. Reconnecting in {RECONNECT_DELAY_SECONDS}s...")
+            except Exception as e:
+                print(f"An unexpected error occurred: {e}")
+            self.mailbox.close()
+            time.sleep(RECONNECT_DELAY_SECONDS)
 
 def main_loop():
     print("Starting Email Automation Service...")
+    if METRICS_PORT:
+        serve_metrics(METRICS_PORT)
     print(f"Connecting to {IMAP_SERVER} for user {EMAIL_USER}...")
-    while True:
-        try:
-            mail = imaplib.IMAP4_SSL(IMAP_SERVER)
-            mail.login(EMAIL_USER, EMAIL_PASS)
-            mail.select(MAILBOX_TO_MONITOR)
-            print(f"Successfully connected. Monitoring '{MAILBOX_TO_MONITOR}'.")
-            process_new_emails(mail)
-            mail.logout()
-            print("Logged out. Waiting for next poll cycle...")
-        except imaplib.IMAP4.abort as e:
-            print(f"IMAP connection aborted: {e}. Retrying in {POLL_INTERVAL_SECONDS}s...")
-        except imaplib.IMAP4.error as e:
-            print(f"IMAP error: {e}. Retrying in {POLL_INTERVAL_SECONDS}s...")
-        except ConnectionRefusedError as e:
-            print(f"Connection refused: {e}. Check server/port. Retrying in {POLL_INTERVAL_SECONDS}s...")
-        except Exception as e:
-            print(f"An unexpected error occurred: {e}")
-        time.sleep(POLL_INTERVAL_SECONDS)
+    mailbox = IMAPMailbox(IMAP_SERVER, EMAIL_USER, EMAIL_PASS, MAILBOX_TO_MONITOR)
+    job_queue = JobQueue(JOB_QUEUE_PATH) if JOB_QUEUE_PATH else None
+    if job_queue:
+        print(f"Queueing messages in {job_queue.location} ({job_queue.stats()['queued']} waiting from earlier runs).")
+    # Built here rather than at import, so importing this module (e.g. for EmailIngestor in the
+    # benchmarks) does not open the memory store or the model client
+    classifier = ClassifierAgent()
+    EmailIngestor(mailbox, classifier, UIDCheckpoint(CHECKPOINT_FILE), job_queue=job_queue).run_forever()
 
 if __name__ == "__main__":
     if not all([IMAP_SERVER, EMAIL_USER, EMAIL_PASS]):
         print("Error: IMAP_SERVER, EMAIL_AUTOMATION_USER, or EMAIL_AUTOMATION_APP_PASSWORD not set in .env")
     else:
-        main_loop()
\ No newline at end of file
+        main_loop()
@@ -1,11 +1,20 @@
 import streamlit as st
+import hashlib
 import os
 import json
 from agents.classifier_agent import ClassifierAgent
-from memory.shared_memory import shared_memory_instance, MEMORY_FILE
+from memory.shared_memory import shared_memory_instance
+from utils.job_queue import JobQueue, JobWorker, JOB_QUEUE_PATH
+from utils.metrics import metrics
 
 st.set_page_config(page_title="Multi-Agent Document Processor", layout="wide")
 
+LOG_PAGE_SIZES = [10, 25, 50, 100]
+UPLOAD_WORKER_THREADS = int(os.getenv("UPLOAD_WORKER_THREADS", "4")) # Inputs processed concurrently
+UPLOAD_POLL_INTERVAL = float(os.getenv("UPLOAD_POLL_INTERVAL", "1.0")) # Seconds between progress updates
+# Checkpointed stages of a job, in pipeline order, for its progress bar
+PROGRESS_STAGES = ["extracted", "intent", "thread_id", "result"]
+
 @st.cache_resource
 def get_classifier_agent():
     print("Initializing ClassifierAgent for Streamlit app...")
@@ -13,77 +22,192 @@ def get_classifier_agent():
 
 classifier = get_classifier_agent()
 
+@st.cache_resource
+def get_job_worker():
+    # Inputs are queued durably and processed by background threads, so the script run (and
+    # the page) never blocks on extraction or LLM calls. If this app dies mid-way, a
+    # job_worker.py process resumes a job from its last checkpointed stage once its lease expires
+    worker = JobWorker(JobQueue(JOB_QUEUE_PATH or "jobs.db"), classifier, threads=UPLOAD_WORKER_THREADS,
+                       name="streamlit")
+    worker.start()
+    return worker
+
+def submit(data: bytes, input_data, source_identifier: str, source_type: str, force: bool = False) -> dict:
+    """Queues an input for the background worker, keyed by the SHA-256 of its content: identical
+    content reuses the existing job (and its result and thread_id) unless `force` is set, which
+    re-runs it with fresh LLM calls (no duplicate reuse, no cached answers). A finished job
+    without a usable result (dead-lettered, or with failed LLM steps) is run again."""
+    queue = get_job_worker().queue
+    dedup_key = f"streamlit:{hashlib.sha256(data).hexdigest()}"
+    job = queue.find(dedup_key)
+    if job is None:
+        job_id = queue.enqueue(input_data, source_identifier, source_type, dedup_key=dedup_key, force=force)
+        return {"job_id": job_id, "name": source_identifier, "cached": False}
+    result = job["result"]
+    failed = job["status"] == "dead" or (job["status"] == "done" and isinstance(result, dict) and
+                                         bool(result.get("llm_errors")))
+    if (force or failed) and not queue.requeue(job["id"], force=force):
+        st.warning(f"'{source_identifier}' is already being processed (job {job['id']}).")
+    return {"job_id": job["id"], "name": source_identifier,
+            "cached": not force and not failed and job["status"] == "done"}
+
+def stage_progress(job: dict) -> float:
+    if job["status"] in ("done", "dead"):
+        return 1.0
+    stages = job["stages"]
+    reached = [i for i, stage in enumerate(PROGRESS_STAGES) if stage in stages]
+    return (max(reached) + 1 if reached else 0) / (len(PROGRESS_STAGES) + 1)
+
+def thread_label(job: dict) -> str:
+    """Short thread id of a finished job; a JSON stream has one thread per record, so its
+    record counts are shown instead."""
+    result = job["result"]
+    if job["thread_id"]:
+        return f"thread {str(job['thread_id'])[:8]}"
+    if isinstance(result, dict) and "stream_layout" in result:
+        return f"{result['documents']} records, {result['errors']} failed"
+    return "thread -"
+
+def stage_detail(job: dict) -> str:
+    stages = [stage for stage in job["stages"] if not stage.startswith("record#")]
+    records = len(job["stages"]) - len(stages)
+    if records:
+        stages.append(f"{records} records done")
+    return ", ".join(stages) or job["status"]
+
+def show_jobs():
+    """Progress and results of this session's submissions. Re-runs itself every
+    UPLOAD_POLL_INTERVAL seconds while jobs are pending, then refreshes the whole page once."""
+    queue = get_job_worker().queue
+    jobs = [(submission, queue.get(submission["job_id"])) for submission in st.session_state.submissions]
+    finished = sum(1 for _, job in jobs if job["status"] in ("done", "dead"))
+    st.subheader("📊 Processing Results")
+    st.progress(finished / len(jobs), text=f"{finished} of {len(jobs)} inputs processed")
+    for submission, job in jobs:
+        name = submission["name"]
+        if job["status"] == "done":
+            label = "cached result" if submission["cached"] else "processed"
+            with st.expander(f"✅ {name} ({label}, {thread_label(job)})", expanded=len(jobs) == 1):
+                st.json(job["result"])
+                spans = metrics.spans(thread_id=job["thread_id"]) if job["thread_id"] else []
+                if spans:
+                    st.caption("Stage timings")
+                    st.dataframe(spans, use_container_width=True)
+        elif job["status"] == "dead":
+            st.error(f"❌ {name}: failed after {job['attempts']} attempts: {job['last_error']}")
+        else:
+            detail = f"retrying after: {job['last_error']}" if job["last_error"] else stage_detail(job)
+            st.progress(stage_progress(job), text=f"⏳ {name}: {detail}")
+    if finished == len(jobs) and st.session_state.get("submissions_pending"):
+        st.session_state.submissions_pending = False
+        st.rerun() # Stops polling and shows the new entries in the log sidebar
+
 st.title("📄 Multi-Agent Document Processor")
 st.markdown("""
-Upload a file (PDF, JSON, Email/Text) or enter raw text.
+Upload files (PDF, JSON, Email/Text) or enter raw text.
 The system will classify its format and intent, then route it to the appropriate agent for processing.
 Results and a running log will be displayed below.
 """)
 
 input_method = st.radio("Choose input method:", ("File Upload", "Raw Text Input"))
 
-uploaded_file = None
+uploaded_files = []
 raw_text_input = ""
 source_identifier_manual = "raw_text_input"
 
 if input_method == "File Upload":
-    uploaded_file = st.file_uploader("Choose a PDF, JSON, or Text/Email file", type=["pdf", "json", "txt", "eml"])
-    if uploaded_file:
+    uploaded_files = st.file_uploader("Choose PDF, JSON, or Text/Email files", type=["pdf", "json", "jsonl", "ndjson", "txt", "eml"],
+                                      accept_multiple_files=True)
+    for uploaded_file in uploaded_files:
         st.write(f"Uploaded: {uploaded_file.name} ({uploaded_file.type})")
 else:
     raw_text_input = st.text_area("Enter Email Content or other Text:", height=200)
     source_identifier_manual = st.text_input("Optional: Give this input a name/identifier", value="manual_text_entry")
+force_reprocess = st.checkbox("Force reprocess", help="Process again even if identical content already has a result")
 
 if st.button("Process Input"):
-    if uploaded_file:
-        st.session_state.last_thread_id = None
-        st.session_state.last_result = None
-        with st.spinner(f"Processing {uploaded_file.name}..."):
-            thread_id, result = classifier.process(
-                input_data=uploaded_file,
-                source_identifier=uploaded_file.name,
-                source_type="streamlit_upload"
-            )
-            st.session_state.last_thread_id = thread_id
-            st.session_state.last_result = result
-        if st.session_state.last_result:
-            st.success(f"File '{uploaded_file.name}' processed successfully!")
-        else:
-            st.error("An error occurred during processing.")
+    if uploaded_files:
+        st.session_state.submissions = [
+            submit(uploaded_file.getvalue(), uploaded_file, uploaded_file.name, "streamlit_upload", force_reprocess)
+            for uploaded_file in uploaded_files]
     elif raw_text_input.strip():
-        st.session_state.last_thread_id = None
-        st.session_state.last_result = None
-        with st.spinner(f"Processing raw text input '{source_identifier_manual}'..."):
-            thread_id, result = classifier.process(
-                input_data=raw_text_input,
-                source_identifier=source_identifier_manual,
-                source_type="streamlit_raw_text"
-            )
-            st.session_state.last_thread_id = thread_id
-            st.session_state.last_result = result
-        if st.session_state.last_result:
-            st.success(f"Raw text input '{source_identifier_manual}' processed successfully!")
-        else:
-            st.error("An error occurred during processing raw text.")
+        st.session_state.submissions = [submit(raw_text_input.encode('utf-8'), raw_text_input, source_identifier_manual,
+                                               "streamlit_raw_text", force_reprocess)]
     else:
+        st.session_state.submissions = []
         st.warning("Please upload a file or enter text to process.")
+    st.session_state.submissions_pending = bool(st.session_state.submissions)
 
-if 'last_result' in st.session_state and st.session_state.last_result:
-    st.subheader("📊 Processing Result")
-    st.json(st.session_state.last_result)
+if st.session_state.get("submissions"):
+    st.fragment(show_jobs, run_every=UPLOAD_POLL_INTERVAL if st.session_state.get("submissions_pending") else None)()
 
-st.sidebar.title("📝 Shared Memory Log")
-st.sidebar.markdown(f"Log file: `{MEMORY_FILE}` (updates on disk)")
+with st.expander("⏱️ Pipeline latency (this app process)"):
+    stage_rows = metrics.stage_summary()
+    if stage_rows:
+        st.caption("Per stage and step, slowest p95 first. LLM steps are labelled by agent and prompt.")
+        st.dataframe(stage_rows, use_container_width=True)
+        st.bar_chart({f"{r['stage']}:{r['step'] or ''}": r["p95_ms"] for r in stage_rows[:15]})
+        col_prom, col_json = st.columns(2)
+        col_prom.download_button("Prometheus metrics", metrics.prometheus_text(), file_name="metrics.prom")
+        col_json.download_button("JSON snapshot", json.dumps(metrics.snapshot(include_spans=True), indent=2),
+                                 file_name="metrics.json")
+    else:
+        st.write("No stages timed yet. Process an input to collect timings.")
 
-if st.sidebar.button("Refresh Log from File"):
-    shared_memory_instance.load_from_file()
+st.sidebar.title("📝 Shared Memory Log")
+st.sidebar.markdown(f"Log store: `{shared_memory_instance.storage.location}` (appends on disk)")
+# Other processes (IMAP service, CLI runs) append to the same store; pick up only what is new
+new_entries = shared_memory_instance.refresh()
+if new_entries:
+    st.sidebar.caption(f"{new_entries} new entries from other processes")
+if st.sidebar.button("Refresh Log"):
+    st.rerun()
+memory_usage = shared_memory_instance.memory_usage()
+st.sidebar.caption(f"{memory_usage['entries']} entries, {memory_usage['resident_entries']} resident "
+                   f"({memory_usage['resident_bytes'] // 1024} KB)")
 
+# Only one page is read and rendered per rerun, whatever the size of the history
+total_entries = len(shared_memory_instance)
+seen_entries = st.session_state.get("log_seen_entries", total_entries)
 if shared_memory_instance.log:
-    for entry in reversed(shared_memory_instance.log):
-        with st.sidebar.expander(f"Log ID: {entry['log_id']} ({entry['timestamp']}) - {entry['source_identifier']}"):
-            st.json(entry)
+    intent_filter = st.sidebar.selectbox("Filter by intent", ["All"] + shared_memory_instance.index.values("classified_intent"))
+    agent_filter = st.sidebar.selectbox("Filter by agent", ["All"] + shared_memory_instance.index.values("agent_processed"))
+    thread_filter = st.sidebar.text_input("Filter by thread ID").strip()
+    page_size = st.sidebar.selectbox("Entries per page", LOG_PAGE_SIZES, index=1)
+    filters = dict(intent=None if intent_filter == "All" else intent_filter,
+                   agent=None if agent_filter == "All" else agent_filter,
+                   thread_id=thread_filter or None)
+    matches = shared_memory_instance.count(**filters)
+    pages = max(1, -(-matches // page_size))
+    # Keyed on the filters, so changing them starts again at the newest page
+    page = st.sidebar.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1, step=1,
+                                   key=f"log_page:{intent_filter}:{agent_filter}:{thread_filter}:{page_size}")
+    log_entries = shared_memory_instance.query(**filters, newest_first=True, limit=page_size,
+                                               offset=(page - 1) * page_size)
+    # Entries appended since this session's last render (at most one page of them is marked)
+    new_log_ids = {entry["log_id"] for entry in
+                   shared_memory_instance.get_entries(range(max(seen_entries, total_entries - page_size), total_entries))}
+    if total_entries > seen_entries:
+        st.sidebar.caption(f"🆕 {total_entries - seen_entries} entries since the last view")
+    st.sidebar.caption(f"{matches} matching entries, newest first, grouped by thread")
+
+    threads = {}
+    for entry in log_entries:
+        threads.setdefault(entry["thread_id"], []).append(entry)
+    for thread_id, entries in threads.items():
+        thread_size = len(shared_memory_instance.index.positions("thread_id", thread_id))
+        marker = "🆕 " if any(entry["log_id"] in new_log_ids for entry in entries) else ""
+        with st.sidebar.expander(f"{marker}Thread {str(thread_id)[:8]} - {entries[0]['source_identifier']} "
+                                 f"({len(entries)} of {thread_size} entries)"):
+            st.caption(f"Thread ID: {thread_id}")
+            for entry in entries:
+                st.markdown(f"**Log ID:** {entry['log_id']} ({entry['timestamp']}) - {entry['agent_processed']}")
+                st.json(entry, expanded=False)
+    if not log_entries:
+        st.sidebar.write("No entries match the selected filters.")
 else:
     st.sidebar.write("Memory log is empty.")
+st.session_state.log_seen_entries = total_entries
 
 st.markdown("---")
 st.caption("Developed as a multi-agent AI system.")
\ No newline at end of file
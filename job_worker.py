@@ -0,0 +1,79 @@
+"""Drains the durable job queue (utils/job_queue.py) through ClassifierAgent. Start as many
+of these as needed against the same queue file; jobs are leased, so each runs once, and a
+job left behind by a crashed worker is picked up again once its lease expires, resuming
+from its last checkpointed stage.
+
+Usage: python job_worker.py [--processes 2] [--threads 4] [--queue jobs.db]
+       python job_worker.py --stats | --dead-letters | --retry-dead [JOB_ID]
+"""
+import argparse
+import multiprocessing
+import os
+import signal
+import threading
+from utils.job_queue import JobQueue, JobWorker, JOB_QUEUE_PATH
+
+WORKER_THREADS = int(os.getenv("CLASSIFIER_MAX_CONCURRENCY", "4"))
+
+
+def run_worker(queue_path: str, threads: int, exit_when_idle: bool = False):
+    from agents.classifier_agent import ClassifierAgent # Each process opens its own memory store and LLM client
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    classifier = ClassifierAgent()
+    worker = JobWorker(JobQueue(queue_path), classifier, threads=threads)
+    print(f"Worker {worker.name}: {threads} thread(s) on {queue_path}")
+    worker.start()
+    try:
+        while not stop.is_set():
+            if exit_when_idle and worker.drain(timeout=1.0):
+                break
+            stop.wait(1.0)
+    except KeyboardInterrupt:
+        pass
+    worker.stop()
+    classifier.memory.save_to_file() # atexit handlers do not run in multiprocessing children
+    print(f"Worker {worker.name}: {worker.processed} job(s) done, {worker.failed} failed.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--queue", default=JOB_QUEUE_PATH)
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=WORKER_THREADS, help="worker threads per process")
+    parser.add_argument("--exit-when-idle", action="store_true", help="stop once no job is ready or running")
+    parser.add_argument("--stats", action="store_true", help="print job counts per status and exit")
+    parser.add_argument("--dead-letters", action="store_true", help="list dead-lettered jobs and exit")
+    parser.add_argument("--retry-dead", nargs="?", type=int, const=-1, metavar="JOB_ID",
+                        help="re-queue one dead-lettered job, or all of them")
+    args = parser.parse_args()
+
+    if args.stats or args.dead_letters or args.retry_dead is not None:
+        job_queue = JobQueue(args.queue)
+        if args.stats:
+            print(job_queue.stats())
+        if args.dead_letters:
+            for job in job_queue.dead_letters():
+                print(f"{job['id']}: {job['source_identifier']} ({job['attempts']} attempts) {job['last_error']}")
+        if args.retry_dead is not None:
+            requeued = job_queue.retry_dead(None if args.retry_dead == -1 else args.retry_dead)
+            print(f"Re-queued {requeued} dead-lettered job(s).")
+        return
+
+    if args.processes == 1:
+        run_worker(args.queue, args.threads, args.exit_when_idle)
+        return
+    processes = [multiprocessing.Process(target=run_worker, args=(args.queue, args.threads, args.exit_when_idle),
+                                         name=f"job-worker-{i}") for i in range(args.processes)]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt: # The workers got the same SIGINT and finish their running jobs
+        for process in processes:
+            process.join()
+
+
+if __name__ == "__main__":
+    main()
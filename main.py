@@ -1,73 +1,159 @@
+"""Runs documents through the multi-agent pipeline in bulk: files, glob patterns, directories
+(walked recursively), mbox files, Maildir folders, JSON Lines streams and JSON array files, one
+input per record ('-' reads JSON Lines from stdin). With --manifest, the content hash of every processed document is recorded and
+documents already listed are skipped, so an interrupted backfill resumes where it stopped.
+
+Usage: python main.py [INPUT ...] [--workers 8] [--manifest done.txt] [--output results.jsonl | -]
+       python main.py                  # the bundled sample_inputs
+"""
+import argparse
+import contextlib
+import json
 import os
+import sys
+import time
 from agents.classifier_agent import ClassifierAgent
-from memory.shared_memory import shared_memory_instance, MEMORY_FILE
-import json
+from utils.batch_inputs import iter_inputs
+from utils.job_queue import result_failure
+from utils.llm_utils import get_token_usage
+from utils.metrics import metrics
+
+SAMPLE_INPUTS = [
+    "sample_inputs/email_rfq.txt",
+    "sample_inputs/invoice_data.json",
+    "sample_inputs/email_complaint.txt",
+    "sample_inputs/some_regulation.txt",
+    "sample_inputs/document.pdf",
+]
+MAX_CONCURRENCY = int(os.getenv("CLASSIFIER_MAX_CONCURRENCY", "4"))
+
+
+class Manifest:
+    """Content hashes of documents already processed, one per line (followed by a tab and the
+    source identifier), appended and flushed as each document succeeds."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.hashes = set()
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.hashes = {line.split("\t", 1)[0].strip() for line in f if line.strip()}
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def __contains__(self, digest: str) -> bool:
+        return digest in self.hashes
+
+    def add(self, digest: str, source_identifier: str):
+        self.hashes.add(digest)
+        self._file.write(f"{digest}\t{source_identifier}\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class BatchRun:
+    """Feeds inputs to ClassifierAgent.process_batch, skipping documents in the manifest (or
+    seen earlier in the run) and streaming one JSON line per finished document to `output`."""
+
+    def __init__(self, classifier: ClassifierAgent, manifest: Manifest = None, output=None):
+        self.classifier = classifier
+        self.manifest = manifest
+        self.output = output
+        self.counts = {"processed": 0, "failed": 0, "skipped": 0, "duplicates": 0}
+        self._in_flight = {} # process_batch index -> (content hash, source_type)
+        self._seen = set()
+
+    def _pending(self, inputs):
+        index = 0
+        for digest, kwargs in inputs:
+            if self.manifest is not None and digest in self.manifest:
+                self.counts["skipped"] += 1
+                continue
+            if digest in self._seen:
+                self.counts["duplicates"] += 1
+                continue
+            self._seen.add(digest)
+            self._in_flight[index] = (digest, kwargs["source_type"])
+            index += 1
+            yield kwargs
+
+    def _finished(self, completed, index, source_identifier, outcome):
+        # process_batch serializes progress callbacks, so no locking is needed here
+        digest, source_type = self._in_flight.pop(index)
+        thread_id, result = outcome
+        # Same rule as the job queue: failed LLM steps or stream records are failures, kept out of the manifest
+        failed = (thread_id is None and isinstance(result, dict) and "error" in result) or \
+            bool(result_failure(result))
+        self.counts["failed" if failed else "processed"] += 1
+        if not failed and self.manifest is not None:
+            self.manifest.add(digest, source_identifier)
+        if self.output is not None:
+            record = {"source_identifier": source_identifier, "source_type": source_type, "sha256": digest,
+                      "status": "error" if failed else "ok", "thread_id": thread_id, "result": result}
+            self.output.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+            self.output.flush()
+        print(f"[{completed}] {source_identifier} {'failed' if failed else 'processed'} (Thread: {thread_id})")
+
+    def run(self, inputs, workers: int) -> float:
+        """Processes `inputs` ((content hash, process kwargs) pairs). Returns the wall time in seconds."""
+        start = time.perf_counter()
+        self.classifier.process_batch(self._pending(inputs), max_concurrency=workers,
+                                      progress_callback=self._finished, keep_results=False)
+        self.classifier.memory.save_to_file()
+        return time.perf_counter() - start
+
+
+def print_summary(run: BatchRun, elapsed: float):
+    counts = run.counts
+    done = counts["processed"] + counts["failed"]
+    print("\n--- Batch summary ---")
+    print(f"{counts['processed']} processed, {counts['failed']} failed, {counts['skipped']} skipped (manifest), "
+          f"{counts['duplicates']} duplicates in {elapsed:.1f}s ({done / elapsed if elapsed else 0:.2f} docs/s)")
+    for row in metrics.stage_summary():
+        if row["stage"] in ("pipeline", "llm", "agent") and row["count"]:
+            print(f"{row['stage']}:{row['step'] or ''} n={row['count']} mean={row['mean_ms']}ms "
+                  f"p50={row['p50_ms']}ms p95={row['p95_ms']}ms p99={row['p99_ms']}ms errors={row['errors']}")
+    print("\n--- Token usage by agent ---")
+    for agent, usage in sorted(get_token_usage()["by_agent"].items()):
+        print(f"{agent}: {usage['calls']} calls ({usage['cached_calls']} cached), "
+              f"{usage['total_tokens']} tokens spent, prompt content {usage['kept_tokens']}/{usage['input_tokens']} tokens kept")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("inputs", nargs="*", help="files, directories, glob patterns or '-' for JSON Lines on stdin")
+    parser.add_argument("--workers", type=int, default=MAX_CONCURRENCY, help="documents processed concurrently")
+    parser.add_argument("--manifest", help="file of processed content hashes; listed documents are skipped")
+    parser.add_argument("--output", "-o", help="write one JSON line per document to this file, or '-' for stdout")
+    parser.add_argument("--print-log", action="store_true", help="print the whole memory log at the end")
+    args = parser.parse_args()
+
+    output = None
+    if args.output == "-":
+        output = sys.stdout
+    elif args.output:
+        output = open(args.output, 'a', encoding='utf-8')
+    manifest = Manifest(args.manifest) if args.manifest else None
+    # With results on stdout, everything else the pipeline prints goes to stderr
+    with contextlib.redirect_stdout(sys.stderr) if output is sys.stdout else contextlib.nullcontext():
+        print("Starting Multi-Agent AI System...")
+        classifier = ClassifierAgent()
+        run = BatchRun(classifier, manifest=manifest, output=output)
+        print(f"\n--- Processing {', '.join(args.inputs) or 'sample inputs'} ({args.workers} workers) ---")
+        try:
+            own_files = [path for path in (args.output, args.manifest) if path and path != "-"]
+            elapsed = run.run(iter_inputs(args.inputs or SAMPLE_INPUTS, exclude=own_files), args.workers)
+        finally:
+            if manifest is not None:
+                manifest.close()
+            if output is not None and output is not sys.stdout:
+                output.close()
+        if args.print_log:
+            classifier.memory.print_log()
+        print_summary(run, elapsed)
+        print(f"Memory log saved to: {classifier.memory.storage.location}")
 
-def load_sample_data(filepath):
-    try:
-        if filepath.lower().endswith(".json"):
-            with open(filepath, 'r') as f:
-                return json.load(f)
-        else:
-            if filepath.lower().endswith(".pdf"):
-                return filepath
-            with open(filepath, 'r', encoding='utf-8') as f:
-                return f.read()
-    except Exception as e:
-        print(f"Error loading sample data from {filepath}: {e}")
-        return None
 
 if __name__ == "__main__":
-    print("Starting Multi-Agent AI System...")
-    classifier = ClassifierAgent()
-    print("\n--- Processing Email RFQ (Text File) ---")
-    email_rfq_path = "sample_inputs/email_rfq.txt"
-    email_rfq_content = load_sample_data(email_rfq_path)
-    if email_rfq_content:
-        thread_id_rfq, result_rfq = classifier.process(
-            input_data=email_rfq_content,
-            source_identifier=os.path.basename(email_rfq_path),
-            source_type="file_upload_text_email"
-        )
-        print(f"RFQ Processing Result (Thread: {thread_id_rfq}):")
-    print("\n--- Processing JSON Invoice (File) ---")
-    json_invoice_path = "sample_inputs/invoice_data.json"
-    if os.path.exists(json_invoice_path):
-        thread_id_invoice, result_invoice = classifier.process(
-            input_data=json_invoice_path,
-            source_identifier=os.path.basename(json_invoice_path),
-            source_type="file_upload_json"
-        )
-        print(f"Invoice Processing Result (Thread: {thread_id_invoice}):")
-    print("\n--- Processing Email Complaint (Text File) ---")
-    email_complaint_path = "sample_inputs/email_complaint.txt"
-    email_complaint_content = load_sample_data(email_complaint_path)
-    if email_complaint_content:
-        thread_id_complaint, result_complaint = classifier.process(
-            input_data=email_complaint_content,
-            source_identifier=os.path.basename(email_complaint_path),
-            source_type="file_upload_text_email",
-        )
-        print(f"Complaint Processing Result (Thread: {thread_id_complaint}):")
-    print("\n--- Processing Regulation Document (Text File) ---")
-    regulation_path = "sample_inputs/some_regulation.txt"
-    regulation_content = load_sample_data(regulation_path)
-    if regulation_content:
-        thread_id_reg, result_reg = classifier.process(
-            input_data=regulation_content,
-            source_identifier=os.path.basename(regulation_path),
-            source_type="file_upload_text_document"
-        )
-        print(f"Regulation Processing Result (Thread: {thread_id_reg}):")
-    print("\n--- Processing PDF Document (Simulated) ---")
-    pdf_path = "sample_inputs/document.pdf"
-    if os.path.exists(pdf_path):
-        thread_id_pdf, result_pdf = classifier.process(
-            input_data=pdf_path,
-            source_identifier=os.path.basename(pdf_path),
-            source_type="file_upload_pdf"
-        )
-        print(f"PDF Processing Result (Thread: {thread_id_pdf}):")
-    shared_memory_instance.print_log()
-    print("\nMulti-Agent AI System run complete.")
-    print(f"Memory log saved to: {MEMORY_FILE}")
\ No newline at end of file
+    main()
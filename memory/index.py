@@ -0,0 +1,101 @@
+# memory/index.py
+import bisect
+import datetime
+from array import array
+from collections import defaultdict
+
+# Entry field -> query keyword used by SharedMemory.query
+INDEXED_FIELDS = {
+    "thread_id": "thread_id",
+    "source_identifier": "source",
+    "classified_intent": "intent",
+    "agent_processed": "agent",
+}
+
+
+def _to_epoch(value) -> float:
+    """ISO string, date or datetime -> POSIX seconds; missing or unparsable -> -inf."""
+    if isinstance(value, str):
+        try:
+            value = datetime.datetime.fromisoformat(value)
+        except ValueError:
+            return float("-inf")
+    if isinstance(value, datetime.datetime):
+        return value.timestamp()
+    if isinstance(value, datetime.date):
+        return datetime.datetime.combine(value, datetime.time()).timestamp()
+    return float("-inf")
+
+
+def _positions():
+    return array('q')
+
+
+class MemoryIndex:
+    """Secondary indexes over log positions, updated incrementally as entries are appended.
+    Each indexed field maps a value to the ascending positions holding it. Positions and
+    timestamps are kept in typed arrays (8 bytes each) so the index stays small next to
+    millions of entries that are not themselves resident."""
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._fields = {field: defaultdict(_positions) for field in INDEXED_FIELDS}
+        self._timestamps = array('d') # Sorted POSIX timestamps
+        self._timestamp_positions = array('q') # Positions aligned with _timestamps
+
+    def add(self, position: int, entry: dict):
+        for field, index in self._fields.items():
+            index[entry.get(field)].append(position)
+        timestamp = _to_epoch(entry.get("timestamp"))
+        if not self._timestamps or timestamp >= self._timestamps[-1]:
+            self._timestamps.append(timestamp)
+            self._timestamp_positions.append(position)
+        else: # Out-of-order timestamp (e.g. migrated history); keep the list sorted
+            i = bisect.bisect_right(self._timestamps, timestamp)
+            self._timestamps.insert(i, timestamp)
+            self._timestamp_positions.insert(i, position)
+
+    def rebuild(self, entries):
+        self.clear()
+        for position, entry in enumerate(entries):
+            self.add(position, entry)
+
+    def positions(self, field: str, value):
+        index = self._fields[field]
+        return index[value] if value in index else _positions()
+
+    def values(self, field: str) -> list:
+        """Distinct values seen for an indexed field, e.g. for filter dropdowns."""
+        return sorted(v for v in self._fields[field] if v is not None)
+
+    def time_range(self, since=None, until=None):
+        """Positions whose timestamp lies in [since, until], in timestamp order."""
+        lo = bisect.bisect_left(self._timestamps, _to_epoch(since)) if since is not None else 0
+        hi = bisect.bisect_right(self._timestamps, _to_epoch(until)) if until is not None else len(self._timestamps)
+        return self._timestamp_positions[lo:hi]
+
+    def query(self, since=None, until=None, **filters) -> list:
+        """Ascending positions matching every given filter. Filters use the keywords in
+        INDEXED_FIELDS (thread_id, source, intent, agent); None means 'any'."""
+        keyword_to_field = {kw: field for field, kw in INDEXED_FIELDS.items()}
+        candidates = []
+        for keyword, value in filters.items():
+            if keyword not in keyword_to_field:
+                raise ValueError(f"Unknown query filter '{keyword}'. Use one of: {', '.join(keyword_to_field)}")
+            if value is not None:
+                candidates.append(self.positions(keyword_to_field[keyword], value))
+        if since is not None or until is not None:
+            candidates.append(self.time_range(since, until))
+        if not candidates:
+            return None # No filters: caller should use every position
+        if len(candidates) == 1 and since is None and until is None:
+            return candidates[0] # Already ascending
+        candidates.sort(key=len)
+        result = set(candidates[0])
+        for other in candidates[1:]:
+            if not result:
+                break
+            result.intersection_update(other)
+        return sorted(result)
@@ -0,0 +1,271 @@
+# memory/record.py
+import base64
+import datetime
+import json
+import os
+import sys
+import uuid
+import zlib
+try:
+    import zstandard # Optional: MEMORY_COMPRESSION=zstd
+except ImportError:
+    zstandard = None
+
+MEMORY_COMPRESSION = os.getenv("MEMORY_COMPRESSION", "zlib") # "zlib", "zstd" or "none"
+# extracted_data encoded as JSON below this size is kept as is; compression would not pay off
+MEMORY_COMPRESS_MIN_BYTES = int(os.getenv("MEMORY_COMPRESS_MIN_BYTES", "96"))
+
+ENTRY_FIELDS = ("log_id", "timestamp", "thread_id", "source_identifier", "source_type",
+                "classified_format", "classified_intent", "agent_processed", "extracted_data", "notes")
+# Few distinct values across the log; one shared string object per value
+CATEGORICAL_FIELDS = ("source_type", "classified_format", "classified_intent", "agent_processed", "notes")
+
+# Payload codecs, stored as the first byte of an encoded extracted_data. A codec's
+# dictionary must never change once data was written with it: add a new codec instead.
+CODEC_RAW = 0 # Plain UTF-8 JSON
+CODEC_ZLIB = 1 # zlib with PAYLOAD_DICTIONARY as preset dictionary
+CODEC_ZSTD = 2 # zstd with PAYLOAD_DICTIONARY as raw content dictionary
+
+# Skeletons of the extracted_data the code itself writes: key names (agent fields, JSONAgent
+# schema fields), fixed vocabularies (intents, urgency, intent sources) and the messages of
+# agents, schema validation and dedup, in the compact JSON layout encode_payload produces.
+# No document content: phrases from particular inputs would only flatter those inputs.
+# Short records compress poorly on their own; with these bytes as preset history, repeated
+# structure costs a few bits per occurrence. Most frequent skeletons last.
+PAYLOAD_DICTIONARY = "".join(json.dumps(skeleton, ensure_ascii=False, separators=(",", ":")) for skeleton in (
+    {"error": "Failed to parse JSON string/content"},
+    {"error": "Failed to parse JSON content"},
+    {"status": "Unknown format: Unknown"},
+    {"duplicate_of": "", "match": "exact", "similarity": 1.0, "reused_result": {}},
+    {"original_data_preview": {"rfq_id": "", "product_description": "", "quantity_needed": 1, "deadline": "",
+                               "contact_person": ""},
+     "reformatted_data": {"rfq_id": "", "product_description": "", "quantity_needed": 1,
+                          "_anomalies": ["No specific schema defined for intent 'Other'. Passing through data."]},
+     "schema_applied": "RFQ", "anomalies_detected": "None"},
+    {"original_data_preview": {"invoice_id": "", "customer_name": "", "invoice_date": "", "due_date": "",
+                               "items": [{"name": "", "quantity": 1, "unit_price": 0.0}], "total_amount": 0.0},
+     "reformatted_data": {"invoice_id": "", "customer_name": "", "invoice_date": "", "due_date": "",
+                          "items": [{"name": "", "quantity": 1, "unit_price": 0.0}], "total_amount": 0.0,
+                          "_anomalies": ["Missing required field: ", "Field 'total_amount': Coerced string to float",
+                                         "Item at index 0, field 'quantity': Expected type int, got str",
+                                         "Item at index 0, field 'unit_price': Value outside [0, None]"]},
+     "schema_applied": "Invoice", "anomalies_detected": "None",
+     "derived_totals": {"item_count": 1, "priced_items": 1, "items_total": 0.0, "total_matches": True}},
+    {"near_duplicate_of": {"thread_id": "", "similarity": 0.9}, "intent_source": "local:tfidf",
+     "llm_errors": {"intent": "Error: "}},
+    {"dedup_signature": {"sha256": "", "simhash": "", "minhash": ""}, "intent_source": "local:json_signature"},
+    {"dedup_signature": {"sha256": "", "simhash": "", "minhash": ""}, "intent_source": "local:keywords"},
+    {"dedup_signature": {"sha256": "", "simhash": "", "minhash": ""}, "intent_source": "llm"},
+    {"sender": "", "intent": "Order Confirmation", "urgency": "Low", "crm_summary": None,
+     "original_content_preview": "", "llm_errors": {"sender": "Error: ", "urgency": "Error: ", "summary": "Error: "}},
+    {"sender": "", "intent": "Complaint", "urgency": "High", "crm_summary": "", "original_content_preview": ""},
+    {"sender": "", "intent": "Regulation", "urgency": "Medium", "crm_summary": "", "original_content_preview": ""},
+    {"sender": "", "intent": "Invoice", "urgency": "Medium", "crm_summary": "", "original_content_preview": ""},
+    {"sender": "", "intent": "General Inquiry", "urgency": "Medium", "crm_summary": "",
+     "original_content_preview": "Subject: \n\nFrom: \n\n..."},
+    {"sender": "", "intent": "RFQ", "urgency": "Medium", "crm_summary": "",
+     "original_content_preview": "Subject: \n\nFrom: \n\n..."},
+)).encode('utf-8')
+_DICTIONARIES = {CODEC_ZLIB: PAYLOAD_DICTIONARY, CODEC_ZSTD: PAYLOAD_DICTIONARY}
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+_zstd_codecs = {} # codec -> (compressor, decompressor)
+
+
+def _zstd(codec: int):
+    if zstandard is None:
+        raise RuntimeError("Entry payload is zstd-compressed but the 'zstandard' package is not installed.")
+    if codec not in _zstd_codecs:
+        dictionary = zstandard.ZstdCompressionDict(_DICTIONARIES[codec], dict_type=zstandard.DICT_TYPE_RAWCONTENT)
+        _zstd_codecs[codec] = (zstandard.ZstdCompressor(level=6, dict_data=dictionary),
+                               zstandard.ZstdDecompressor(dict_data=dictionary))
+    return _zstd_codecs[codec]
+
+
+def _compression_codec() -> int:
+    if MEMORY_COMPRESSION == "none":
+        return CODEC_RAW
+    if MEMORY_COMPRESSION == "zstd":
+        if zstandard is not None:
+            return CODEC_ZSTD
+        print("Warning: MEMORY_COMPRESSION=zstd but 'zstandard' is not installed. Using zlib.")
+    return CODEC_ZLIB
+
+_CODEC = _compression_codec()
+
+
+def encode_payload(data: dict) -> bytes:
+    """extracted_data -> codec byte + JSON, compressed when large enough."""
+    raw = json.dumps(data or {}, ensure_ascii=False, separators=(",", ":")).encode('utf-8')
+    if _CODEC == CODEC_RAW or len(raw) < MEMORY_COMPRESS_MIN_BYTES:
+        return bytes((CODEC_RAW,)) + raw
+    if _CODEC == CODEC_ZSTD:
+        compressed = _zstd(_CODEC)[0].compress(raw)
+    else:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -15, zdict=_DICTIONARIES[_CODEC])
+        compressed = compressor.compress(raw) + compressor.flush()
+    if len(compressed) >= len(raw):
+        return bytes((CODEC_RAW,)) + raw
+    return bytes((_CODEC,)) + compressed
+
+
+def decode_payload(blob: bytes) -> dict:
+    codec, body = blob[0], blob[1:]
+    if codec == CODEC_ZLIB:
+        decompressor = zlib.decompressobj(-15, zdict=_DICTIONARIES[codec])
+        body = decompressor.decompress(body) + decompressor.flush()
+    elif codec == CODEC_ZSTD:
+        body = _zstd(codec)[1].decompress(body)
+    elif codec != CODEC_RAW:
+        raise ValueError(f"Unknown entry payload codec {codec}")
+    return json.loads(body)
+
+
+def _pack_id(value):
+    """Canonical UUID string -> 16 bytes; anything else is kept as given."""
+    if isinstance(value, str) and len(value) == 36:
+        try:
+            packed = uuid.UUID(value)
+        except ValueError:
+            return value
+        if str(packed) == value:
+            return packed.bytes
+    return value
+
+
+def _unpack_id(value):
+    return str(uuid.UUID(bytes=value)) if isinstance(value, bytes) else value
+
+
+def _pack_timestamp(value):
+    """Naive ISO timestamp (as written by SharedMemory) -> microseconds since the epoch, when
+    it converts back to exactly the same string; anything else is kept as given."""
+    if isinstance(value, str):
+        try:
+            parsed = datetime.datetime.fromisoformat(value)
+        except ValueError:
+            return value
+        if parsed.tzinfo is None and parsed.isoformat() == value:
+            return (parsed - _EPOCH) // datetime.timedelta(microseconds=1)
+    return value
+
+
+def _unpack_timestamp(value):
+    if isinstance(value, int):
+        return (_EPOCH + datetime.timedelta(microseconds=value)).isoformat()
+    return value
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class MemoryRecord:
+    """Compact form of a SharedMemory entry, used for the resident working set and on disk:
+    UUIDs as 16 bytes, the timestamp as integer microseconds, categorical fields interned
+    and extracted_data as encoded (usually compressed) JSON, decoded on access.
+    `to_entry()` rebuilds exactly the dict that was stored."""
+    __slots__ = ("log_id", "timestamp", "thread_id", "source_identifier", "source_type", "classified_format",
+                 "classified_intent", "agent_processed", "payload", "notes")
+
+    def __init__(self, log_id, timestamp, thread_id, source_identifier, source_type, classified_format,
+                 classified_intent, agent_processed, payload: bytes, notes):
+        self.log_id = log_id
+        self.timestamp = timestamp
+        self.thread_id = thread_id
+        self.source_identifier = source_identifier
+        self.source_type = _intern(source_type)
+        self.classified_format = _intern(classified_format)
+        self.classified_intent = _intern(classified_intent)
+        self.agent_processed = _intern(agent_processed)
+        self.payload = payload
+        self.notes = _intern(notes)
+
+    @classmethod
+    def from_entry(cls, entry: dict):
+        return cls(_pack_id(entry.get("log_id")), _pack_timestamp(entry.get("timestamp")),
+                   _pack_id(entry.get("thread_id")), entry.get("source_identifier"), entry.get("source_type"),
+                   entry.get("classified_format"), entry.get("classified_intent"), entry.get("agent_processed"),
+                   encode_payload(entry.get("extracted_data")), entry.get("notes"))
+
+    def get(self, field: str, default=None):
+        """Field of the entry dict, decoded (same as to_entry().get(field))."""
+        if field in ("log_id", "thread_id"):
+            return _unpack_id(getattr(self, field))
+        if field == "timestamp":
+            return _unpack_timestamp(self.timestamp)
+        if field == "extracted_data":
+            return decode_payload(self.payload)
+        if field in ENTRY_FIELDS:
+            return getattr(self, field)
+        return default
+
+    def to_entry(self) -> dict:
+        return {
+            "log_id": _unpack_id(self.log_id),
+            "timestamp": _unpack_timestamp(self.timestamp),
+            "thread_id": _unpack_id(self.thread_id),
+            "source_identifier": self.source_identifier,
+            "source_type": self.source_type,
+            "classified_format": self.classified_format,
+            "classified_intent": self.classified_intent,
+            "agent_processed": self.agent_processed,
+            "extracted_data": decode_payload(self.payload),
+            "notes": self.notes
+        }
+
+    def resident_size(self) -> int:
+        """Bytes held by this record; interned categoricals are shared and not counted."""
+        size = sys.getsizeof(self)
+        for value in (self.log_id, self.timestamp, self.thread_id, self.source_identifier, self.payload):
+            size += sys.getsizeof(value) if value is not None else 0
+        return size
+
+    # Storage rows: (log_id, timestamp, thread_id, source_identifier, source_type, classified_format,
+    # classified_intent, agent_processed, payload, notes). SQLite stores them as they are.
+
+    def to_row(self) -> tuple:
+        return (self.log_id, self.timestamp, self.thread_id, self.source_identifier, self.source_type,
+                self.classified_format, self.classified_intent, self.agent_processed, self.payload, self.notes)
+
+    @classmethod
+    def from_row(cls, row):
+        """Builds a record from a storage row, including rows written as plain text before
+        records were compact (string ids and timestamps, JSON text payloads)."""
+        log_id, timestamp, thread_id, source_identifier, source_type, classified_format, \
+            classified_intent, agent_processed, payload, notes = row
+        if isinstance(timestamp, str) and timestamp.isdigit(): # Integer stored in a TEXT column
+            timestamp = int(timestamp)
+        if not isinstance(payload, bytes):
+            payload = encode_payload(json.loads(payload) if payload else {})
+        return cls(_pack_id(log_id), _pack_timestamp(timestamp), _pack_id(thread_id), source_identifier,
+                   source_type, classified_format, classified_intent, agent_processed, payload, notes)
+
+    # JSON Lines: an array in row order; ids as unpadded base64 (non-UUID ids as a one-element
+    # list) and the payload as its JSON object when uncompressed, base64 otherwise.
+
+    def to_json(self) -> list:
+        def pack(value):
+            return base64.b64encode(value).decode('ascii').rstrip("=") if isinstance(value, bytes) else [value]
+        payload = json.loads(self.payload[1:]) if self.payload[0] == CODEC_RAW else \
+            base64.b64encode(self.payload).decode('ascii')
+        return [pack(self.log_id), self.timestamp, pack(self.thread_id), self.source_identifier, self.source_type,
+                self.classified_format, self.classified_intent, self.agent_processed, payload, self.notes]
+
+    @classmethod
+    def from_json(cls, value):
+        """Builds a record from a decoded JSON line: the compact array, or a plain entry dict."""
+        if isinstance(value, dict):
+            return cls.from_entry(value)
+        def unpack(packed):
+            return packed[0] if isinstance(packed, list) else base64.b64decode(packed + "=" * (-len(packed) % 4))
+        log_id, timestamp, thread_id, source_identifier, source_type, classified_format, \
+            classified_intent, agent_processed, payload, notes = value
+        payload = base64.b64decode(payload) if isinstance(payload, str) else \
+            bytes((CODEC_RAW,)) + json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode('utf-8')
+        return cls(unpack(log_id), timestamp, unpack(thread_id), source_identifier, source_type, classified_format,
+                   classified_intent, agent_processed, payload, notes)
+
+
+def as_record(entry) -> MemoryRecord:
+    return entry if isinstance(entry, MemoryRecord) else MemoryRecord.from_entry(entry)
@@ -3,13 +3,165 @@ import json
 import datetime
 import uuid
 import os
+import sys
+import atexit
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from .record import MemoryRecord
+from .storage import create_storage, migrate_json_log
+from .index import MemoryIndex
+from utils.metrics import metrics
+
+MEMORY_FILE = "shared_memory_log.json" # Legacy single-file log, migrated into the store on first start
+MEMORY_BACKEND = os.getenv("MEMORY_BACKEND", "jsonl") # "jsonl" (append-only segments) or "sqlite" (WAL)
+MEMORY_STORE_PATH = os.getenv("MEMORY_STORE_PATH") or \
+    ("shared_memory_log.db" if MEMORY_BACKEND == "sqlite" else "shared_memory_log.d")
+MEMORY_FLUSH_EVERY = int(os.getenv("MEMORY_FLUSH_EVERY", "32"))
+MEMORY_FLUSH_INTERVAL = float(os.getenv("MEMORY_FLUSH_INTERVAL", "1.0")) # Max seconds an entry stays buffered
+MEMORY_CACHE_ENTRIES = int(os.getenv("MEMORY_CACHE_ENTRIES", "5000")) # Resident entries; older ones are paged in
+PAGE_SIZE = 1000 # Entries read from storage per batch when iterating
+
+
+def _deep_sizeof(obj) -> int:
+    if isinstance(obj, MemoryRecord):
+        return obj.resident_size()
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(_deep_sizeof(k) + _deep_sizeof(v) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(_deep_sizeof(v) for v in obj)
+    return size
+
+
+class LogView:
+    """Read-only sequence over every entry, in append order. Entries are fetched from the
+    SharedMemory working set or paged in from storage on access, so iterating the whole
+    history never holds more than one page of old entries."""
+
+    def __init__(self, memory):
+        self._memory = memory
+
+    def __len__(self):
+        return len(self._memory)
+
+    def __bool__(self):
+        return len(self._memory) > 0
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return self._memory.get_entries(range(*item.indices(len(self))))
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError("log index out of range")
+        return self._memory.get_entries([item])[0]
+
+    def __iter__(self):
+        return self._memory.iter_entries()
+
+    def __reversed__(self):
+        return self._memory.iter_entries(reverse=True)
 
-MEMORY_FILE = "shared_memory_log.json"
 
 class SharedMemory:
-    def __init__(self):
-        self.log = []
+    """Entry log backed by a storage engine. Only a bounded working set is resident: an LRU
+    of recently added or accessed entries (hot threads) plus entries not yet flushed.
+    Everything else is paged in from storage by position when queried; the indexes map
+    positions to storage locators. Resident entries are compact MemoryRecords, turned back
+    into the same dicts on access. Buffered entries are flushed by a background timer at least
+    every flush interval, even when no further entry is added."""
+
+    def __init__(self, storage=None, legacy_file: str = MEMORY_FILE, cache_entries: int = MEMORY_CACHE_ENTRIES):
+        self.storage = storage or create_storage(MEMORY_BACKEND, MEMORY_STORE_PATH, flush_every=MEMORY_FLUSH_EVERY,
+                                                 flush_interval=MEMORY_FLUSH_INTERVAL)
+        self.legacy_file = legacy_file
+        self.cache_entries = cache_entries
+        self.log = LogView(self)
+        self.index = MemoryIndex()
+        self._lock = threading.RLock() # add_entry may be called from concurrent batch workers
+        self._locators = array('q') # Position -> storage locator, for flushed entries
+        self._pending = {} # Position -> MemoryRecord not yet flushed (always resident)
+        self._cache = OrderedDict() # Position -> MemoryRecord, least recently used first
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._flusher = None # Started with the first buffered entry
         self.load_from_file()
+        atexit.register(self.save_to_file)
+
+    def __len__(self):
+        return len(self._locators) + len(self._pending)
+
+    def _record_flushed(self, locators: list):
+        # Storage flushes in append order, so the flushed entries are the oldest pending ones
+        for locator in locators:
+            position = len(self._locators)
+            self._locators.append(locator)
+            self._remember(position, self._pending.pop(position))
+
+    def _remember(self, position: int, record: MemoryRecord):
+        self._cache[position] = record
+        self._cache.move_to_end(position)
+        while len(self._cache) > self.cache_entries:
+            self._cache.popitem(last=False)
+
+    def get_entries(self, positions) -> list:
+        """Entries at the given positions, in the same order; missing ones are read from storage in one batch."""
+        positions = list(positions)
+        with self._lock:
+            entries = [None] * len(positions)
+            missing = []
+            for i, position in enumerate(positions):
+                entry = self._pending.get(position)
+                if entry is None:
+                    entry = self._cache.get(position)
+                    if entry is not None:
+                        self._cache.move_to_end(position)
+                if entry is None:
+                    missing.append(i)
+                else:
+                    entries[i] = entry
+            self.cache_hits += len(positions) - len(missing)
+            self.cache_misses += len(missing)
+            if missing:
+                loaded = self.storage.read([self._locators[positions[i]] for i in missing])
+                for i, record in zip(missing, loaded):
+                    entries[i] = record
+                    self._remember(positions[i], record)
+        return [record.to_entry() for record in entries]
+
+    def iter_entries(self, positions=None, reverse: bool = False):
+        """Yields entries page by page without adding old pages to the working set."""
+        if positions is None:
+            positions = range(len(self))
+        if reverse:
+            positions = positions[::-1]
+        for start in range(0, len(positions), PAGE_SIZE):
+            page = positions[start:start + PAGE_SIZE]
+            with self._lock:
+                entries = [self._pending.get(p) or self._cache.get(p) for p in page]
+                missing = [i for i, e in enumerate(entries) if e is None]
+                if missing:
+                    loaded = self.storage.read([self._locators[page[i]] for i in missing])
+                    for i, record in zip(missing, loaded):
+                        entries[i] = record
+            for record in entries:
+                yield record.to_entry()
+
+    def memory_usage(self) -> dict:
+        """Size of the resident working set and the indexes."""
+        with self._lock:
+            resident = list(self._cache.values()) + list(self._pending.values())
+            lookups = self.cache_hits + self.cache_misses
+            return {
+                "entries": len(self),
+                "resident_entries": len(resident),
+                "cache_capacity": self.cache_entries,
+                "resident_bytes": sum(_deep_sizeof(e) for e in resident),
+                "locator_bytes": self._locators.itemsize * len(self._locators),
+                "cache_hit_rate": round(self.cache_hits / lookups, 4) if lookups else 0.0,
+            }
 
     def add_entry(self, source_identifier: str, source_type: str, classified_format: str = None,
                   classified_intent: str = None, agent_processed: str = None,
@@ -29,34 +181,126 @@ class SharedMemory:
             "extracted_data": extracted_data if extracted_data else {},
             "notes": notes
         }
-        self.log.append(entry)
-        self.save_to_file()
+        metrics.bind_thread(thread_id)
+        with metrics.span("memory_write", agent_processed), self._lock:
+            position = len(self)
+            self.index.add(position, entry)
+            record = MemoryRecord.from_entry(entry)
+            self._pending[position] = record
+            self._record_flushed(self.storage.append(record))
+            if self._pending and self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_periodically, name="memory-flush", daemon=True)
+                self._flusher.start()
         print(f"Memory Added: {entry['log_id']} for thread {thread_id}")
         return thread_id
 
+    async def aadd_entry(self, **kwargs):
+        """add_entry for event loops. Buffering an entry is done inline; a write that would flush
+        to disk, or that would wait for another writer holding the lock, runs on a worker thread
+        so the loop never blocks on file I/O."""
+        if not self.storage.flush_due() and self._lock.acquire(blocking=False):
+            try:
+                return self.add_entry(**kwargs)
+            finally:
+                self._lock.release()
+        import asyncio
+        return await asyncio.to_thread(self.add_entry, **kwargs)
+
     def get_last_entry_by_thread(self, thread_id: str):
-        thread_entries = [entry for entry in self.log if entry["thread_id"] == thread_id]
-        return thread_entries[-1] if thread_entries else None
+        positions = self.index.positions("thread_id", thread_id)
+        return self.get_entries([positions[-1]])[0] if positions else None
 
     def get_full_thread_history(self, thread_id: str):
-        return [entry for entry in self.log if entry["thread_id"] == thread_id]
+        return self.get_entries(self.index.positions("thread_id", thread_id))
+
+    def _matching(self, thread_id=None, source=None, intent=None, agent=None, since=None, until=None):
+        positions = self.index.query(thread_id=thread_id, source=source, intent=intent, agent=agent,
+                                     since=since, until=until)
+        return range(len(self)) if positions is None else positions
+
+    def query(self, thread_id: str = None, source: str = None, intent: str = None, agent: str = None,
+              since=None, until=None, limit: int = None, newest_first: bool = False, offset: int = 0) -> list:
+        """Returns entries matching all given filters using the in-memory indexes.
+        `since`/`until` accept ISO strings or datetimes and are inclusive. `offset` and `limit`
+        select a page (counted from the newest entry with `newest_first`); only that page is read."""
+        positions = self._matching(thread_id, source, intent, agent, since, until)
+        if newest_first:
+            end = max(len(positions) - offset, 0)
+            positions = positions[max(end - limit, 0) if limit is not None else 0:end][::-1]
+        else:
+            positions = positions[offset:None if limit is None else offset + limit]
+        return self.get_entries(positions)
+
+    def count(self, thread_id: str = None, source: str = None, intent: str = None, agent: str = None,
+              since=None, until=None) -> int:
+        """Number of entries `query` would match with the same filters (index lookup only)."""
+        return len(self._matching(thread_id, source, intent, agent, since, until))
+
+    def _flush_periodically(self):
+        # Storage only checks its flush interval on the next append; a quiet service (the IMAP
+        # loop between messages) would otherwise keep entries buffered indefinitely
+        interval = getattr(self.storage, "flush_interval", MEMORY_FLUSH_INTERVAL)
+        while True:
+            time.sleep(interval)
+            if self._pending:
+                self.save_to_file()
 
     def save_to_file(self):
-        with open(MEMORY_FILE, 'w') as f:
-            json.dump(self.log, f, indent=4)
+        """Forces buffered entries to disk. Entries are appended, never rewritten."""
+        with self._lock:
+            self._record_flushed(self.storage.flush())
+
+    def _rebuild(self):
+        with self._lock:
+            self.save_to_file()
+            self.index.clear()
+            self._locators = array('q')
+            self._pending = {}
+            self._cache = OrderedDict()
+            # Streams the store once to rebuild the indexes; only the newest entries stay resident
+            for position, (locator, record) in enumerate(self.storage.scan()):
+                self.index.add(position, record)
+                self._locators.append(locator)
+                self._remember(position, record)
 
     def load_from_file(self):
-        if os.path.exists(MEMORY_FILE):
+        self._rebuild()
+        # The scan tells whether the store is empty; only then is a legacy log migrated
+        if not len(self) and self.legacy_file and os.path.exists(self.legacy_file):
             try:
-                with open(MEMORY_FILE, 'r') as f:
-                    self.log = json.load(f)
-                print(f"Loaded {len(self.log)} entries from {MEMORY_FILE}")
+                migrated = migrate_json_log(self.legacy_file, self.storage)
+                print(f"Migrated {migrated} entries from {self.legacy_file} to {self.storage.location}")
+                self._rebuild()
             except json.JSONDecodeError:
-                print(f"Warning: Could not decode {MEMORY_FILE}. Starting with empty memory.")
-                self.log = []
+                print(f"Warning: Could not decode {self.legacy_file}. Skipping migration.")
+        if len(self):
+            print(f"Loaded {len(self)} entries from {self.storage.location}")
         else:
-            print(f"{MEMORY_FILE} not found. Starting with empty memory.")
-            self.log = []
+            print(f"No entries in {self.storage.location}. Starting with empty memory.")
+
+    def refresh(self) -> int:
+        """Tails the store for entries written by other processes since the last load/refresh
+        and appends them to the indexes. Returns how many were added."""
+        with self._lock:
+            self.save_to_file() # Own pending entries must hold their positions before foreign ones are added
+            added = 0
+            for locator, record in self.storage.tail():
+                position = len(self)
+                self.index.add(position, record)
+                self._locators.append(locator)
+                self._remember(position, record)
+                added += 1
+        return added
+
+    def wait_for_changes(self, timeout: float = None, poll_interval: float = 0.5) -> int:
+        """Blocks until another process writes to the store (or `timeout` passes), then
+        refreshes. Change checks are a stat / PRAGMA, not a re-read."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.storage.changed():
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            time.sleep(poll_interval)
+        return self.refresh()
 
     def print_log(self):
         print("\n--- Shared Memory Log ---")
@@ -64,4 +308,20 @@ class SharedMemory:
             print(json.dumps(entry, indent=2))
         print("-------------------------\n")
 
-shared_memory_instance = SharedMemory()
\ No newline at end of file
+_shared_memory = None
+_shared_memory_lock = threading.Lock()
+
+def get_shared_memory() -> SharedMemory:
+    """The process-wide SharedMemory, opened (and its indexes loaded) on first call."""
+    global _shared_memory
+    if _shared_memory is None:
+        with _shared_memory_lock:
+            if _shared_memory is None:
+                _shared_memory = SharedMemory()
+    return _shared_memory
+
+def __getattr__(name):
+    # `shared_memory_instance` stays importable but is only created when first accessed
+    if name == "shared_memory_instance":
+        return get_shared_memory()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
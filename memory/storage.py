@@ -0,0 +1,457 @@
+# memory/storage.py
+import contextlib
+import json
+import os
+import sqlite3
+import threading
+import time
+try:
+    import fcntl # POSIX advisory locks for multi-process appends
+except ImportError:
+    fcntl = None
+from .record import ENTRY_FIELDS, MemoryRecord, as_record
+
+MEMORY_FSYNC = os.getenv("MEMORY_FSYNC", "0") == "1" # fsync every batch (durable across power loss, slower)
+
+
+class JSONLStorage:
+    """Append-only JSON Lines store. Entries are buffered and written in batches to
+    numbered segment files inside `directory`; nothing already on disk is rewritten.
+    Every stored entry has an integer locator (segment number and byte offset) that
+    `read` uses to fetch it again without scanning. Entries are stored as compact
+    MemoryRecord lines; lines written as plain entry dicts are still read.
+    Several processes can share a directory: each batch is written with one write() while
+    holding an exclusive lock on `directory/.lock`, and `tail` returns what other
+    processes appended since this instance last looked."""
+
+    SEGMENT_PREFIX = "segment-"
+    SEGMENT_SUFFIX = ".jsonl"
+    OFFSET_BITS = 40 # Locator = segment number << 40 | byte offset
+    LOCK_FILE = ".lock"
+
+    def __init__(self, directory: str, flush_every: int = 32, flush_interval: float = 1.0,
+                 segment_max_bytes: int = 64 * 1024 * 1024, fsync: bool = MEMORY_FSYNC):
+        self.directory = directory
+        self.flush_every = max(1, flush_every)
+        self.flush_interval = flush_interval
+        self.segment_max_bytes = segment_max_bytes
+        self.fsync = fsync
+        self._buffer = []
+        self._last_flush = time.monotonic()
+        self._lock = threading.RLock()
+        self._file = None
+        self._cursor = (0, 0) # (segment number, byte offset) read up to by scan/tail
+        self._own = set() # Locators this instance wrote past the cursor; tail skips them, then drops them
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock_file = open(os.path.join(self.directory, self.LOCK_FILE), 'a+b')
+        self._lock_depth = 0
+
+    @property
+    def location(self) -> str:
+        return self.directory
+
+    @contextlib.contextmanager
+    def _exclusive(self):
+        """Cross-process lock (no-op where fcntl is unavailable); re-entrant within this instance."""
+        with self._lock:
+            if self._lock_depth == 0 and fcntl:
+                fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0 and fcntl:
+                    fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _segment_paths(self):
+        names = sorted(n for n in os.listdir(self.directory)
+                       if n.startswith(self.SEGMENT_PREFIX) and n.endswith(self.SEGMENT_SUFFIX))
+        return [os.path.join(self.directory, n) for n in names]
+
+    def _segment_path(self, number: int) -> str:
+        return os.path.join(self.directory, f"{self.SEGMENT_PREFIX}{number:06d}{self.SEGMENT_SUFFIX}")
+
+    def _segment_number(self, path: str) -> int:
+        return int(os.path.basename(path)[len(self.SEGMENT_PREFIX):-len(self.SEGMENT_SUFFIX)])
+
+    def _open_active_segment(self):
+        # Called under the cross-process lock: another process may have started a new segment
+        segments = self._segment_paths()
+        if segments and os.path.getsize(segments[-1]) < self.segment_max_bytes:
+            path = segments[-1]
+        else:
+            path = self._segment_path(self._segment_number(segments[-1]) + 1 if segments else 1)
+        if self._file is None or self._file.name != path:
+            if self._file is not None:
+                self._file.close()
+            self._file = open(path, 'a+b')
+            self._file_number = self._segment_number(path)
+
+    @staticmethod
+    def _encode(entry) -> bytes:
+        return json.dumps(as_record(entry).to_json(), ensure_ascii=False, separators=(",", ":")).encode('utf-8')
+
+    def append(self, entry) -> list:
+        """Buffers an entry (dict or MemoryRecord). Returns the locators of the entries written
+        if this triggered a flush."""
+        with self._lock:
+            self._buffer.append(self._encode(entry))
+            if len(self._buffer) >= self.flush_every or \
+               time.monotonic() - self._last_flush >= self.flush_interval:
+                return self.flush()
+            return []
+
+    def flush_due(self) -> bool:
+        """True if the next append would flush, i.e. write to disk under the cross-process lock."""
+        return len(self._buffer) + 1 >= self.flush_every or \
+               time.monotonic() - self._last_flush >= self.flush_interval
+
+    def append_many(self, entries) -> list:
+        with self._lock:
+            self._buffer.extend(self._encode(e) for e in entries)
+            return self.flush()
+
+    def flush(self) -> list:
+        """Writes buffered entries and returns their locators, in append order."""
+        with self._lock:
+            self._last_flush = time.monotonic()
+            if not self._buffer:
+                return []
+            with self._exclusive():
+                self._open_active_segment()
+                offset = self._file.seek(0, os.SEEK_END)
+                data = b"\n".join(self._buffer) + b"\n"
+                if offset:
+                    self._file.seek(offset - 1)
+                    if self._file.read(1) != b"\n":
+                        data = b"\n" + data # Seal a line torn by a crashed writer
+                        offset += 1
+                base = self._file_number << self.OFFSET_BITS
+                locators = []
+                for line in self._buffer:
+                    locators.append(base | offset)
+                    offset += len(line) + 1
+                self._file.write(data)
+                self._file.flush()
+                if self.fsync:
+                    os.fsync(self._file.fileno())
+                if self._caught_up(self._file_number, locators[0] & ((1 << self.OFFSET_BITS) - 1)):
+                    self._cursor = (self._file_number, offset) # Nothing foreign in between: skip over our own batch
+                else:
+                    self._own.update(locators)
+            self._buffer = []
+            return locators
+
+    def _caught_up(self, number: int, offset: int) -> bool:
+        """True if the cursor sits exactly at (number, offset), i.e. nothing unread lies before it."""
+        segment, cursor_offset = self._cursor
+        if segment == number:
+            return cursor_offset == offset
+        if segment == number - 1 and offset == 0:
+            path = self._segment_path(segment)
+            return cursor_offset == (os.path.getsize(path) if os.path.exists(path) else 0)
+        return False
+
+    def _read_new(self):
+        """Yields (locator, MemoryRecord) after the cursor, advancing it. Stops at a line that is
+        still being written (no trailing newline yet)."""
+        for path in self._segment_paths():
+            number = self._segment_number(path)
+            segment, offset = self._cursor
+            if number < segment:
+                continue
+            start = offset if number == segment else 0
+            base = number << self.OFFSET_BITS
+            with open(path, 'rb') as f:
+                f.seek(start)
+                position = start
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        return
+                    line_offset, position = position, position + len(line)
+                    self._cursor = (number, position)
+                    if not line.strip():
+                        continue
+                    try:
+                        yield base | line_offset, MemoryRecord.from_json(json.loads(line))
+                    except json.JSONDecodeError:
+                        # A torn line from a crash mid-write; skip it rather than fail.
+                        print(f"Warning: Skipping unreadable line at offset {line_offset} in {path}")
+            self._cursor = (number, position)
+
+    def scan(self):
+        """Yields (locator, MemoryRecord) for every stored entry, oldest first, one at a time."""
+        with self._lock:
+            self._cursor = (0, 0)
+            self._own.clear()
+        yield from self._read_new()
+
+    def tail(self) -> list:
+        """(locator, MemoryRecord) for entries other writers appended since the last scan/tail."""
+        with self._lock:
+            return _foreign(self._read_new(), self._own)
+
+    def changed(self) -> bool:
+        """Cheap check (one stat) for data past the cursor."""
+        segments = self._segment_paths()
+        if not segments:
+            return False
+        number = self._segment_number(segments[-1])
+        segment, offset = self._cursor
+        return number > segment or os.path.getsize(segments[-1]) > offset
+
+    def read(self, locators) -> list:
+        """MemoryRecords at the given locators, in the same order."""
+        mask = (1 << self.OFFSET_BITS) - 1
+        entries = [None] * len(locators)
+        by_segment = {}
+        for i, locator in enumerate(locators):
+            by_segment.setdefault(locator >> self.OFFSET_BITS, []).append((locator & mask, i))
+        for number, wanted in by_segment.items():
+            with open(self._segment_path(number), 'rb') as f:
+                for offset, i in sorted(wanted):
+                    f.seek(offset)
+                    entries[i] = MemoryRecord.from_json(json.loads(f.readline()))
+        return entries
+
+    def load_all(self) -> list:
+        """Every entry as a plain dict."""
+        self.flush()
+        return [record.to_entry() for _, record in self.scan()]
+
+    def import_if_empty(self, entries) -> int:
+        """Appends `entries` only if the store is empty, atomically with respect to other
+        processes (so concurrent first starts migrate a legacy log once). Returns the count written."""
+        with self._exclusive():
+            if self._buffer or any(os.path.getsize(path) for path in self._segment_paths()):
+                return 0
+            return len(self.append_many(entries))
+
+    def count(self) -> int:
+        with self._lock:
+            total = len(self._buffer)
+            for path in self._segment_paths():
+                with open(path, 'rb') as f:
+                    total += sum(1 for line in f if line.strip())
+            return total
+
+    def close(self):
+        with self._lock:
+            self.flush()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self._lock_file.close()
+
+
+class SQLiteStorage:
+    """SQLite store in WAL mode. Entries are buffered and inserted in one transaction per batch.
+    An entry's locator is its `seq`. Several processes can share the database: batches are
+    inserted in BEGIN IMMEDIATE transactions, so seq order is commit order and `tail` can
+    follow other writers by seq. Rows hold MemoryRecord fields (UUIDs and extracted_data as
+    BLOBs, the timestamp as an INTEGER); rows of databases created with TEXT columns are still read."""
+
+    def __init__(self, db_path: str, flush_every: int = 32, flush_interval: float = 1.0,
+                 fsync: bool = MEMORY_FSYNC):
+        self.db_path = db_path
+        self.flush_every = max(1, flush_every)
+        self.flush_interval = flush_interval
+        self._buffer = []
+        self._last_flush = time.monotonic()
+        self._lock = threading.RLock()
+        self._cursor = 0 # Highest seq read by scan/tail
+        self._own = set() # Seqs this instance wrote past the cursor; tail skips them, then drops them
+        # Autocommit mode: transactions are opened explicitly with BEGIN IMMEDIATE
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(f"PRAGMA synchronous={'FULL' if fsync else 'NORMAL'}")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                log_id BLOB NOT NULL,
+                timestamp INTEGER,
+                thread_id BLOB,
+                source_identifier TEXT,
+                source_type TEXT,
+                classified_format TEXT,
+                classified_intent TEXT,
+                agent_processed TEXT,
+                extracted_data BLOB,
+                notes TEXT
+            )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_thread ON entries(thread_id)")
+        self._data_version = None
+
+    @property
+    def location(self) -> str:
+        return self.db_path
+
+    @staticmethod
+    def _to_row(entry) -> tuple:
+        return as_record(entry).to_row()
+
+    @staticmethod
+    def _from_row(row) -> MemoryRecord:
+        return MemoryRecord.from_row(row)
+
+    def append(self, entry) -> list:
+        """Buffers an entry (dict or MemoryRecord). Returns the locators of the entries written
+        if this triggered a flush."""
+        with self._lock:
+            self._buffer.append(self._to_row(entry))
+            if len(self._buffer) >= self.flush_every or \
+               time.monotonic() - self._last_flush >= self.flush_interval:
+                return self.flush()
+            return []
+
+    def flush_due(self) -> bool:
+        """True if the next append would flush, i.e. write to disk under the cross-process lock."""
+        return len(self._buffer) + 1 >= self.flush_every or \
+               time.monotonic() - self._last_flush >= self.flush_interval
+
+    def append_many(self, entries) -> list:
+        with self._lock:
+            self._buffer.extend(self._to_row(e) for e in entries)
+            return self.flush()
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        # IMMEDIATE takes the write lock up front, so concurrent writers queue (up to the
+        # connection timeout) instead of failing when upgrading a read transaction
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+
+    def flush(self) -> list:
+        """Inserts buffered entries and returns their seq values, in append order."""
+        with self._lock:
+            self._last_flush = time.monotonic()
+            if not self._buffer:
+                return []
+            placeholders = ", ".join("?" for _ in ENTRY_FIELDS)
+            with self._transaction():
+                # Explicit seq values so the caller learns each entry's locator
+                first = self._conn.execute("SELECT COALESCE(MAX(seq), 0) + 1 FROM entries").fetchone()[0]
+                seqs = list(range(first, first + len(self._buffer)))
+                self._conn.executemany(
+                    f"INSERT INTO entries (seq, {', '.join(ENTRY_FIELDS)}) VALUES (?, {placeholders})",
+                    [(seq,) + row for seq, row in zip(seqs, self._buffer)])
+            if self._cursor == first - 1:
+                self._cursor = seqs[-1] # Nothing foreign in between: skip over our own batch
+            else:
+                self._own.update(seqs)
+            self._buffer = []
+            return seqs
+
+    def _read_new(self, batch_size: int = 1000):
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT seq, {', '.join(ENTRY_FIELDS)} FROM entries WHERE seq > ? ORDER BY seq LIMIT ?",
+                    (self._cursor, batch_size)).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                self._cursor = row[0]
+                yield row[0], self._from_row(row[1:])
+
+    def scan(self):
+        """Yields (seq, MemoryRecord) for every stored entry, oldest first, reading in batches."""
+        with self._lock:
+            self._cursor = 0
+            self._own.clear()
+        yield from self._read_new()
+
+    def tail(self) -> list:
+        """(seq, MemoryRecord) for entries other writers inserted since the last scan/tail."""
+        with self._lock:
+            return _foreign(self._read_new(), self._own)
+
+    def changed(self) -> bool:
+        """Cheap check for commits by other connections (PRAGMA data_version)."""
+        with self._lock:
+            version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            changed = version != self._data_version
+            self._data_version = version
+            return changed
+
+    def read(self, locators) -> list:
+        """MemoryRecords with the given seq values, in the same order."""
+        found = {}
+        locators = list(locators)
+        with self._lock:
+            for start in range(0, len(locators), 500):
+                chunk = locators[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT seq, {', '.join(ENTRY_FIELDS)} FROM entries WHERE seq IN ({', '.join('?' for _ in chunk)})",
+                    chunk)
+                for row in rows:
+                    found[row[0]] = self._from_row(row[1:])
+        return [found.get(seq) for seq in locators]
+
+    def load_all(self) -> list:
+        """Every entry as a plain dict."""
+        self.flush()
+        return [record.to_entry() for _, record in self.scan()]
+
+    def import_if_empty(self, entries) -> int:
+        """Inserts `entries` only if the table is empty, in one transaction. Returns the count written."""
+        with self._lock:
+            self.flush()
+            rows = [self._to_row(e) for e in entries]
+            placeholders = ", ".join("?" for _ in ENTRY_FIELDS)
+            with self._transaction():
+                if self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]:
+                    return 0
+                self._conn.executemany(
+                    f"INSERT INTO entries ({', '.join(ENTRY_FIELDS)}) VALUES ({placeholders})", rows)
+            return len(rows)
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0] + len(self._buffer)
+
+    def close(self):
+        with self._lock:
+            self.flush()
+            self._conn.close()
+
+
+def _foreign(new_entries, own: set) -> list:
+    """The (locator, record) pairs not written by this instance. Own locators are dropped from
+    `own` as the cursor passes them, since they can never be read again."""
+    foreign = []
+    for locator, entry in new_entries:
+        if locator in own:
+            own.discard(locator)
+        else:
+            foreign.append((locator, entry))
+    return foreign
+
+
+STORAGE_BACKENDS = {
+    "jsonl": JSONLStorage,
+    "sqlite": SQLiteStorage,
+}
+
+
+def create_storage(backend: str, path: str, **kwargs):
+    """Builds a storage engine by name ('jsonl' or 'sqlite')."""
+    try:
+        storage_cls = STORAGE_BACKENDS[backend.lower()]
+    except KeyError:
+        raise ValueError(f"Unknown memory backend '{backend}'. Choose one of: {', '.join(STORAGE_BACKENDS)}")
+    return storage_cls(path, **kwargs)
+
+
+def migrate_json_log(json_path: str, storage) -> int:
+    """Copies every entry of a legacy single-file JSON log into `storage` in one batch, unless
+    the store already has entries (e.g. another process migrated first). Returns the number migrated."""
+    with open(json_path, 'r') as f:
+        entries = json.load(f)
+    return storage.import_if_empty(entries)
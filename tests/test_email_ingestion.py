@@ -0,0 +1,114 @@
+# tests/test_email_ingestion.py
+"""UID checkpointing and batched fetching of email_automation_service against utils.fake_imap."""
+import pytest
+
+from email_automation_service import EmailIngestor, UIDCheckpoint
+from utils.fake_imap import FakeMailbox
+
+
+def _message(n: int) -> bytes:
+    return f"From: sender{n}@example.com\r\nSubject: RFQ {n}\r\n\r\nPlease quote {n} units.".encode()
+
+
+class RecordingClassifier:
+    """Stands in for ClassifierAgent; records what the workers hand it."""
+
+    def __init__(self):
+        self.calls = []
+
+    def process(self, input_data, source_identifier=None, source_type=None):
+        self.calls.append(source_identifier)
+        return f"thread-{len(self.calls)}", {}
+
+
+class FailingJobQueue:
+    """Job queue whose enqueue fails for the UIDs in `fail_uids` (then accepts them)."""
+
+    def __init__(self, fail_uids=()):
+        self.fail_uids = set(fail_uids)
+        self.enqueued = []
+
+    def enqueue(self, dedup_key=None, **job):
+        uid = int(dedup_key.rsplit(":", 1)[1])
+        if uid in self.fail_uids:
+            self.fail_uids.discard(uid)
+            raise RuntimeError("database is locked")
+        self.enqueued.append(uid)
+        return len(self.enqueued)
+
+
+@pytest.fixture
+def checkpoint(tmp_path):
+    return UIDCheckpoint(str(tmp_path / "checkpoint.json"))
+
+
+def test_out_of_order_done_never_passes_in_flight_uid(checkpoint, tmp_path):
+    for uid in (1, 2, 3):
+        checkpoint.started(uid)
+
+    checkpoint.done(3)
+    checkpoint.done(2)
+    assert checkpoint.last_uid == 0 # UID 1 is still being processed
+    assert checkpoint.next_after() == 3 # ...but 2 and 3 are not handed out again
+
+    checkpoint.done(1)
+    assert checkpoint.last_uid == 3
+    assert UIDCheckpoint(str(tmp_path / "checkpoint.json")).last_uid == 3
+
+
+def test_done_advances_only_to_lowest_in_flight(checkpoint):
+    for uid in (4, 5, 6):
+        checkpoint.started(uid)
+
+    checkpoint.done(4)
+    checkpoint.done(6)
+    assert checkpoint.last_uid == 4
+
+
+def test_uidvalidity_change_resets_checkpoint(checkpoint, tmp_path):
+    checkpoint.check_uidvalidity(7)
+    checkpoint.started(10)
+    checkpoint.done(10)
+    assert checkpoint.last_uid == 10
+
+    checkpoint.check_uidvalidity(7)
+    assert checkpoint.last_uid == 10
+
+    checkpoint.check_uidvalidity(8)
+    assert checkpoint.last_uid is None
+    assert checkpoint.next_after() is None
+    reloaded = UIDCheckpoint(str(tmp_path / "checkpoint.json"))
+    assert (reloaded.last_uid, reloaded.uidvalidity) == (None, 8)
+
+
+def test_drain_once_fetches_in_batches(checkpoint):
+    mailbox = FakeMailbox()
+    for n in range(5):
+        mailbox.deliver(_message(n))
+    classifier = RecordingClassifier()
+    ingestor = EmailIngestor(mailbox, classifier, checkpoint, workers=1, batch_size=2, queue_size=10)
+
+    assert ingestor.drain_once() == 5
+    assert mailbox.fetch_calls == 3 # UIDs [1, 2], [3, 4], [5]
+
+    ingestor.start()
+    ingestor.stop()
+    assert len(classifier.calls) == 5
+    assert checkpoint.last_uid == 5
+    assert ingestor.drain_once() == 0
+    assert mailbox.fetch_calls == 3
+
+
+def test_failed_enqueue_is_fetched_again(checkpoint):
+    mailbox = FakeMailbox()
+    for n in range(3):
+        mailbox.deliver(_message(n))
+    ingestor = EmailIngestor(mailbox, RecordingClassifier(), checkpoint, workers=1, batch_size=10)
+    ingestor.job_queue = FailingJobQueue(fail_uids={2})
+
+    assert ingestor.drain_once() == 1
+    assert checkpoint.last_uid == 1
+
+    assert ingestor.drain_once() == 2
+    assert ingestor.job_queue.enqueued == [1, 2, 3]
+    assert checkpoint.last_uid == 3
@@ -0,0 +1,99 @@
+# tests/test_llm_retries.py
+"""Retry behaviour of utils.llm_utils against utils.fake_model.FakeGenerativeModel."""
+import pytest
+
+from utils import llm_utils
+from utils.fake_model import FakeAPIError, FakeGenerativeModel
+from utils.rate_limiter import (FATAL, RATE_LIMITED, TRANSIENT, RateLimiter, RetryBudget, RetryPolicy,
+                                classify_error)
+
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    """Installs a fresh retry policy, budget and unlimited rate limiter, disables the response
+    cache, records backoff sleeps instead of sleeping, and returns a helper that installs a
+    FakeGenerativeModel."""
+    sleeps = []
+    monkeypatch.setattr(llm_utils, "rate_limiter", RateLimiter())
+    monkeypatch.setattr(llm_utils, "retry_policy", RetryPolicy(max_attempts=3, base_delay=0.5, max_delay=2.0))
+    monkeypatch.setattr(llm_utils, "retry_budget", RetryBudget())
+    monkeypatch.setattr(llm_utils.time, "sleep", sleeps.append)
+    monkeypatch.setattr(llm_utils, "model", None)
+    monkeypatch.setattr(llm_utils, "response_cache", None) # Never touch the on-disk cache
+    monkeypatch.setattr(llm_utils, "_cache_initialized", True)
+
+    def install(**kwargs):
+        model = FakeGenerativeModel(**kwargs)
+        llm_utils.set_model(model)
+        return model
+
+    install.sleeps = sleeps
+    return install
+
+
+@pytest.mark.parametrize("error, kind", [
+    (FakeAPIError(429, "quota exceeded"), RATE_LIMITED),
+    (FakeAPIError(503, "service unavailable"), TRANSIENT),
+    (ConnectionError("connection reset"), TRANSIENT),
+    (FakeAPIError(400, "invalid argument"), FATAL),
+    (FakeAPIError(403, "permission denied"), FATAL),
+    (ValueError("bad prompt"), FATAL),
+])
+def test_classify_error(error, kind):
+    assert classify_error(error) == kind
+
+
+def test_backoff_stays_within_policy_bounds():
+    policy = RetryPolicy(max_attempts=6, base_delay=0.5, max_delay=4.0)
+    for attempt in range(1, 7):
+        for _ in range(50):
+            assert 0 <= policy.delay(attempt) <= min(4.0, 0.5 * 2 ** attempt)
+
+
+def test_retry_budget_caps_retries():
+    budget = RetryBudget(ratio=0.5, min_retries_per_window=1)
+    for _ in range(4):
+        budget.record_request()
+    assert [budget.try_spend() for _ in range(3)] == [True, True, False]
+
+
+def test_retryable_errors_are_retried_then_answered(fake_llm):
+    model = fake_llm(errors=[FakeAPIError(429, "quota exceeded"), FakeAPIError(503, "service unavailable")],
+                     default_response="Invoice")
+
+    assert llm_utils.call_gemini("Primary Intent:", use_cache=False) == "Invoice"
+    assert model.call_count == 3
+    assert len(fake_llm.sleeps) == 2
+    assert all(0 <= delay <= 2.0 for delay in fake_llm.sleeps)
+
+
+def test_exhausted_retries_return_error_marker(fake_llm):
+    model = fake_llm(errors=[FakeAPIError(503, "service unavailable")] * 10)
+
+    answer = llm_utils.call_gemini("Urgency:", use_cache=False)
+
+    assert answer.startswith(llm_utils.LLM_ERROR_PREFIX)
+    assert llm_utils.is_llm_error(answer)
+    assert model.call_count == llm_utils.retry_policy.max_attempts
+    assert len(fake_llm.sleeps) == llm_utils.retry_policy.max_attempts - 1
+
+
+def test_fatal_error_is_not_retried(fake_llm):
+    model = fake_llm(errors=[FakeAPIError(400, "invalid argument")])
+
+    answer = llm_utils.call_gemini("Urgency:", use_cache=False)
+
+    assert answer.startswith(llm_utils.LLM_ERROR_PREFIX)
+    assert model.call_count == 1
+    assert fake_llm.sleeps == []
+
+
+def test_empty_retry_budget_stops_retries(fake_llm, monkeypatch):
+    monkeypatch.setattr(llm_utils, "retry_budget", RetryBudget(ratio=0, min_retries_per_window=0))
+    model = fake_llm(errors=[FakeAPIError(429, "quota exceeded")] * 10)
+
+    answer = llm_utils.call_gemini("Urgency:", use_cache=False)
+
+    assert answer.startswith(llm_utils.LLM_ERROR_PREFIX)
+    assert model.call_count == 1
+    assert fake_llm.sleeps == []
@@ -0,0 +1,182 @@
+# utils/batch_inputs.py
+import email
+import glob
+import hashlib
+import json
+import mailbox
+import os
+import re
+import sys
+from .email_parse import decode_subject, fetch_email_body
+from .json_stream import JSON_EXTENSIONS, JSON_LINES_EXTENSIONS, JSONDocumentStream
+
+TEXT_EXTENSIONS = (".txt", ".eml", ".md")
+MBOX_EXTENSIONS = (".mbox", ".mbx")
+# Files picked up when walking a directory; anything else is ignored
+BATCH_EXTENSIONS = TEXT_EXTENSIONS + JSON_EXTENSIONS + MBOX_EXTENSIONS + (".pdf",)
+HASH_CHUNK_BYTES = 1 << 20
+SQLITE_SIDECAR_SUFFIXES = ("-wal", "-shm", "-journal")
+# mbox envelope line: "From <sender> <asctime date>", e.g. "From jane@example.com Mon Jun  2 09:15:01 2025"
+MBOX_ENVELOPE_RE = re.compile(rb"From \S+ +\w{3} +\w{3} +\d{1,2} +\d{1,2}:\d{2}(?::\d{2})?(?: +\S+)? +\d{4}\s*$")
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _is_maildir(path: str) -> bool:
+    return all(os.path.isdir(os.path.join(path, sub)) for sub in ("cur", "new", "tmp"))
+
+
+def store_paths() -> list:
+    """The pipeline's own state (memory store, legacy log, job queue, LLM cache), which must
+    never be read back as input."""
+    from memory.shared_memory import MEMORY_FILE, MEMORY_STORE_PATH
+    from .job_queue import JOB_QUEUE_PATH
+    from .llm_utils import LLM_CACHE_PATH
+    return [path for path in (MEMORY_STORE_PATH, MEMORY_FILE, JOB_QUEUE_PATH, LLM_CACHE_PATH) if path]
+
+
+def _excluded(path: str, exclude) -> bool:
+    real = os.path.realpath(path)
+    for suffix in SQLITE_SIDECAR_SUFFIXES:
+        if real.endswith(suffix):
+            real = real[:-len(suffix)]
+            break
+    return real in exclude or os.path.dirname(real) in exclude
+
+
+def _is_mbox(path: str) -> bool:
+    """Files with an mbox extension, or with no extension that start with an mbox envelope line."""
+    if path.lower().endswith(MBOX_EXTENSIONS):
+        return True
+    if os.path.splitext(path)[1]:
+        return False
+    with open(path, 'rb') as f:
+        return MBOX_ENVELOPE_RE.match(f.readline(1024)) is not None
+
+
+def _email_input(raw_message: bytes, source_identifier: str, source_type: str):
+    """Same text layout as the IMAP service hands to ClassifierAgent."""
+    msg = email.message_from_bytes(raw_message)
+    subject = decode_subject(msg) if msg["Subject"] else "(no subject)"
+    text = f"Subject: {subject}\n\nFrom: {msg.get('From')}\n\n{fetch_email_body(msg)}"
+    return content_hash(raw_message), {"input_data": text, "source_identifier": source_identifier,
+                                       "source_type": source_type}
+
+
+def _iter_mailbox(box, name: str, source_type: str):
+    try:
+        for key in sorted(box.keys()):
+            yield _email_input(box.get_bytes(key), f"{name}#{key}", source_type)
+    finally:
+        box.close()
+
+
+def _iter_json_records(documents: JSONDocumentStream, name: str, source_type: str):
+    try:
+        for i, document in enumerate(documents):
+            canonical = json.dumps(document, ensure_ascii=False, sort_keys=True).encode('utf-8')
+            yield content_hash(canonical), {"input_data": document, "source_identifier": f"{name}#{i}",
+                                            "source_type": source_type}
+    finally:
+        documents.close()
+
+
+def _iter_json_lines(source, name: str):
+    yield from _iter_json_records(JSONDocumentStream(source, filename=name), name, "batch_jsonl_record")
+
+
+def _iter_json_file(path: str):
+    """Records of a top-level JSON array (or JSON Lines saved as .json) one by one, like a
+    .jsonl file, so --workers and the manifest apply per record; a single object is one input."""
+    documents = JSONDocumentStream(path)
+    if documents.is_multi_document:
+        yield from _iter_json_records(documents, path, "batch_json_record")
+        return
+    documents.close()
+    # The classifier streams a single JSON document from its path
+    yield file_hash(path), {"input_data": path, "source_identifier": path, "source_type": "batch_file"}
+
+
+def iter_file(path: str):
+    """(content hash, ClassifierAgent.process kwargs) for each document in one file: every
+    message of an mbox, every record of a JSON Lines file or JSON array, or the file itself
+    (.eml files are parsed as a message)."""
+    lower = path.lower()
+    if lower.endswith(JSON_LINES_EXTENSIONS):
+        yield from _iter_json_lines(path, path)
+    elif _is_mbox(path):
+        yield from _iter_mailbox(mailbox.mbox(path, create=False), path, "batch_mbox")
+    elif lower.endswith(".eml"):
+        with open(path, 'rb') as f:
+            yield _email_input(f.read(), path, "batch_eml")
+    elif lower.endswith(JSON_EXTENSIONS):
+        yield from _iter_json_file(path)
+    elif lower.endswith(".pdf"):
+        # The classifier streams PDF files from their path
+        yield file_hash(path), {"input_data": path, "source_identifier": path, "source_type": "batch_file"}
+    else:
+        with open(path, 'rb') as f:
+            data = f.read()
+        yield content_hash(data), {"input_data": data.decode('utf-8', errors='replace'), "source_identifier": path,
+                                   "source_type": "batch_file"}
+
+
+def _is_batch_file(path: str) -> bool:
+    """Files a directory walk or glob expansion picks up; named files are always read."""
+    name = os.path.basename(path)
+    return name.lower().endswith(BATCH_EXTENSIONS) and not name.startswith(".")
+
+
+def iter_path(path: str, exclude=frozenset()):
+    """Documents under a path: '-' (JSON Lines on stdin), a Maildir, a directory (walked
+    recursively for BATCH_EXTENSIONS files and nested Maildirs, skipping hidden entries) or a
+    single file. Paths whose real path is in `exclude` (e.g. the run's own output or the
+    memory store directory) are skipped."""
+    if path == "-":
+        yield from _iter_json_lines(sys.stdin.buffer, "stdin.jsonl")
+    elif _excluded(path, exclude):
+        return
+    elif os.path.isdir(path):
+        if _is_maildir(path):
+            yield from _iter_mailbox(mailbox.Maildir(path, factory=None, create=False), path, "batch_maildir")
+            return
+        for root, dirs, files in os.walk(path):
+            dirs[:] = sorted(d for d in dirs if not d.startswith(".") and not _excluded(os.path.join(root, d), exclude))
+            for name in [d for d in dirs if _is_maildir(os.path.join(root, d))]:
+                dirs.remove(name)
+                yield from iter_path(os.path.join(root, name), exclude)
+            for name in sorted(files):
+                if _is_batch_file(name):
+                    yield from iter_path(os.path.join(root, name), exclude)
+    elif os.path.isfile(path):
+        yield from iter_file(path)
+    else:
+        print(f"Warning: {path} does not exist. Skipping.", file=sys.stderr)
+
+
+def iter_inputs(patterns, exclude=()):
+    """Expands files, directories and glob patterns (`**` recurses) into (content hash,
+    process kwargs) pairs, lazily, in a stable order. Files matched by a glob are filtered by
+    BATCH_EXTENSIONS like a directory walk; files named explicitly are read whatever their
+    extension. `exclude` lists files to leave out on top of the pipeline's own store files."""
+    exclude = frozenset(os.path.realpath(path) for path in [*exclude, *store_paths()])
+    for pattern in patterns:
+        if glob.has_magic(pattern) and not os.path.exists(pattern):
+            paths = sorted(glob.glob(pattern, recursive=True))
+            if not paths:
+                print(f"Warning: no files match {pattern}.", file=sys.stderr)
+            for path in paths:
+                if os.path.isdir(path) or _is_batch_file(path):
+                    yield from iter_path(path, exclude)
+        else:
+            yield from iter_path(pattern, exclude)
@@ -0,0 +1,155 @@
+# utils/dedup.py
+import hashlib
+import os
+import re
+import threading
+from collections import defaultdict
+from .text_normalize import normalize_for_matching
+
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "1") == "1"
+# What an exact duplicate does: "link" adds it to the prior thread, "reuse" (opt-in) opens a new
+# thread that reuses the prior results. Near duplicates are always processed in full and only
+# reference the earlier thread.
+DEDUP_MODE = os.getenv("DEDUP_MODE", "link")
+DEDUP_MINHASH_THRESHOLD = float(os.getenv("DEDUP_MINHASH_THRESHOLD", "0.85")) # Estimated Jaccard similarity
+DEDUP_SIMHASH_MAX_DISTANCE = int(os.getenv("DEDUP_SIMHASH_MAX_DISTANCE", "3")) # Hamming distance out of 64 bits
+
+NUM_PERMUTATIONS = 64
+LSH_BANDS = 16 # 16 bands x 4 rows: pairs above ~0.5 similarity become candidates
+SHINGLE_SIZE = 3 # Words per shingle
+MIN_SIGNATURE_CHARS = 40 # Shorter texts (e.g. a bare greeting) are too generic to deduplicate
+MAX_SIGNATURE_CHARS = 20000 # Signatures only look at the start of very long documents
+_MERSENNE_PRIME = (1 << 61) - 1
+_PERMUTATIONS = [
+    (int.from_bytes(hashlib.blake2b(f"a{i}".encode(), digest_size=8).digest(), "big") % _MERSENNE_PRIME | 1,
+     int.from_bytes(hashlib.blake2b(f"b{i}".encode(), digest_size=8).digest(), "big") % _MERSENNE_PRIME)
+    for i in range(NUM_PERMUTATIONS)
+]
+_WORD_RE = re.compile(r"\w+")
+
+
+def _hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), "big")
+
+
+def _minhash(words: list) -> list:
+    shingles = {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(max(1, len(words) - SHINGLE_SIZE + 1))}
+    hashes = [_hash64(s) for s in shingles]
+    # 32-bit values keep the stored signature small; collisions only nudge the estimate
+    return [min((a * h + b) % _MERSENNE_PRIME for h in hashes) & 0xFFFFFFFF for a, b in _PERMUTATIONS]
+
+
+def _simhash(words: list) -> int:
+    weights = [0] * 64
+    for word in words:
+        h = _hash64(word)
+        for bit in range(64):
+            weights[bit] += 1 if h >> bit & 1 else -1
+    return sum(1 << bit for bit in range(64) if weights[bit] > 0)
+
+
+def content_signature(text: str) -> dict:
+    """Exact hash plus MinHash and SimHash signatures of the normalized text, in a compact
+    JSON-friendly form (hex strings) suitable for storing in SharedMemory.
+    The exact hash keeps the signature block, so an exact match never depends on what was cut;
+    signature stripping only feeds the thresholded near-duplicate signatures.
+    Returns None when the text is too short to be matched meaningfully."""
+    normalized = normalize_for_matching(text)
+    if len(normalized) < MIN_SIGNATURE_CHARS:
+        return None
+    exact = normalize_for_matching(text, strip_signatures=False)
+    words = _WORD_RE.findall(normalized[:MAX_SIGNATURE_CHARS]) or [""]
+    return {
+        "sha256": hashlib.sha256(exact.encode('utf-8')).hexdigest(),
+        "simhash": f"{_simhash(words):016x}",
+        "minhash": "".join(f"{v:08x}" for v in _minhash(words)),
+    }
+
+
+def _minhash_values(signature: dict) -> list:
+    packed = signature["minhash"]
+    return [int(packed[i:i + 8], 16) for i in range(0, len(packed), 8)]
+
+
+def _band_keys(values: list) -> list:
+    rows = len(values) // LSH_BANDS
+    return [(band, tuple(values[band * rows:(band + 1) * rows])) for band in range(LSH_BANDS)]
+
+
+class DedupIndex:
+    """Finds earlier threads whose content is an exact or near duplicate of a new document.
+    Exact matches use the SHA-256 of the normalized text; near duplicates are found through
+    MinHash LSH buckets and confirmed by estimated Jaccard similarity or SimHash distance."""
+
+    def __init__(self, minhash_threshold: float = DEDUP_MINHASH_THRESHOLD,
+                 simhash_max_distance: int = DEDUP_SIMHASH_MAX_DISTANCE):
+        self.minhash_threshold = minhash_threshold
+        self.simhash_max_distance = simhash_max_distance
+        self._exact = {} # sha256 -> thread_id
+        self._signatures = {} # thread_id -> (minhash values, simhash int)
+        self._buckets = defaultdict(set) # (band, values) -> thread_ids
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.llm_calls_avoided = 0
+
+    def add(self, thread_id: str, signature: dict):
+        values = _minhash_values(signature)
+        with self._lock:
+            self._exact[signature["sha256"]] = thread_id # The latest thread wins, e.g. a success after a failure
+            self._signatures[thread_id] = (values, int(signature["simhash"], 16))
+            for key in _band_keys(values):
+                self._buckets[key].add(thread_id)
+
+    def build_from_entries(self, entries) -> int:
+        """Indexes every SharedMemory entry that carries a 'dedup_signature'."""
+        added = 0
+        for entry in entries:
+            signature = (entry.get("extracted_data") or {}).get("dedup_signature")
+            if signature:
+                self.add(entry["thread_id"], signature)
+                added += 1
+        return added
+
+    def find(self, signature: dict):
+        """Returns (thread_id, 'exact' | 'near', similarity) for the best earlier match, or None."""
+        with self._lock:
+            thread_id = self._exact.get(signature["sha256"])
+            if thread_id:
+                return thread_id, "exact", 1.0
+            values = _minhash_values(signature)
+            simhash = int(signature["simhash"], 16)
+            candidates = set()
+            for key in _band_keys(values):
+                candidates.update(self._buckets.get(key, ()))
+            best = None
+            for candidate in candidates:
+                other_values, other_simhash = self._signatures[candidate]
+                jaccard = sum(a == b for a, b in zip(values, other_values)) / len(values)
+                distance = bin(simhash ^ other_simhash).count("1")
+                if jaccard >= self.minhash_threshold or distance <= self.simhash_max_distance:
+                    if best is None or jaccard > best[2]:
+                        best = (candidate, "near", round(jaccard, 3))
+            return best
+
+    def record(self, match, llm_calls_avoided: int = 0):
+        """Counts the outcome of a lookup for stats()."""
+        with self._lock:
+            if match is None:
+                self.misses += 1
+            elif match[1] == "exact":
+                self.exact_hits += 1
+            else:
+                self.near_hits += 1
+            self.llm_calls_avoided += llm_calls_avoided
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "indexed_threads": len(self._signatures),
+                "exact_hits": self.exact_hits,
+                "near_hits": self.near_hits,
+                "misses": self.misses,
+                "llm_calls_avoided": self.llm_calls_avoided,
+            }
@@ -0,0 +1,38 @@
+# utils/email_parse.py
+from email.header import decode_header
+
+
+def decode_subject(msg):
+    subject_parts = decode_header(msg["Subject"])
+    subject = ""
+    for part, charset in subject_parts:
+        if isinstance(part, bytes):
+            subject += part.decode(charset if charset else 'utf-8', errors='ignore')
+        else:
+            subject += part
+    return subject
+
+def fetch_email_body(msg):
+    if msg.is_multipart():
+        for part in msg.walk():
+            content_type = part.get_content_type()
+            content_disposition = str(part.get("Content-Disposition"))
+            if "attachment" not in content_disposition:
+                if content_type == "text/plain":
+                    try:
+                        return part.get_payload(decode=True).decode(part.get_content_charset() or 'utf-8', errors='ignore')
+                    except:
+                        pass
+                elif content_type == "text/html":
+                    try:
+                        html_body = part.get_payload(decode=True).decode(part.get_content_charset() or 'utf-8', errors='ignore')
+                        return html_body
+                    except:
+                        pass
+    else:
+        if msg.get_content_type() == "text/plain":
+            try:
+                return msg.get_payload(decode=True).decode(msg.get_content_charset() or 'utf-8', errors='ignore')
+            except:
+                return "Could not decode plain text body."
+    return "No suitable text body found."
@@ -0,0 +1,59 @@
+# utils/fake_imap.py
+"""In-memory stand-in for email_automation_service.IMAPMailbox, for tests and benchmarks.
+
+    mailbox = FakeMailbox()
+    mailbox.deliver(b"From: a@example.com\r\nSubject: RFQ\r\n\r\nPlease quote 10 units.")
+    ingestor = EmailIngestor(mailbox, classifier, UIDCheckpoint("checkpoint.json"))
+"""
+import threading
+import time
+
+
+class FakeMailbox:
+    """Holds raw messages keyed by UID and implements connect / search_uids / fetch /
+    wait_for_changes like the real adapter. `fetch_latency` simulates a network round trip."""
+
+    def __init__(self, mailbox: str = "INBOX", uidvalidity: int = 1, supports_idle: bool = True,
+                 fetch_latency: float = 0.0):
+        self.mailbox = mailbox
+        self.uidvalidity = uidvalidity
+        self.supports_idle = supports_idle
+        self.fetch_latency = fetch_latency
+        self.messages = {} # uid -> raw bytes
+        self.seen = set()
+        self.connects = 0
+        self.fetch_calls = 0
+        self._next_uid = 1
+        self._changed = threading.Condition()
+
+    def deliver(self, raw_message: bytes) -> int:
+        with self._changed:
+            uid = self._next_uid
+            self._next_uid += 1
+            self.messages[uid] = raw_message
+            self._changed.notify_all()
+        return uid
+
+    def connect(self):
+        self.connects += 1
+
+    def search_uids(self, after_uid: int = None) -> list:
+        with self._changed:
+            if after_uid is None:
+                return sorted(u for u in self.messages if u not in self.seen)
+            return sorted(u for u in self.messages if u > after_uid)
+
+    def fetch(self, uids: list) -> list:
+        self.fetch_calls += 1
+        if self.fetch_latency:
+            time.sleep(self.fetch_latency)
+        with self._changed:
+            self.seen.update(uids)
+            return [(u, self.messages[u]) for u in sorted(uids) if u in self.messages]
+
+    def wait_for_changes(self, timeout: float) -> bool:
+        with self._changed:
+            return self._changed.wait(timeout)
+
+    def close(self):
+        pass
@@ -0,0 +1,188 @@
+# utils/fake_model.py
+"""Local stand-in for genai.GenerativeModel, for tests and offline runs.
+
+    from utils import llm_utils
+    from utils.fake_model import FakeGenerativeModel, FakeAPIError
+    llm_utils.set_model(FakeGenerativeModel(responses={"Urgency:": "High"},
+                                            errors=[FakeAPIError(429, "quota exceeded")]))
+
+Setting LLM_BACKEND=fake makes llm_utils.get_model() return FakeGenerativeModel.from_env(),
+configured by FAKE_LLM_RESPONSES ("pipeline" for plausible per-prompt answers),
+FAKE_LLM_LATENCY (see latency_distribution), FAKE_LLM_ERROR_RATE and FAKE_LLM_SEED.
+"""
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+import types
+from collections import Counter
+
+INTENT_KEYWORDS = [ # First match wins; mirrors what a model would pick for the sample inputs
+    ("Invoice", ("invoice", "amount due", "total_amount")),
+    ("RFQ", ("rfq", "quotation", "quote", "bulk order")),
+    ("Complaint", ("complaint", "damaged", "disappointed", "refund")),
+    ("Regulation", ("regulation", "compliance", "gdpr")),
+    ("Order Confirmation", ("order confirmation", "order has been confirmed")),
+]
+_EMAIL_RE = re.compile(r"[\w.+-]+@[\w-]+\.[\w.]+")
+
+
+def latency_distribution(spec):
+    """Callable(rng) -> seconds from a spec: a number or "const:S", "uniform:LO,HI",
+    "normal:MEAN,SD", "lognormal:MEDIAN,SIGMA" (the usual shape of API latencies) or "exp:MEAN".
+    A callable is returned unchanged; None or 0 means no delay."""
+    if callable(spec):
+        return spec
+    if not spec:
+        return lambda rng: 0.0
+    if isinstance(spec, (int, float)):
+        return lambda rng: float(spec)
+    kind, _, params = spec.partition(":")
+    if not params:
+        return lambda rng: float(kind)
+    args = [float(p) for p in params.split(",")]
+    kind = kind.strip().lower()
+    if kind == "const":
+        return lambda rng: args[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(args[0], args[1])
+    if kind == "normal":
+        return lambda rng: max(0.0, rng.gauss(args[0], args[1]))
+    if kind == "lognormal":
+        return lambda rng: args[0] * rng.lognormvariate(0.0, args[1])
+    if kind == "exp":
+        return lambda rng: rng.expovariate(1.0 / args[0])
+    raise ValueError(f"Unknown latency distribution '{spec}'. Use const, uniform, normal, lognormal or exp.")
+
+
+def _guess_intent(text: str) -> str:
+    lowered = text.lower()
+    for intent, keywords in INTENT_KEYWORDS:
+        if any(k in lowered for k in keywords):
+            return intent
+    return "General Inquiry"
+
+
+def pipeline_responses(prompt: str) -> str:
+    """Plausible answers to the pipeline's prompts (intent, urgency, sender, CRM summary and the
+    single-call JSON analysis), derived from the content so runs exercise every branch."""
+    content = prompt.split("---")[1] if prompt.count("---") >= 2 else prompt
+    stripped = prompt.rstrip()
+    urgency = "High" if re.search(r"\b(urgent|asap|immediately|deadline)\b", content, re.IGNORECASE) else "Medium"
+    sender_match = _EMAIL_RE.search(content)
+    sender = sender_match.group(0) if sender_match else "Unknown"
+    first_line = next((line.strip() for line in content.splitlines() if line.strip()), "")
+    summary = f"Customer message about: {first_line[:120]}"
+    if stripped.endswith("JSON:"):
+        return json.dumps({"intent": _guess_intent(content), "urgency": urgency, "sender": sender, "summary": summary})
+    if stripped.endswith("Primary Intent:"):
+        return _guess_intent(content)
+    if stripped.endswith("Urgency:"):
+        return urgency
+    if stripped.endswith("Sender:"):
+        return sender
+    if stripped.endswith("CRM Summary:"):
+        return summary
+    return "Other"
+
+
+class FakeAPIError(Exception):
+    """Mimics google.api_core exceptions, which carry the HTTP status in `code`."""
+
+    def __init__(self, code: int, message: str = ""):
+        super().__init__(f"{code} {message}".strip())
+        self.code = code
+
+
+class FakeGenerativeModel:
+    """Answers prompts without network access.
+
+    responses: a callable(prompt) -> str, or a dict mapping a substring of the prompt to the
+               answer (first match wins); `default_response` is used otherwise.
+    errors:    exceptions raised, in order, by the first calls before answers are returned.
+    latency:   seconds to sleep per call: a number, a latency_distribution spec or a callable(rng).
+    error_rate: share of calls failing with a retryable FakeAPIError drawn from `error_codes`.
+    keep_calls: record every prompt in `calls` (turn off for long benchmark runs; `call_count` is always kept).
+    seed:      latency and injected errors are drawn from a generator seeded by (seed, prompt,
+               how often that prompt was seen), so runs repeat regardless of thread interleaving.
+    """
+
+    def __init__(self, responses=None, default_response: str = "Other", errors=None,
+                 model_name: str = "fake-gemini", latency=None, error_rate: float = 0.0,
+                 error_codes=(429, 503), seed: int = 0, keep_calls: bool = True):
+        self.model_name = model_name
+        self.responses = responses or {}
+        self.default_response = default_response
+        self._errors = list(errors or [])
+        self._lock = threading.Lock()
+        self.calls = [] if keep_calls else None
+        self.call_count = 0
+        self.latency = latency_distribution(latency)
+        self.error_rate = error_rate
+        self.error_codes = tuple(error_codes)
+        self.seed = seed
+        self.injected_errors = 0
+        self._prompt_counts = Counter()
+
+    @classmethod
+    def from_env(cls):
+        responses = pipeline_responses if os.getenv("FAKE_LLM_RESPONSES", "") == "pipeline" else None
+        return cls(responses=responses,
+                   latency=os.getenv("FAKE_LLM_LATENCY") or None,
+                   error_rate=float(os.getenv("FAKE_LLM_ERROR_RATE", "0")),
+                   seed=int(os.getenv("FAKE_LLM_SEED", "0")))
+
+    def _rng(self, prompt: str) -> random.Random:
+        digest = hashlib.blake2b(prompt.encode("utf-8", "replace"), digest_size=8).digest()
+        with self._lock:
+            self._prompt_counts[digest] += 1
+            occurrence = self._prompt_counts[digest]
+        return random.Random(f"{self.seed}:{digest.hex()}:{occurrence}")
+
+    def _answer(self, prompt: str) -> str:
+        if callable(self.responses):
+            return self.responses(prompt)
+        for marker, answer in self.responses.items():
+            if marker in prompt:
+                return answer
+        return self.default_response
+
+    def _begin_call(self, prompt: str):
+        """Records the call and returns (rng, delay), raising a scripted or injected error."""
+        with self._lock:
+            self.call_count += 1
+            if self.calls is not None:
+                self.calls.append(prompt)
+            error = self._errors.pop(0) if self._errors else None
+        if error is not None:
+            raise error
+        rng = self._rng(prompt)
+        return rng, self.latency(rng)
+
+    def _finish_call(self, prompt: str, rng: random.Random):
+        if self.error_rate and rng.random() < self.error_rate:
+            with self._lock:
+                self.injected_errors += 1
+            code = rng.choice(self.error_codes)
+            raise FakeAPIError(code, "quota exceeded" if code == 429 else "service unavailable")
+        text = self._answer(prompt)
+        part = types.SimpleNamespace(text=text)
+        candidate = types.SimpleNamespace(content=types.SimpleNamespace(parts=[part]))
+        usage = types.SimpleNamespace(total_token_count=(len(prompt) + len(text)) // 4)
+        return types.SimpleNamespace(candidates=[candidate], usage_metadata=usage)
+
+    def generate_content(self, prompt, generation_config=None, **kwargs):
+        rng, delay = self._begin_call(prompt)
+        if delay > 0:
+            time.sleep(delay)
+        return self._finish_call(prompt, rng)
+
+    async def generate_content_async(self, prompt, generation_config=None, **kwargs):
+        import asyncio
+        rng, delay = self._begin_call(prompt)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return self._finish_call(prompt, rng)
@@ -0,0 +1,451 @@
+# utils/job_queue.py
+import io
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+JOB_QUEUE_PATH = os.getenv("JOB_QUEUE_PATH", "jobs.db") # Empty disables the queue in the email service
+JOB_VISIBILITY_TIMEOUT = float(os.getenv("JOB_VISIBILITY_TIMEOUT", "300")) # Lease length; renewed while a job runs
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5")) # Attempts before a job is dead-lettered
+JOB_RETRY_DELAY = float(os.getenv("JOB_RETRY_DELAY", "10")) # Backoff base in seconds, doubled per attempt
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1.0"))
+
+JOB_STATUSES = ("queued", "running", "done", "dead")
+
+
+class UploadedBytes(io.BytesIO):
+    """In-memory file with a name, standing in for a Streamlit UploadedFile when a queued
+    upload is replayed (ClassifierAgent only needs `name` and `getvalue`)."""
+
+    def __init__(self, data: bytes, name: str):
+        super().__init__(data)
+        self.name = name
+
+
+class Job:
+    __slots__ = ("id", "source_identifier", "source_type", "thread_id", "attempts", "max_attempts",
+                 "worker", "_payload", "_body")
+
+    def __init__(self, row):
+        (self.id, self.source_identifier, self.source_type, self.thread_id, self.attempts,
+         self.max_attempts, self.worker, self._payload, self._body) = row
+
+    def input_data(self):
+        """The `input_data` the job was enqueued with: text or a path, a dict, or an uploaded file."""
+        payload = json.loads(self._payload)
+        if payload["kind"] == "file":
+            return UploadedBytes(self._body, payload["name"])
+        return payload["value"]
+
+    def process_kwargs(self) -> dict:
+        kwargs = {"input_data": self.input_data(), "source_identifier": self.source_identifier,
+                  "source_type": self.source_type, "thread_id": self.thread_id}
+        if json.loads(self._payload).get("force"):
+            kwargs["force"] = True
+        return kwargs
+
+
+def result_failure(result) -> str:
+    """Why a result that ClassifierAgent.process returned normally is still a failure, or
+    None: failed LLM steps ('llm_errors'), or failed records of a JSON stream (its summary's
+    'errors')."""
+    if not isinstance(result, dict):
+        return None
+    if result.get("llm_errors"):
+        return f"LLM steps failed: {', '.join(result['llm_errors'])}"
+    if "stream_layout" in result and result.get("errors"):
+        return f"{result['errors']} of {result['documents']} stream records failed"
+    return None
+
+
+class JobCheckpoint:
+    """Completed stages of one job (extracted text, intent, agent step answers, ...), persisted
+    as they finish so a retried job resumes after them. Agents use it like a dict; values
+    must be JSON-serializable. Writes are fenced like the job's status updates: once the
+    lease was lost to another worker, they no longer reach the queue."""
+
+    def __init__(self, job_queue, job: Job, stages: dict):
+        self._queue = job_queue
+        self.job = job
+        self.job_id = job.id
+        self._stages = stages
+
+    def get(self, stage: str, default=None):
+        return self._stages.get(stage, default)
+
+    def __contains__(self, stage: str) -> bool:
+        return stage in self._stages
+
+    def __getitem__(self, stage: str):
+        return self._stages[stage]
+
+    def __setitem__(self, stage: str, value):
+        self._queue.save_stage(self.job, stage, value)
+        self._stages[stage] = value
+
+    def __len__(self):
+        return len(self._stages)
+
+
+class JobQueue:
+    """Persistent job queue in a SQLite file (WAL), shared by any number of worker threads and
+    processes. A claimed job is leased for `visibility_timeout` seconds; a job whose worker
+    dies becomes visible again when the lease runs out. Failed jobs are retried with
+    exponential backoff and dead-lettered after `max_attempts`. Each job keeps its stage
+    checkpoints until it completes.
+
+    Completing, failing or renewing a job and saving its stages is fenced by its attempt number,
+    so a worker whose lease expired (and whose job another worker took over) cannot overwrite
+    the newer attempt."""
+
+    def __init__(self, db_path: str = JOB_QUEUE_PATH, visibility_timeout: float = JOB_VISIBILITY_TIMEOUT,
+                 max_attempts: int = JOB_MAX_ATTEMPTS, retry_delay: float = JOB_RETRY_DELAY):
+        self.db_path = db_path
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._lock = threading.RLock()
+        # Autocommit mode: transactions are opened explicitly with BEGIN IMMEDIATE
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                dedup_key TEXT UNIQUE,
+                source_identifier TEXT,
+                source_type TEXT,
+                thread_id TEXT,
+                payload TEXT NOT NULL,
+                body BLOB,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL,
+                visible_at REAL NOT NULL,
+                worker TEXT,
+                last_error TEXT,
+                result TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_ready ON jobs(status, visible_at)")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS job_stages (
+                job_id INTEGER NOT NULL,
+                stage TEXT NOT NULL,
+                value TEXT,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (job_id, stage)
+            )""")
+
+    @property
+    def location(self) -> str:
+        return self.db_path
+
+    def _transaction(self, statements):
+        """Runs `statements(conn)` in a BEGIN IMMEDIATE transaction and returns its result."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = statements(self._conn)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    def enqueue(self, input_data, source_identifier: str, source_type: str = "unknown_source",
+                thread_id: str = None, dedup_key: str = None, max_attempts: int = None, force: bool = False) -> int:
+        """Queues a ClassifierAgent.process call. `input_data` is text or a file path, a dict,
+        or an uploaded file object (its bytes are stored). With `dedup_key`, enqueueing the same
+        key again returns the existing job id instead of adding a job. `force` is passed on to
+        `process` (see requeue). Returns the job id."""
+        body = None
+        if hasattr(input_data, 'name') and hasattr(input_data, 'getvalue'):
+            payload = {"kind": "file", "name": input_data.name}
+            body = input_data.getvalue()
+        else:
+            payload = {"kind": type(input_data).__name__, "value": input_data}
+        if force:
+            payload["force"] = True
+        now = time.time()
+
+        def insert(conn):
+            if dedup_key is not None:
+                row = conn.execute("SELECT id FROM jobs WHERE dedup_key = ?", (dedup_key,)).fetchone()
+                if row:
+                    return row[0]
+            return conn.execute(
+                "INSERT INTO jobs (dedup_key, source_identifier, source_type, thread_id, payload, body, status,"
+                " max_attempts, visible_at, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, 'queued', ?, ?, ?, ?)",
+                (dedup_key, source_identifier, source_type, thread_id, json.dumps(payload, ensure_ascii=False), body,
+                 max_attempts or self.max_attempts, now, now, now)).lastrowid
+        return self._transaction(insert)
+
+    def claim(self, worker: str, job_id: int = None):
+        """Leases the oldest visible job (or job `job_id`, if it is visible) to `worker`.
+        Returns (Job, JobCheckpoint) or None when nothing is ready. A job whose lease expired
+        on its last attempt is dead-lettered instead of being handed out again."""
+        def lease(conn):
+            while True:
+                now = time.time()
+                query = ("SELECT id, attempts, max_attempts FROM jobs WHERE status IN ('queued', 'running')"
+                         " AND visible_at <= ?")
+                params = (now,)
+                if job_id is not None:
+                    query += " AND id = ?"
+                    params += (job_id,)
+                row = conn.execute(query + " ORDER BY visible_at, id LIMIT 1", params).fetchone()
+                if row is None:
+                    return None
+                if row[1] >= row[2]:
+                    conn.execute("UPDATE jobs SET status = 'dead', last_error = COALESCE(last_error, ?),"
+                                 " updated_at = ? WHERE id = ?", ("Lease expired on the last attempt", now, row[0]))
+                    print(f"Job {row[0]} dead-lettered after {row[1]} attempts (lease expired).")
+                    continue
+                conn.execute("UPDATE jobs SET status = 'running', attempts = attempts + 1, visible_at = ?,"
+                             " worker = ?, updated_at = ? WHERE id = ?",
+                             (now + self.visibility_timeout, worker, now, row[0]))
+                job = Job(conn.execute(
+                    "SELECT id, source_identifier, source_type, thread_id, attempts, max_attempts, worker,"
+                    " payload, body FROM jobs WHERE id = ?", (row[0],)).fetchone())
+                stages = {stage: json.loads(value) for stage, value in
+                          conn.execute("SELECT stage, value FROM job_stages WHERE job_id = ?", (row[0],))}
+                return job, stages
+
+        claimed = self._transaction(lease)
+        if claimed is None:
+            return None
+        job, stages = claimed
+        return job, JobCheckpoint(self, job, stages)
+
+    def save_stage(self, job: Job, stage: str, value) -> bool:
+        """Checkpoints a stage of a running job, fenced by its attempt number like the status
+        updates. Returns False if the lease was lost (the stage is not written)."""
+        encoded = json.dumps(value, ensure_ascii=False)
+
+        def insert(conn):
+            if conn.execute("SELECT 1 FROM jobs WHERE id = ? AND attempts = ? AND status = 'running'",
+                            (job.id, job.attempts)).fetchone() is None:
+                return False
+            conn.execute("INSERT OR REPLACE INTO job_stages (job_id, stage, value, updated_at) VALUES (?, ?, ?, ?)",
+                         (job.id, stage, encoded, time.time()))
+            return True
+        if self._transaction(insert):
+            return True
+        print(f"Warning: lease on job {job.id} (attempt {job.attempts}) was lost to another worker.")
+        return False
+
+    def _fenced_update(self, job: Job, assignments: str, params: tuple) -> bool:
+        def update(conn):
+            return conn.execute(f"UPDATE jobs SET {assignments}, updated_at = ? WHERE id = ? AND attempts = ?"
+                                " AND status = 'running'", params + (time.time(), job.id, job.attempts)).rowcount
+        if self._transaction(update):
+            return True
+        print(f"Warning: lease on job {job.id} (attempt {job.attempts}) was lost to another worker.")
+        return False
+
+    def heartbeat(self, job: Job) -> bool:
+        """Extends the lease of a running job. Returns False if the lease was lost."""
+        return self._fenced_update(job, "visible_at = ?", (time.time() + self.visibility_timeout,))
+
+    def complete(self, job: Job, thread_id: str = None, result=None) -> bool:
+        """Marks the job done, stores its result and drops its stage checkpoints."""
+        if not self._fenced_update(job, "status = 'done', thread_id = COALESCE(?, thread_id), result = ?, last_error = NULL",
+                                   (thread_id, json.dumps(result, ensure_ascii=False, default=str))):
+            return False
+        with self._lock:
+            self._conn.execute("DELETE FROM job_stages WHERE job_id = ?", (job.id,))
+        return True
+
+    def fail(self, job: Job, error: str) -> bool:
+        """Records a failed attempt. The job is retried after a backoff (keeping its
+        checkpoints) or dead-lettered once it has used up its attempts."""
+        if job.attempts >= job.max_attempts:
+            print(f"Job {job.id} dead-lettered after {job.attempts} attempts: {error}")
+            return self._fenced_update(job, "status = 'dead', last_error = ?", (error,))
+        delay = self.retry_delay * (2 ** (job.attempts - 1))
+        print(f"Job {job.id} failed (attempt {job.attempts}/{job.max_attempts}), retrying in {delay:.0f}s: {error}")
+        return self._fenced_update(job, "status = 'queued', visible_at = ?, last_error = ?", (time.time() + delay, error))
+
+    def release(self, job: Job) -> bool:
+        """Hands a running job back without counting the attempt (e.g. on shutdown)."""
+        return self._fenced_update(job, "status = 'queued', visible_at = ?, attempts = attempts - 1", (time.time(),))
+
+    def requeue(self, job_id: int, force: bool = False) -> bool:
+        """Runs a finished (done or dead) job again from scratch, e.g. to force reprocessing of
+        content whose dedup key already has a result. With `force`, the run is passed
+        `force=True` (no duplicate reuse, no cached LLM answers). Returns False if the job is
+        not finished."""
+        def reset(conn):
+            row = conn.execute("SELECT payload FROM jobs WHERE id = ? AND status IN ('done', 'dead')",
+                               (job_id,)).fetchone()
+            if row is None:
+                return False
+            payload = dict(json.loads(row[0]), force=force)
+            updated = conn.execute("UPDATE jobs SET status = 'queued', attempts = 0, visible_at = ?, result = NULL,"
+                                   " last_error = NULL, payload = ?, updated_at = ? WHERE id = ?",
+                                   (time.time(), json.dumps(payload, ensure_ascii=False), time.time(),
+                                    job_id)).rowcount
+            if updated:
+                conn.execute("DELETE FROM job_stages WHERE job_id = ?", (job_id,))
+            return bool(updated)
+        return self._transaction(reset)
+
+    def retry_dead(self, job_id: int = None) -> int:
+        """Re-queues dead-lettered jobs (one, or all) with a fresh attempt budget."""
+        query = "UPDATE jobs SET status = 'queued', attempts = 0, visible_at = ?, updated_at = ? WHERE status = 'dead'"
+        params = (time.time(), time.time())
+        if job_id is not None:
+            query += " AND id = ?"
+            params += (job_id,)
+        return self._transaction(lambda conn: conn.execute(query, params).rowcount)
+
+    def dead_letters(self, limit: int = 100) -> list:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, source_identifier, attempts, last_error, updated_at FROM jobs WHERE status = 'dead'"
+                " ORDER BY updated_at DESC LIMIT ?", (limit,)).fetchall()
+        return [dict(zip(("id", "source_identifier", "attempts", "last_error", "updated_at"), row)) for row in rows]
+
+    def _get(self, where: str, param) -> dict:
+        with self._lock:
+            row = self._conn.execute("SELECT id, source_identifier, status, attempts, thread_id, last_error, result"
+                                     f" FROM jobs WHERE {where} = ?", (param,)).fetchone()
+            if row is None:
+                return None
+            stages = [stage for stage, in self._conn.execute(
+                "SELECT stage FROM job_stages WHERE job_id = ? ORDER BY updated_at", (row[0],))]
+        job = dict(zip(("id", "source_identifier", "status", "attempts", "thread_id", "last_error", "result"), row))
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        job["stages"] = stages
+        return job
+
+    def get(self, job_id: int) -> dict:
+        """Status, attempts, thread_id, last error, result and checkpointed stages (the
+        progress of a running job) of a job, or None."""
+        return self._get("id", job_id)
+
+    def find(self, dedup_key: str) -> dict:
+        """`get` for the job enqueued with `dedup_key`, or None."""
+        return self._get("dedup_key", dedup_key)
+
+    def stats(self) -> dict:
+        """Job counts per status, with `ready` counting queued jobs visible now."""
+        with self._lock:
+            counts = dict(self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+            ready = self._conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND visible_at <= ?",
+                                       (time.time(),)).fetchone()[0]
+        return dict({status: counts.get(status, 0) for status in JOB_STATUSES}, ready=ready)
+
+    def purge_done(self, older_than: float = 7 * 24 * 3600) -> int:
+        """Deletes completed jobs last updated more than `older_than` seconds ago."""
+        cutoff = time.time() - older_than
+        return self._transaction(lambda conn: conn.execute(
+            "DELETE FROM jobs WHERE status = 'done' AND updated_at < ?", (cutoff,)).rowcount)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class JobWorker:
+    """Drains a JobQueue with `threads` worker threads, each calling
+    `classifier.process(..., checkpoint=...)` for the jobs it claims. Leases of running jobs
+    are renewed in the background, so only jobs of a dead worker time out."""
+
+    def __init__(self, job_queue: JobQueue, classifier_agent, threads: int = 1, name: str = None,
+                 poll_interval: float = JOB_POLL_INTERVAL):
+        self.queue = job_queue
+        self.classifier = classifier_agent
+        self.threads = threads
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        self.poll_interval = poll_interval
+        self.processed = 0
+        self.failed = 0
+        self._running = {} # job id -> Job, for lease renewal
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def run_job(self, job: Job, checkpoint: JobCheckpoint):
+        """Processes one claimed job and completes it, or fails it when processing raised, an
+        LLM step failed (result 'llm_errors') or records of a stream failed. Returns
+        (thread_id, result) or None."""
+        with self._lock:
+            self._running[job.id] = job
+        try:
+            resumed = f", resuming after {len(checkpoint)} checkpointed stage(s)" if len(checkpoint) else ""
+            print(f"Worker {self.name}: job {job.id} attempt {job.attempts} ({job.source_identifier}){resumed}")
+            outcome = self.classifier.process(**job.process_kwargs(), checkpoint=checkpoint)
+        except Exception as e:
+            with self._lock:
+                self.failed += 1
+            self.queue.fail(job, f"{type(e).__name__}: {e}")
+            return None
+        finally:
+            with self._lock:
+                self._running.pop(job.id, None)
+        thread_id, result = outcome
+        failure = result_failure(result)
+        if failure:
+            # The successful steps (or stream records) stay checkpointed; the retry only re-runs the failed ones
+            with self._lock:
+                self.failed += 1
+            self.queue.fail(job, failure)
+            return None
+        self.queue.complete(job, thread_id, result)
+        with self._lock:
+            self.processed += 1
+        return outcome
+
+    def run_once(self, job_id: int = None):
+        """Claims and runs a single job, if one is ready. Returns its outcome or None."""
+        claimed = self.queue.claim(self.name, job_id=job_id)
+        return self.run_job(*claimed) if claimed else None
+
+    def _loop(self, index: int):
+        while not self._stop.is_set():
+            claimed = self.queue.claim(f"{self.name}/{index}")
+            if claimed is None:
+                self._stop.wait(self.poll_interval)
+                continue
+            self.run_job(*claimed)
+
+    def _renew_leases(self):
+        while not self._stop.wait(self.queue.visibility_timeout / 3):
+            with self._lock:
+                running = list(self._running.values())
+            for job in running:
+                self.queue.heartbeat(job)
+
+    def start(self):
+        self._stop.clear()
+        self._threads = [threading.Thread(target=self._loop, args=(i,), name=f"job-worker-{i}", daemon=True)
+                         for i in range(self.threads)]
+        self._threads.append(threading.Thread(target=self._renew_leases, name="job-lease-renewal", daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        """Stops claiming new jobs and waits for the running ones to finish."""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def drain(self, timeout: float = None) -> bool:
+        """Blocks until no job is ready or running (e.g. after a burst), or `timeout` passes."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            stats = self.queue.stats()
+            with self._lock:
+                busy = bool(self._running)
+            if not stats["ready"] and not stats["running"] and not busy:
+                return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(min(self.poll_interval, 0.1))
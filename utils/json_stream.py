@@ -0,0 +1,179 @@
+# utils/json_stream.py
+import codecs
+import io
+import json
+import os
+
+# JSON text handed to intent classification and dedup; prompts read at most 2000 characters
+# and dedup signatures at most 20000, so nothing past this is ever serialized.
+JSON_CONTENT_CHARS = int(os.getenv("JSON_CONTENT_CHARS", "20000"))
+JSON_STREAM_CHUNK_BYTES = int(os.getenv("JSON_STREAM_CHUNK_BYTES", str(1 << 20)))
+JSON_LINES_EXTENSIONS = (".jsonl", ".ndjson")
+JSON_EXTENSIONS = (".json",) + JSON_LINES_EXTENSIONS
+PREVIEW_CHARS = 100
+_LAYOUT_PEEK_BYTES = 64 * 1024
+_WHITESPACE = " \t\r\n"
+_decoder = json.JSONDecoder()
+# iterencode() with the default _one_shot=False uses the pure-Python generator, which yields
+# small chunks lazily, so a prefix of a huge document costs only the prefix.
+_encoder = json.JSONEncoder(ensure_ascii=False)
+
+
+def json_prompt_text(obj, max_chars: int = JSON_CONTENT_CHARS) -> str:
+    """Compact JSON rendering of `obj`, cut at `max_chars` without serializing the rest."""
+    parts = []
+    size = 0
+    for chunk in _encoder.iterencode(obj):
+        parts.append(chunk)
+        size += len(chunk)
+        if size >= max_chars:
+            break
+    return "".join(parts)[:max_chars]
+
+
+def preview_value(value, max_chars: int = PREVIEW_CHARS):
+    """Short preview of a value: strings are sliced, containers are rendered only up to
+    `max_chars`. Values that fit are returned unchanged."""
+    if isinstance(value, str):
+        return value if len(value) <= max_chars else value[:max_chars] + '...'
+    if isinstance(value, (dict, list)):
+        text = json_prompt_text(value, max_chars + 1)
+        return value if len(text) <= max_chars else text[:max_chars] + '...'
+    text = str(value)
+    return value if len(text) <= max_chars else text[:max_chars] + '...'
+
+
+def preview_document(data: dict, max_chars: int = PREVIEW_CHARS) -> dict:
+    return {k: preview_value(v, max_chars) for k, v in data.items()}
+
+
+def _open_binary(source):
+    """Returns (binary stream, owned) for a path, bytes or a file-like object."""
+    if isinstance(source, (bytes, bytearray)):
+        return io.BytesIO(source), True
+    if isinstance(source, str):
+        return open(source, 'rb'), True
+    if hasattr(source, 'seek') and (not hasattr(source, 'seekable') or source.seekable()): # Not pipes (stdin)
+        source.seek(0)
+    return source, False
+
+
+class JSONDocumentStream:
+    """Iterates the documents in a JSON source without loading it whole.
+    Layouts: 'lines' (JSON Lines / NDJSON, one document per line), 'array' (a top-level
+    array, each element is a document, parsed incrementally) and 'object' (one document,
+    which has to be parsed in full). Malformed JSON Lines records are skipped and counted."""
+
+    def __init__(self, source, filename: str = None, chunk_bytes: int = JSON_STREAM_CHUNK_BYTES):
+        self.stream, self._owned = _open_binary(source)
+        self.chunk_bytes = chunk_bytes
+        self.skipped = 0
+        name = filename or (source if isinstance(source, str) else getattr(source, 'name', '')) or ''
+        self.layout = "lines" if name.lower().endswith(JSON_LINES_EXTENSIONS) else self._detect_layout()
+
+    def _detect_layout(self) -> str:
+        head = self.stream.read(_LAYOUT_PEEK_BYTES)
+        self.stream.seek(0)
+        text = head.decode('utf-8', errors='ignore').lstrip(_WHITESPACE + "\ufeff")
+        if text.startswith("["):
+            return "array"
+        first_line, newline, rest = text.partition("\n")
+        if newline and rest.strip().startswith("{"):
+            try:
+                json.loads(first_line)
+                return "lines" # A complete document on the first line, followed by another one
+            except json.JSONDecodeError:
+                pass
+        return "object"
+
+    @property
+    def is_multi_document(self) -> bool:
+        return self.layout in ("lines", "array")
+
+    def load_single(self):
+        """Parses an 'object' layout source."""
+        return json.loads(self.stream.read().decode('utf-8-sig'))
+
+    def __iter__(self):
+        if self.layout == "lines":
+            return self._iter_lines()
+        if self.layout == "array":
+            return self._iter_array()
+        return iter([self.load_single()])
+
+    def _iter_lines(self):
+        for line_number, raw in enumerate(self.stream, 1):
+            line = raw.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except (json.JSONDecodeError, UnicodeDecodeError) as e:
+                self.skipped += 1
+                print(f"Skipping malformed JSON Lines record at line {line_number}: {e}")
+
+    def _chunks(self):
+        decoder = codecs.getincrementaldecoder('utf-8-sig')()
+        while True:
+            data = self.stream.read(self.chunk_bytes)
+            text = decoder.decode(data, final=not data)
+            if text:
+                yield text
+            if not data:
+                return
+
+    def _iter_array(self):
+        chunks = self._chunks()
+        buffer, pos, exhausted = "", 0, False
+
+        def refill():
+            # Reads at least as much as is already buffered, so one huge element is
+            # assembled in O(size) rather than by many small concatenations.
+            nonlocal buffer, pos, exhausted
+            pending = [buffer[pos:]]
+            wanted = max(len(pending[0]), 1)
+            read = 0
+            while read < wanted:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    exhausted = True
+                    break
+                pending.append(chunk)
+                read += len(chunk)
+            buffer, pos = "".join(pending), 0
+
+        started = False
+        while True:
+            while pos < len(buffer) and buffer[pos] in _WHITESPACE + ",":
+                pos += 1
+            if pos >= len(buffer):
+                if exhausted:
+                    raise ValueError("Malformed JSON array: unexpected end of input")
+                refill()
+                continue
+            if not started:
+                if buffer[pos] != "[":
+                    raise ValueError("JSON source is not an array")
+                started = True
+                pos += 1
+                continue
+            if buffer[pos] == "]":
+                return
+            try:
+                document, end = _decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if exhausted:
+                    raise
+                refill()
+                continue
+            if end == len(buffer) and not exhausted:
+                refill() # A number at the very end of the buffer may continue in the next chunk
+                continue
+            pos = end
+            yield document
+            if pos > self.chunk_bytes:
+                buffer, pos = buffer[pos:], 0 # Drop consumed text
+
+    def close(self):
+        if self._owned:
+            self.stream.close()
@@ -1,37 +1,280 @@
 # utils/llm_utils.py
-import google.generativeai as genai
+import contextlib
+import contextvars
 import os
-from dotenv import load_dotenv
+import threading
+import time
+from .llm_cache import LLMCache, make_cache_key
+from .metrics import span
+from .prompt_budget import count_tokens, token_ledger
+from .rate_limiter import RateLimiter, RetryBudget, RetryPolicy, classify_error, server_retry_delay, FATAL
+from .structured_output import parse_json_object, validate_structured
 
-load_dotenv()
+MODEL_NAME = 'gemini-2.5-flash-preview-05-20'
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini") # "gemini", or "fake" for offline runs (utils.fake_model)
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") == "1"
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "llm_cache.db")
+LLM_ERROR_PREFIX = "Error:" # call_gemini returns "Error: ..." once retries are exhausted
 
-API_KEY = os.getenv("GOOGLE_API_KEY")
+# The model client and the response cache are created on first use (see get_model /
+# get_response_cache), so importing this module needs neither the Gemini SDK nor an API key.
+model = None
+response_cache = None
+_init_lock = threading.Lock()
+_cache_initialized = False
+# Set these to your Gemini quota; 0 leaves that dimension unlimited
+rate_limiter = RateLimiter(
+    requests_per_minute=float(os.getenv("GEMINI_REQUESTS_PER_MINUTE", "60")),
+    tokens_per_minute=float(os.getenv("GEMINI_TOKENS_PER_MINUTE", "1000000"))
+)
+retry_policy = RetryPolicy(
+    max_attempts=int(os.getenv("GEMINI_MAX_ATTEMPTS", "4")),
+    base_delay=float(os.getenv("GEMINI_RETRY_BASE_DELAY", "1.0")),
+    max_delay=float(os.getenv("GEMINI_RETRY_MAX_DELAY", "30.0"))
+)
+retry_budget = RetryBudget(ratio=float(os.getenv("GEMINI_RETRY_BUDGET_RATIO", "0.2")))
+# Set by fresh_answers(): every call in the context behaves as use_cache=False
+_fresh_answers = contextvars.ContextVar("llm_fresh_answers", default=False)
 
-if not API_KEY:
-    raise ValueError("GOOGLE_API_KEY not found in environment variables. Please set it in .env file.")
+def _create_model():
+    if LLM_BACKEND == "fake":
+        from .fake_model import FakeGenerativeModel
+        print("LLM_BACKEND=fake: using the offline stub model.")
+        return FakeGenerativeModel.from_env()
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except ImportError:
+        pass # python-dotenv is optional when the key is already in the environment
+    api_key = os.getenv("GOOGLE_API_KEY")
+    if not api_key:
+        raise ValueError("GOOGLE_API_KEY not found in environment variables. Please set it in .env file.")
+    import google.generativeai as genai
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel(MODEL_NAME)
+
+def get_model():
+    """The model client, created on first call unless one was injected with set_model."""
+    global model
+    if model is None:
+        with _init_lock:
+            if model is None:
+                model = _create_model()
+    return model
+
+def get_response_cache():
+    """The response cache (None when disabled), opened on first call."""
+    global response_cache, _cache_initialized
+    if not _cache_initialized:
+        with _init_lock:
+            if not _cache_initialized:
+                if LLM_CACHE_ENABLED and response_cache is None:
+                    response_cache = LLMCache(
+                        db_path=LLM_CACHE_PATH,
+                        max_memory_entries=int(os.getenv("LLM_CACHE_MEMORY_ENTRIES", "512")),
+                        max_disk_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "10000")),
+                        ttl_seconds=float(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+                    )
+                _cache_initialized = True
+    return response_cache
+
+def set_model(new_model):
+    """Replaces the model client, e.g. with utils.fake_model.FakeGenerativeModel in tests."""
+    global model
+    model = new_model
 
-genai.configure(api_key=API_KEY)
-model = genai.GenerativeModel('gemini-2.5-flash-preview-05-20')
+def is_llm_error(text: str) -> bool:
+    """True if `text` is the error marker call_gemini returns instead of a model answer."""
+    return text is None or text.startswith(LLM_ERROR_PREFIX)
+
+def estimate_tokens(text: str) -> int:
+    return count_tokens(text) + 1
+
+@contextlib.contextmanager
+def fresh_answers(enabled: bool = True):
+    """Within this context (and the PromptGroup steps it starts), call_gemini and
+    call_gemini_async skip cached answers as if called with use_cache=False, e.g. for a
+    forced reprocess. The fresh answers still refresh the cache."""
+    token = _fresh_answers.set(enabled or _fresh_answers.get())
+    try:
+        yield
+    finally:
+        _fresh_answers.reset(token)
 
-def call_gemini(prompt: str, temperature=0.3) -> str:
+def _cache_key(prompt: str, temperature: float, response_mime_type: str = None):
+    """(response cache, key) for a request; the key is None when caching is disabled."""
+    generation_config = {"response_mime_type": response_mime_type} if response_mime_type else None
+    response_cache = get_response_cache()
+    model_name = getattr(get_model(), "model_name", MODEL_NAME)
+    return response_cache, make_cache_key(model_name, prompt, temperature, generation_config) if response_cache else None
+
+def _cached_answer(llm_span, prompt: str, response_cache, cache_key, use_cache: bool, agent: str):
+    use_cache = use_cache and not _fresh_answers.get()
+    prompt_tokens = estimate_tokens(prompt)
+    llm_span.set(prompt_tokens=prompt_tokens, cache="off" if not cache_key else "miss")
+    if cache_key and use_cache:
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            token_ledger.record_call(agent, prompt_tokens, cached=True)
+            llm_span.set(cache="hit", response_chars=len(cached))
+            return cached
+    return None
+
+def _store_answer(llm_span, response_text: str, response_cache, cache_key):
+    if is_llm_error(response_text):
+        llm_span.fail(response_text)
+    else:
+        llm_span.set(response_chars=len(response_text))
+        if cache_key:
+            response_cache.put(cache_key, response_text)
+
+def call_gemini(prompt: str, temperature=0.3, use_cache: bool = True, response_mime_type: str = None,
+                agent: str = None) -> str:
     """
     Sends a prompt to Gemini and returns the text response.
+    Identical requests are answered from the response cache; pass use_cache=False (or call
+    inside fresh_answers()) to force a fresh call (the fresh answer still refreshes the cache).
+    `agent` labels the call in the token ledger, e.g. "EmailAgent.urgency".
     """
-    try:
-        response = model.generate_content(
-            prompt,
-            generation_config=genai.types.GenerationConfig(
-                temperature=temperature
-            )
-        )
-        if response.candidates and response.candidates[0].content.parts:
-            return response.candidates[0].content.parts[0].text.strip()
-        else:
-            print("Warning: Gemini response was empty or malformed.")
-            return "Error: No content in response"
-    except Exception as e:
-        print(f"Error calling Gemini: {e}")
-        return f"Error: {str(e)}"
+    response_cache, cache_key = _cache_key(prompt, temperature, response_mime_type)
+    with span("llm", agent) as llm_span:
+        cached = _cached_answer(llm_span, prompt, response_cache, cache_key, use_cache, agent)
+        if cached is not None:
+            return cached
+        response_text = _generate(prompt, temperature, response_mime_type, agent)
+        _store_answer(llm_span, response_text, response_cache, cache_key)
+        return response_text
+
+async def call_gemini_async(prompt: str, temperature=0.3, use_cache: bool = True, response_mime_type: str = None,
+                            agent: str = None) -> str:
+    """
+    Awaitable call_gemini with the same cache, rate limiting, retries and accounting.
+    Uses the client's native generate_content_async when it has one (the Gemini SDK does),
+    so a request in flight holds no thread; other clients run on a worker thread. Cache lookups
+    and writes (SQLite on a miss) also run on a worker thread, off the event loop.
+    """
+    import asyncio
+    response_cache, cache_key = await asyncio.to_thread(_cache_key, prompt, temperature, response_mime_type)
+    with span("llm", agent) as llm_span:
+        cached = await asyncio.to_thread(_cached_answer, llm_span, prompt, response_cache, cache_key, use_cache, agent)
+        if cached is not None:
+            return cached
+        response_text = await _agenerate(prompt, temperature, response_mime_type, agent)
+        await asyncio.to_thread(_store_answer, llm_span, response_text, response_cache, cache_key)
+        return response_text
+
+def _parse_structured(response_text: str, schema: dict):
+    parsed = parse_json_object(response_text)
+    if parsed is None:
+        print(f"Warning: Gemini did not return parseable JSON: {response_text[:100]}")
+        return None
+    normalized, errors = validate_structured(parsed, schema)
+    if errors:
+        print(f"Warning: Gemini JSON failed schema validation: {errors}")
+        return None
+    return normalized
+
+def call_gemini_json(prompt: str, schema: dict, temperature=0.2, use_cache: bool = True, agent: str = None):
+    """
+    Asks Gemini for a single JSON object and validates it against `schema`
+    (see utils.structured_output.validate_structured).
+    Returns the normalized dict, or None if the response is not valid so callers can fall back.
+    """
+    response_text = call_gemini(prompt, temperature=temperature, use_cache=use_cache,
+                                response_mime_type="application/json", agent=agent)
+    return _parse_structured(response_text, schema)
+
+async def call_gemini_json_async(prompt: str, schema: dict, temperature=0.2, use_cache: bool = True,
+                                 agent: str = None):
+    """Awaitable call_gemini_json."""
+    response_text = await call_gemini_async(prompt, temperature=temperature, use_cache=use_cache,
+                                            response_mime_type="application/json", agent=agent)
+    return _parse_structured(response_text, schema)
+
+def get_cache_stats() -> dict:
+    """Hit/miss counters of the LLM response cache."""
+    cache = get_response_cache()
+    return cache.stats() if cache else {"enabled": False}
+
+def get_token_usage() -> dict:
+    """Tokens spent per agent and per prompt step (see utils.prompt_budget.TokenLedger)."""
+    return token_ledger.stats()
+
+def _generation_config(temperature: float, response_mime_type: str = None) -> dict:
+    # The SDK accepts a plain dict for GenerationConfig
+    config_kwargs = {"temperature": temperature}
+    if response_mime_type:
+        config_kwargs["response_mime_type"] = response_mime_type
+    return config_kwargs
+
+def _retry_delay(e: Exception, attempt: int):
+    """Seconds to wait before retrying after failed attempt number `attempt`, or None if the
+    error is fatal, the attempts are used up or the retry budget is exhausted."""
+    error_kind = classify_error(e)
+    if error_kind == FATAL or attempt >= retry_policy.max_attempts or not retry_budget.try_spend():
+        print(f"Error calling Gemini ({error_kind}, attempt {attempt}): {e}")
+        return None
+    delay = retry_policy.delay(attempt, server_retry_delay(e))
+    print(f"Gemini call failed ({error_kind}); retrying in {delay:.1f}s (attempt {attempt}/{retry_policy.max_attempts})")
+    return delay
+
+def _response_text(response, estimated_tokens: int, agent: str = None) -> str:
+    usage = getattr(response, "usage_metadata", None)
+    actual_tokens = getattr(usage, "total_token_count", 0) or 0
+    rate_limiter.record_usage(estimated_tokens, actual_tokens)
+    token_ledger.record_call(agent, estimated_tokens, actual_tokens)
+    if response.candidates and response.candidates[0].content.parts:
+        return response.candidates[0].content.parts[0].text.strip()
+    print("Warning: Gemini response was empty or malformed.")
+    return f"{LLM_ERROR_PREFIX} No content in response"
+
+def _generate(prompt: str, temperature: float, response_mime_type: str = None, agent: str = None) -> str:
+    """One logical model call: waits for the rate limiter, then retries rate-limit and
+    transient errors with jittered exponential backoff while the retry budget allows."""
+    config_kwargs = _generation_config(temperature, response_mime_type)
+    client = get_model()
+    estimated_tokens = estimate_tokens(prompt)
+    retry_budget.record_request()
+    attempt = 0
+    while True:
+        rate_limiter.acquire(estimated_tokens)
+        try:
+            response = client.generate_content(prompt, generation_config=config_kwargs)
+        except Exception as e:
+            attempt += 1
+            delay = _retry_delay(e, attempt)
+            if delay is None:
+                return f"{LLM_ERROR_PREFIX} {str(e)}"
+            time.sleep(delay)
+            continue
+        return _response_text(response, estimated_tokens, agent)
+
+async def _agenerate(prompt: str, temperature: float, response_mime_type: str = None, agent: str = None) -> str:
+    """_generate for event loops: rate-limit waits and backoff sleep on the loop."""
+    import asyncio # Only needed by async callers; kept out of the import path of sync ones
+    config_kwargs = _generation_config(temperature, response_mime_type)
+    client = get_model()
+    generate_async = getattr(client, "generate_content_async", None)
+    estimated_tokens = estimate_tokens(prompt)
+    retry_budget.record_request()
+    attempt = 0
+    while True:
+        wait = rate_limiter.reserve(estimated_tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        try:
+            if generate_async is not None:
+                response = await generate_async(prompt, generation_config=config_kwargs)
+            else:
+                response = await asyncio.to_thread(client.generate_content, prompt, generation_config=config_kwargs)
+        except Exception as e:
+            attempt += 1
+            delay = _retry_delay(e, attempt)
+            if delay is None:
+                return f"{LLM_ERROR_PREFIX} {str(e)}"
+            await asyncio.sleep(delay)
+            continue
+        return _response_text(response, estimated_tokens, agent)
 
 if __name__ == '__main__':
     test_prompt = "What is the capital of France?"
@@ -0,0 +1,206 @@
+# utils/local_classifier.py
+import math
+import os
+import re
+import threading
+from collections import Counter, defaultdict
+
+LOCAL_CLASSIFIER_THRESHOLD = float(os.getenv("LOCAL_CLASSIFIER_THRESHOLD", "0.85"))
+# The TF-IDF tier scores the margin of its best class over the runner-up, on its own scale
+LOCAL_CLASSIFIER_TFIDF_THRESHOLD = float(os.getenv("LOCAL_CLASSIFIER_TFIDF_THRESHOLD", "0.25"))
+
+# (intent, pattern, weight in the subject line, weight in the body)
+KEYWORD_RULES = [
+    ("RFQ", r"\bRFQ\b|request for (?:a )?quot(?:e|ation)|\bquotation\b|please (?:provide|send) (?:a |us a )?quote", 0.95, 0.8),
+    ("Invoice", r"\binvoice\b|\bamount due\b|\bpayment due\b|\binvoice (?:no|number|#)", 0.9, 0.7),
+    ("Complaint", r"\bcomplain|\bdamaged\b|\bdefective\b|\brefund\b|\bunacceptable\b|\bdisappointed\b", 0.9, 0.75),
+    ("Regulation", r"\bregulation\b|\bcompliance\b|\bdirective\b|\bpursuant to\b|\barticle \d+", 0.9, 0.7),
+    ("Order Confirmation", r"\border confirm|\byour order (?:has been|is) confirmed|\bthank you for your order\b", 0.95, 0.8),
+]
+_COMPILED_RULES = [(intent, re.compile(pattern, re.IGNORECASE), subject_w, body_w)
+                   for intent, pattern, subject_w, body_w in KEYWORD_RULES]
+_SUBJECT_RE = re.compile(r"^Subject:\s*(.+)$", re.IGNORECASE | re.MULTILINE)
+_TOKEN_RE = re.compile(r"[a-z][a-z0-9_]{2,}")
+
+
+def _tokens(text: str) -> list:
+    return _TOKEN_RE.findall(text.lower())
+
+
+class TfidfCentroidModel:
+    """Tiny TF-IDF nearest-centroid text classifier (no third-party dependencies), meant to
+    be fit on labelled history. predict() returns (label, margin), the margin being the cosine
+    similarity to the best centroid minus the similarity to the runner-up: a text close to every
+    centroid scores low, and a model that knows a single label never scores above 0."""
+
+    def __init__(self, min_examples_per_label: int = 2):
+        self.min_examples_per_label = min_examples_per_label
+        self.idf = {}
+        self.centroids = {}
+
+    def _vector(self, text: str) -> dict:
+        counts = Counter(t for t in _tokens(text) if t in self.idf)
+        vector = {t: c * self.idf[t] for t, c in counts.items()}
+        norm = math.sqrt(sum(v * v for v in vector.values())) or 1.0
+        return {t: v / norm for t, v in vector.items()}
+
+    def fit(self, texts: list, labels: list):
+        document_frequency = Counter()
+        for text in texts:
+            document_frequency.update(set(_tokens(text)))
+        n = len(texts)
+        self.idf = {t: math.log((1 + n) / (1 + df)) + 1 for t, df in document_frequency.items()}
+        sums = defaultdict(Counter)
+        label_counts = Counter(labels)
+        for text, label in zip(texts, labels):
+            if label_counts[label] >= self.min_examples_per_label:
+                sums[label].update(self._vector(text))
+        self.centroids = {}
+        for label, total in sums.items():
+            norm = math.sqrt(sum(v * v for v in total.values())) or 1.0
+            self.centroids[label] = {t: v / norm for t, v in total.items()}
+        return self
+
+    def predict(self, text: str):
+        if not self.centroids:
+            return None, 0.0
+        vector = self._vector(text)
+        scores = {label: sum(w * centroid.get(t, 0.0) for t, w in vector.items())
+                  for label, centroid in self.centroids.items()}
+        ranked = sorted(scores.items(), key=lambda kv: kv[1], reverse=True)
+        label, best = ranked[0]
+        runner_up = ranked[1][1] if len(ranked) > 1 else best
+        return label, max(best - runner_up, 0.0)
+
+
+def _intent_source(data: dict):
+    """Where a classification entry's intent came from. Entries written before sources were
+    recorded have none; every intent was classified by the LLM then. A failed classification
+    ('Other' with an intent error) has no usable label."""
+    if "intent" in (data.get("llm_errors") or {}):
+        return None
+    return data.get("intent_source") or "llm"
+
+
+def llm_labelled(entries):
+    """Agent entries (in log order) whose intent was classified by the LLM, as recorded in the
+    'intent_source' of the thread's latest classification entry. Intents answered by the local
+    tier are left out, so the local tier is never trained or scored on its own answers."""
+    sources = {} # thread_id -> intent source of its latest classification
+    for entry in entries:
+        data = entry.get("extracted_data") or {}
+        if entry.get("agent_processed") == "ClassifierAgent" and entry.get("notes") == "Initial classification":
+            sources[entry["thread_id"]] = _intent_source(data)
+        elif sources.get(entry["thread_id"]) == "llm":
+            yield entry
+
+
+def history_examples(entries) -> list:
+    """(text, label) pairs from SharedMemory entries whose intent came from the LLM, built from
+    the content the agents kept: the email preview and summary, or the JSON preview keys/values."""
+    examples = []
+    for entry in llm_labelled(entries):
+        label = entry.get("classified_intent")
+        data = entry.get("extracted_data") or {}
+        if not label or label == "Other":
+            continue
+        if entry.get("agent_processed") == "EmailAgent" and data.get("original_content_preview"):
+            examples.append((f"{data['original_content_preview']}\n{data.get('crm_summary') or ''}", label))
+        elif entry.get("agent_processed") == "JSONAgent" and isinstance(data.get("original_data_preview"), dict):
+            preview = data["original_data_preview"]
+            examples.append((" ".join(f"{k} {v}" for k, v in preview.items()), label))
+    return examples
+
+
+class LocalIntentClassifier:
+    """Cheap intent tier that runs before the LLM. Combines JSON key signatures (matched
+    against JSONAgent.target_schemas), keyword/regex rules and an optional TF-IDF model,
+    and returns (intent or None, confidence, method). Callers use the LLM when the
+    confidence is below `threshold` (`tfidf_threshold` for the TF-IDF margin)."""
+
+    def __init__(self, schemas: dict = None, model: TfidfCentroidModel = None,
+                 threshold: float = LOCAL_CLASSIFIER_THRESHOLD,
+                 tfidf_threshold: float = LOCAL_CLASSIFIER_TFIDF_THRESHOLD):
+        self.schemas = schemas or {}
+        self.model = model
+        self.threshold = threshold
+        self.tfidf_threshold = tfidf_threshold
+        self.local_hits = 0
+        self.llm_fallbacks = 0
+        self._lock = threading.Lock()
+
+    def _match_json_signature(self, data: dict):
+        best = (None, 0.0)
+        keys = set(data)
+        for intent, schema in self.schemas.items():
+            required = schema.get("required_fields", [])
+            if not required:
+                continue
+            known = set(required) | set(schema.get("optional_fields", []))
+            coverage = len(keys & set(required)) / len(required)
+            # All required fields present is a strong signal; extra known fields add a little
+            confidence = 0.9 * coverage + 0.1 * (len(keys & known) / len(known))
+            if confidence > best[1]:
+                best = (intent, round(confidence, 3))
+        return best
+
+    def _match_keywords(self, text: str):
+        subject_match = _SUBJECT_RE.search(text)
+        subject = subject_match.group(1) if subject_match else ""
+        scores = {}
+        for intent, pattern, subject_weight, body_weight in _COMPILED_RULES:
+            score = 0.0
+            if subject and pattern.search(subject):
+                score = subject_weight
+            elif pattern.search(text):
+                score = body_weight
+            if score:
+                scores[intent] = score
+        if not scores:
+            return None, 0.0
+        ranked = sorted(scores.items(), key=lambda kv: kv[1], reverse=True)
+        intent, confidence = ranked[0]
+        if len(ranked) > 1:
+            # Competing rules make the answer less certain
+            confidence -= 0.5 * ranked[1][1]
+        return intent, round(max(confidence, 0.0), 3)
+
+    def _threshold(self, method: str) -> float:
+        return self.tfidf_threshold if method == "tfidf" else self.threshold
+
+    def predict(self, text: str, source_format: str = None, data: dict = None):
+        """Best local guess as (intent, confidence, method), whatever the confidence. Tiers
+        are compared by how far their confidence is above or below their own threshold."""
+        candidates = []
+        if isinstance(data, dict) and self.schemas:
+            candidates.append(self._match_json_signature(data) + ("json_signature",))
+        if text:
+            candidates.append(self._match_keywords(text) + ("keywords",))
+            if self.model is not None:
+                label, score = self.model.predict(text)
+                candidates.append((label, round(score, 3), "tfidf"))
+        candidates = [c for c in candidates if c[0]]
+        if not candidates:
+            return None, 0.0, None
+        return max(candidates, key=lambda c: c[1] / self._threshold(c[2]))
+
+    def classify(self, text: str, source_format: str = None, data: dict = None):
+        """Like predict, but returns (None, confidence, method) below the threshold and
+        counts local hits vs LLM fallbacks."""
+        intent, confidence, method = self.predict(text, source_format, data)
+        confident = intent is not None and confidence >= self._threshold(method)
+        with self._lock:
+            if confident:
+                self.local_hits += 1
+            else:
+                self.llm_fallbacks += 1
+        return (intent if confident else None), confidence, method
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.local_hits + self.llm_fallbacks
+            return {
+                "local_hits": self.local_hits,
+                "llm_fallbacks": self.llm_fallbacks,
+                "llm_call_reduction": round(self.local_hits / total, 4) if total else 0.0,
+            }
@@ -0,0 +1,329 @@
+# utils/metrics.py
+import atexit
+import bisect
+import contextlib
+import contextvars
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+# Most recent spans kept for JSON snapshots and per-thread lookups
+METRICS_SPAN_BUFFER = int(os.getenv("METRICS_SPAN_BUFFER", "10000"))
+# Recent durations per stage used for p50/p95/p99
+METRICS_SAMPLE_SIZE = int(os.getenv("METRICS_SAMPLE_SIZE", "2048"))
+# Written on exit when set: Prometheus text for *.prom, a JSON snapshot otherwise
+METRICS_EXPORT_PATH = os.getenv("METRICS_EXPORT_PATH")
+# Address serve_metrics binds to; set 0.0.0.0 to expose the endpoint beyond this host
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+# Exported spans leave out source identifiers (file names, mail UIDs) unless this is set
+METRICS_EXPORT_SOURCES = os.getenv("METRICS_EXPORT_SOURCES", "0") == "1"
+
+# Prometheus histogram buckets in seconds, from local stages (ms) to slow LLM calls
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+QUANTILES = (0.5, 0.95, 0.99)
+# Numeric span attributes summed per stage and exported as counters
+COUNTED_ATTRIBUTES = ("prompt_tokens", "response_chars", "input_chars")
+
+_current_trace = contextvars.ContextVar("metrics_trace", default=None)
+
+
+class Trace:
+    """Spans of one document's trip through the pipeline. The thread_id is usually only
+    known after the first memory write, so spans refer to the trace and pick it up from here."""
+    __slots__ = ("trace_id", "source_identifier", "thread_id")
+
+    def __init__(self, source_identifier: str = None, thread_id: str = None):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.source_identifier = source_identifier
+        self.thread_id = thread_id
+
+
+class Span:
+    __slots__ = ("stage", "step", "trace", "start", "duration", "error", "attributes", "_started")
+
+    def __init__(self, stage: str, step: str = None, trace: Trace = None, **attributes):
+        self.stage = stage
+        self.step = step
+        self.trace = trace
+        self.start = time.time()
+        self._started = time.perf_counter()
+        self.duration = None
+        self.error = None
+        self.attributes = attributes
+
+    def set(self, **attributes):
+        """Adds attributes such as prompt_tokens, response_chars or cache="hit"."""
+        self.attributes.update(attributes)
+        return self
+
+    def finish(self):
+        """Stops the clock before the block ends, e.g. before handing off to work timed elsewhere."""
+        if self.duration is None:
+            self.duration = time.perf_counter() - self._started
+        return self
+
+    def fail(self, error):
+        """Marks the span as failed without raising (e.g. an LLM error marker was returned)."""
+        self.error = error if isinstance(error, str) else f"{type(error).__name__}: {error}"
+        return self
+
+    def to_dict(self, include_source: bool = False) -> dict:
+        span = {
+            "stage": self.stage,
+            "step": self.step,
+            "trace_id": self.trace.trace_id if self.trace else None,
+            "thread_id": self.trace.thread_id if self.trace else None,
+            "start": self.start,
+            "duration_ms": round(self.duration * 1000, 3) if self.duration is not None else None,
+            "error": self.error,
+            **self.attributes,
+        }
+        if include_source:
+            span["source_identifier"] = self.trace.source_identifier if self.trace else None
+        return span
+
+
+class _StageStats:
+    __slots__ = ("count", "errors", "cache_hits", "total", "buckets", "samples", "counters")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.cache_hits = 0
+        self.total = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1) # Last slot is +Inf
+        self.samples = deque(maxlen=METRICS_SAMPLE_SIZE)
+        self.counters = dict.fromkeys(COUNTED_ATTRIBUTES, 0)
+
+    def add(self, span: Span):
+        self.count += 1
+        self.errors += span.error is not None
+        self.cache_hits += span.attributes.get("cache") == "hit"
+        self.total += span.duration
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, span.duration)] += 1
+        self.samples.append(span.duration)
+        for name in COUNTED_ATTRIBUTES:
+            value = span.attributes.get(name)
+            if isinstance(value, (int, float)):
+                self.counters[name] += value
+
+    def quantiles(self) -> dict:
+        ordered = sorted(self.samples)
+        if not ordered:
+            return {f"p{int(q * 100)}_ms": None for q in QUANTILES}
+        return {f"p{int(q * 100)}_ms": round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 3)
+                for q in QUANTILES}
+
+
+def _escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class MetricsRegistry:
+    """Per-stage timing spans for the processing pipeline (read, pdf_extract,
+    format_classification, intent, llm, agent, memory_write). Every finished span is
+    folded into per-(stage, step) aggregates, a histogram plus a window of recent
+    durations for quantiles, and kept in a bounded buffer of recent spans.
+
+        with metrics.trace(source_identifier):
+            with metrics.span("read") as s:
+                ...
+                s.set(input_chars=len(text))
+    """
+
+    def __init__(self, span_buffer: int = METRICS_SPAN_BUFFER, enabled: bool = METRICS_ENABLED):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._spans = deque(maxlen=span_buffer)
+        self._stats = {} # (stage, step) -> _StageStats
+        self.started_at = time.time()
+
+    @contextlib.contextmanager
+    def trace(self, source_identifier: str = None, thread_id: str = None):
+        """Groups the spans recorded in this context (including PromptGroup steps) under one trace."""
+        current = Trace(source_identifier, thread_id)
+        token = _current_trace.set(current)
+        try:
+            yield current
+        finally:
+            _current_trace.reset(token)
+
+    def bind_thread(self, thread_id: str):
+        """Attaches the current trace to a memory thread, once it is known."""
+        current = _current_trace.get()
+        if current is not None and current.thread_id is None:
+            current.thread_id = thread_id
+
+    @contextlib.contextmanager
+    def span(self, stage: str, step: str = None, **attributes):
+        span = Span(stage, step, _current_trace.get(), **attributes)
+        try:
+            yield span
+        except BaseException as e:
+            span.fail(e)
+            raise
+        finally:
+            span.finish()
+            if self.enabled:
+                self.record(span)
+
+    def timed(self, stage: str, step: str = None):
+        """Decorator form of span() for plain and async functions. Without `step`, agent
+        methods use the agent's name."""
+        def decorator(func):
+            if inspect.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    label = step or (getattr(args[0], "agent_name", None) if args else None)
+                    with self.span(stage, label):
+                        return await func(*args, **kwargs)
+                return async_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                label = step or (getattr(args[0], "agent_name", None) if args else None)
+                with self.span(stage, label):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def record(self, span: Span):
+        with self._lock:
+            self._spans.append(span)
+            key = (span.stage, span.step)
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = _StageStats()
+            stats.add(span)
+
+    def reset(self):
+        with self._lock:
+            self._spans.clear()
+            self._stats.clear()
+            self.started_at = time.time()
+
+    def spans(self, thread_id: str = None, limit: int = None, include_sources: bool = METRICS_EXPORT_SOURCES) -> list:
+        """Recent spans as dicts, oldest first, optionally only those of one thread. Source
+        identifiers are only included with `include_sources`."""
+        with self._lock:
+            spans = list(self._spans)
+        if thread_id is not None:
+            spans = [s for s in spans if s.trace is not None and s.trace.thread_id == thread_id]
+        if limit is not None:
+            spans = spans[-limit:]
+        return [s.to_dict(include_sources) for s in spans]
+
+    def stage_summary(self) -> list:
+        """One row per (stage, step): count, errors, cache hits, mean and p50/p95/p99 in ms,
+        slowest p95 first."""
+        with self._lock:
+            items = [(key, stats, stats.quantiles()) for key, stats in self._stats.items()]
+        rows = []
+        for (stage, step), stats, quantiles in items:
+            rows.append({
+                "stage": stage,
+                "step": step,
+                "count": stats.count,
+                "errors": stats.errors,
+                "cache_hits": stats.cache_hits,
+                "mean_ms": round(stats.total / stats.count * 1000, 3),
+                **quantiles,
+                **{name: value for name, value in stats.counters.items() if value},
+            })
+        rows.sort(key=lambda r: r["p95_ms"] or 0, reverse=True)
+        return rows
+
+    def snapshot(self, include_spans: bool = False, include_sources: bool = METRICS_EXPORT_SOURCES) -> dict:
+        """JSON-serializable view of the aggregates (and the recent spans if asked)."""
+        snapshot = {"started_at": self.started_at, "generated_at": time.time(), "stages": self.stage_summary()}
+        if include_spans:
+            snapshot["spans"] = self.spans(include_sources=include_sources)
+        return snapshot
+
+    def prometheus_text(self) -> str:
+        """Aggregates in the Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            items = [(key, stats.count, stats.errors, stats.cache_hits, stats.total, list(stats.buckets),
+                      dict(stats.counters)) for key, stats in sorted(self._stats.items(), key=lambda kv: (kv[0][0], kv[0][1] or ""))]
+        lines = [
+            "# HELP pipeline_stage_duration_seconds Time spent per pipeline stage.",
+            "# TYPE pipeline_stage_duration_seconds histogram",
+        ]
+        for (stage, step), count, _, _, total, buckets, _ in items:
+            labels = f'stage="{_escape_label(stage)}",step="{_escape_label(step or "")}"'
+            cumulative = 0
+            for bound, bucket in zip(LATENCY_BUCKETS, buckets):
+                cumulative += bucket
+                lines.append(f'pipeline_stage_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'pipeline_stage_duration_seconds_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f"pipeline_stage_duration_seconds_sum{{{labels}}} {total:.6f}")
+            lines.append(f"pipeline_stage_duration_seconds_count{{{labels}}} {count}")
+        counters = [("pipeline_stage_errors_total", "Failed spans per pipeline stage.", lambda item: item[2]),
+                    ("pipeline_stage_cache_hits_total", "Spans answered from a cache.", lambda item: item[3])]
+        counters += [(f"pipeline_stage_{name}_total", f"Sum of {name} over spans.", lambda item, n=name: item[6][n])
+                     for name in COUNTED_ATTRIBUTES]
+        for metric, help_text, value in counters:
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} counter")
+            for item in items:
+                stage, step = item[0]
+                lines.append(f'{metric}{{stage="{_escape_label(stage)}",step="{_escape_label(step or "")}"}} {value(item)}')
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str):
+        """Writes Prometheus text (*.prom, *.txt) or a JSON snapshot with recent spans."""
+        if path.endswith((".prom", ".txt")):
+            content = self.prometheus_text()
+        else:
+            content = json.dumps(self.snapshot(include_spans=True), indent=2)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+
+metrics = MetricsRegistry()
+span = metrics.span
+trace = metrics.trace
+timed = metrics.timed
+
+
+def serve_metrics(port: int, host: str = METRICS_HOST):
+    """Serves /metrics (Prometheus text) and /metrics.json from a daemon thread, on localhost
+    unless METRICS_HOST (or `host`) says otherwise."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = self.path.split("?")[0]
+            if path == "/metrics":
+                body, content_type = metrics.prometheus_text(), "text/plain; version=0.0.4"
+            elif path == "/metrics.json":
+                body, content_type = json.dumps(metrics.snapshot(include_spans="spans" in self.path)), "application/json"
+            else:
+                self.send_error(404)
+                return
+            payload = body.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass # Scrapes every few seconds would flood the console
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    print(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
+
+
+if METRICS_EXPORT_PATH:
+    atexit.register(lambda: metrics.write(METRICS_EXPORT_PATH))
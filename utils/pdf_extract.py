@@ -0,0 +1,166 @@
+# utils/pdf_extract.py
+import io
+import mmap
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+MAX_PDF_BYTES = int(os.getenv("MAX_PDF_BYTES", str(50 * 1024 * 1024)))
+MAX_PDF_PAGES = int(os.getenv("MAX_PDF_PAGES", "500"))
+PARALLEL_PAGE_THRESHOLD = int(os.getenv("PDF_PARALLEL_PAGE_THRESHOLD", "40")) # Below this, one process is faster
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+# PDF bytes handed to the pool are written here once and memory-mapped by the workers
+PDF_SPILL_DIR = os.getenv("PDF_SPILL_DIR") or ("/dev/shm" if os.path.isdir("/dev/shm") else None)
+
+
+_pdf_reader = None
+_pdf_reader_loaded = False
+_pdf_reader_lock = threading.Lock()
+_pool = None # Shared by every extract_pdf_text call; started on first use
+_pool_lock = threading.Lock()
+
+
+def get_pdf_reader():
+    """PyPDF2.PdfReader, imported on first use; None if PyPDF2 is not installed."""
+    global _pdf_reader, _pdf_reader_loaded
+    if not _pdf_reader_loaded:
+        with _pdf_reader_lock:
+            if not _pdf_reader_loaded:
+                try:
+                    from PyPDF2 import PdfReader # For PDF text extraction
+                    _pdf_reader = PdfReader
+                except ImportError:
+                    print("PyPDF2 not installed. PDF processing will be limited to filename detection.")
+                _pdf_reader_loaded = True
+    return _pdf_reader
+
+
+def pdf_support_available() -> bool:
+    return get_pdf_reader() is not None
+
+
+class PDFLimitError(ValueError):
+    """Raised when a PDF is larger than MAX_PDF_BYTES."""
+
+
+class _PDFSource:
+    """Opens bytes or a file path for PdfReader. Paths are memory-mapped, so pages are read
+    from the page cache on demand instead of copying the whole file into memory first."""
+
+    def __init__(self, source, max_bytes: int):
+        self._file = None
+        self._mmap = None
+        is_bytes = isinstance(source, (bytes, bytearray, memoryview))
+        size = len(source) if is_bytes else os.path.getsize(source)
+        if size > max_bytes:
+            raise PDFLimitError(f"PDF is {size} bytes, above the {max_bytes} byte limit")
+        if is_bytes:
+            self.stream = io.BytesIO(source)
+        else:
+            self._file = open(source, 'rb')
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+            self.stream = self._mmap if self._mmap is not None else self._file
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if self._mmap is not None:
+            self._mmap.close()
+        if self._file is not None:
+            self._file.close()
+
+
+def iter_pdf_pages(source, max_pages: int = MAX_PDF_PAGES, max_bytes: int = MAX_PDF_BYTES,
+                   start: int = 0, stop: int = None):
+    """Yields the text of each page (possibly empty) lazily, one page at a time.
+    `source` is PDF bytes or a file path. Pages past `max_pages` are not read."""
+    PdfReader = get_pdf_reader()
+    if not PdfReader:
+        raise RuntimeError("PyPDF2 not available")
+    with _PDFSource(source, max_bytes) as pdf:
+        reader = PdfReader(pdf.stream)
+        page_count = len(reader.pages)
+        if stop is None and page_count > max_pages:
+            print(f"Warning: PDF has {page_count} pages; only the first {max_pages} are read.")
+        end = min(page_count, max_pages, stop if stop is not None else page_count)
+        for page_number in range(start, end):
+            yield reader.pages[page_number].extract_text() or ""
+
+
+def count_pdf_pages(source, max_bytes: int = MAX_PDF_BYTES) -> int:
+    PdfReader = get_pdf_reader()
+    if not PdfReader:
+        raise RuntimeError("PyPDF2 not available")
+    with _PDFSource(source, max_bytes) as pdf:
+        return len(PdfReader(pdf.stream).pages)
+
+
+def extract_pdf_prefix(source, max_chars: int, max_pages: int = MAX_PDF_PAGES,
+                       max_bytes: int = MAX_PDF_BYTES) -> str:
+    """Text of the leading pages, stopping as soon as `max_chars` characters are available."""
+    parts = []
+    collected = 0
+    for page_text in iter_pdf_pages(source, max_pages=max_pages, max_bytes=max_bytes):
+        if page_text:
+            parts.append(page_text)
+            collected += len(page_text) + 1
+        if collected >= max_chars:
+            break
+    return "\n".join(parts).strip()[:max_chars]
+
+
+def _extract_page_range(source, start: int, stop: int, max_bytes: int) -> str:
+    # Runs in a worker process; each worker opens (or maps) the PDF itself
+    pages = iter_pdf_pages(source, max_pages=stop, max_bytes=max_bytes, start=start, stop=stop)
+    return "\n".join(text for text in pages if text)
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(max_workers=PDF_EXTRACT_WORKERS)
+    return _pool
+
+
+def _discard_pool(pool: ProcessPoolExecutor):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+
+def _extract_in_pool(path: str, ranges: list, max_bytes: int) -> str:
+    pool = _get_pool()
+    try:
+        futures = [pool.submit(_extract_page_range, path, start, stop, max_bytes) for start, stop in ranges]
+        return "\n".join(text for text in (f.result() for f in futures) if text)
+    except BrokenProcessPool:
+        # A worker died (e.g. killed for memory); start a fresh pool next time, finish in-process
+        print("Warning: PDF extraction pool broke; extracting in this process.")
+        _discard_pool(pool)
+        return "\n".join(_extract_page_range(path, start, stop, max_bytes) for start, stop in ranges)
+
+
+def extract_pdf_text(source, max_pages: int = MAX_PDF_PAGES, max_bytes: int = MAX_PDF_BYTES,
+                     workers: int = PDF_EXTRACT_WORKERS) -> str:
+    """Full text of the PDF. Files with at least PARALLEL_PAGE_THRESHOLD pages are split into
+    page ranges extracted in parallel by a process pool shared across calls. Workers receive
+    a path and a page range, never the PDF bytes: bytes are written once to a temporary file
+    (in PDF_SPILL_DIR) that each worker memory-maps."""
+    page_count = min(count_pdf_pages(source, max_bytes=max_bytes), max_pages)
+    if workers <= 1 or page_count < PARALLEL_PAGE_THRESHOLD:
+        return _extract_page_range(source, 0, page_count, max_bytes).strip()
+    chunk = -(-page_count // workers) # ceil division
+    ranges = [(start, min(start + chunk, page_count)) for start in range(0, page_count, chunk)]
+    if not isinstance(source, (bytes, bytearray, memoryview)):
+        return _extract_in_pool(source, ranges, max_bytes).strip()
+    with tempfile.NamedTemporaryFile(dir=PDF_SPILL_DIR, prefix="pdf_extract_", suffix=".pdf") as spill:
+        spill.write(source)
+        spill.flush()
+        return _extract_in_pool(spill.name, ranges, max_bytes).strip()
@@ -0,0 +1,181 @@
+# utils/prompt_budget.py
+import functools
+import os
+import re
+import threading
+from collections import defaultdict
+from .text_normalize import split_headers, strip_quoted_replies, strip_signature
+
+# Per-call content budgets in tokens (the old fixed slices were 1000/1500/2000 characters,
+# roughly 250/375/500 tokens). Override with PROMPT_BUDGET_<NAME>, e.g. PROMPT_BUDGET_SUMMARY=800.
+DEFAULT_BUDGETS = {"intent": 500, "sender": 250, "urgency": 375, "summary": 500, "analysis": 500}
+PROMPT_BUDGETS = {name: int(os.getenv(f"PROMPT_BUDGET_{name.upper()}", str(tokens)))
+                  for name, tokens in DEFAULT_BUDGETS.items()}
+
+# Local approximation of a subword tokenizer: words split into pieces of up to 4 characters,
+# every punctuation mark on its own. Close enough to Gemini's counts for budgeting.
+_TOKEN_RE = re.compile(r"\w{1,4}|[^\w\s]")
+_PROMPT_HEADERS = ("from", "to", "cc", "date", "subject")
+BOILERPLATE_RE = re.compile(
+    r"unsubscribe|this (?:e-?mail|message) (?:and any attachments )?(?:is|are|may be) confidential"
+    r"|intended (?:solely )?for the (?:use of the )?(?:individual|addressee)|privileged and confidential"
+    r"|please consider the environment before printing|view (?:this email )?in (?:your|a) browser",
+    re.IGNORECASE)
+# Lines worth keeping even when their paragraph is dropped: amounts, quantities, dates, deadlines
+INFORMATIVE_RE = re.compile(
+    r"[$€£]\s?\d|\d[\d,.]*\s?(?:%|(?:usd|eur|gbp|units?|pcs|pieces|kg|hours|days)\b)|\b\d{4}-\d{2}-\d{2}\b"
+    r"|\b\d{1,2}[/.]\d{1,2}[/.]\d{2,4}\b"
+    r"|\b(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.? \d{1,2}(?:st|nd|rd|th)?\b"
+    r"|\b(?:deadline|due|by (?:monday|tuesday|wednesday|thursday|friday|end of)|asap|urgent|invoice|order|quote)\b",
+    re.IGNORECASE)
+# Salutation-only paragraphs ("Dear Sales Team,") carry nothing the prompts need
+GREETING_RE = re.compile(r"^(?:dear|hi|hello|hey|good (?:morning|afternoon|evening)|to whom it may concern)\b[^\n]{0,60}$",
+                         re.IGNORECASE)
+_PARAGRAPH_SPLIT_RE = re.compile(r"\n\s*\n")
+OMITTED_MARKER = "[...]"
+
+
+def count_tokens(text: str) -> int:
+    return len(_TOKEN_RE.findall(text)) if text else 0
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Longest prefix of `text` within `max_tokens`, cut at a word boundary."""
+    if max_tokens <= 0:
+        return ""
+    for i, match in enumerate(_TOKEN_RE.finditer(text)):
+        if i == max_tokens:
+            cut = text.rfind(" ", 0, match.start())
+            return text[:cut if cut > 0 else match.start()].rstrip()
+    return text
+
+
+@functools.lru_cache(maxsize=64)
+def _segments(text: str, email: bool, keep_signature: bool):
+    """(header lines, [(paragraph, token count, score)]) for the cleaned text. Cached because
+    the same email is budgeted for several prompts (intent, sender, urgency, summary)."""
+    header_lines = []
+    body = text
+    if email:
+        headers, body = split_headers(text)
+        header_lines = [f"{name.capitalize()}: {headers[name]}" for name in _PROMPT_HEADERS if headers.get(name)]
+        body = strip_quoted_replies(body)
+        if not keep_signature:
+            body = strip_signature(body)
+    paragraphs = []
+    for paragraph in _PARAGRAPH_SPLIT_RE.split(body):
+        lines = [line.rstrip() for line in paragraph.strip().splitlines() if not BOILERPLATE_RE.search(line)]
+        if lines and not (len(lines) == 1 and GREETING_RE.match(lines[0])):
+            paragraphs.append("\n".join(lines))
+    scored = []
+    for position, paragraph in enumerate(paragraphs):
+        # Opening paragraphs state the request; amounts, dates and deadlines carry the details
+        score = 3.0 if position == 0 else 1.5 if position == 1 else 1.0 / position
+        score += min(len(INFORMATIVE_RE.findall(paragraph)), 3) * 0.75
+        if keep_signature and position == len(paragraphs) - 1:
+            score += 2.0 # Sender extraction wants the sign-off
+        scored.append((paragraph, count_tokens(paragraph), score))
+    return header_lines, scored
+
+
+def fit_to_budget(text: str, max_tokens: int, email: bool = True, keep_signature: bool = False,
+                  agent: str = None) -> str:
+    """Content for a prompt within `max_tokens`. For email-like text, headers are reduced to
+    From/To/Date/Subject and quoted replies, signature (unless `keep_signature`) and
+    boilerplate are dropped. Paragraphs are then picked by informativeness (opening
+    paragraphs, amounts, dates, deadlines) and kept in their original order, with
+    "[...]" where something was left out; a paragraph that does not fit is cut at a word
+    boundary. `agent` attributes the trimming to a ledger entry."""
+    text = text or ""
+    header_lines, paragraphs = _segments(text, email, keep_signature)
+    header = "\n".join(header_lines)
+    remaining = max_tokens - count_tokens(header)
+    if remaining <= 0:
+        result = truncate_to_tokens(header, max_tokens)
+    elif sum(tokens for _, tokens, _ in paragraphs) <= remaining:
+        result = "\n\n".join([header] + [p for p, _, _ in paragraphs] if header else [p for p, _, _ in paragraphs])
+    else:
+        remaining -= 2 * count_tokens(OMITTED_MARKER) # Room for the markers around a cut
+        chosen = {}
+        ranked = sorted(range(len(paragraphs)), key=lambda i: paragraphs[i][2], reverse=True)
+        for index in ranked:
+            paragraph, tokens, _ = paragraphs[index]
+            if tokens <= remaining:
+                chosen[index] = paragraph
+                remaining -= tokens
+        # The best paragraph that did not fit whole: keep as much of its start as the budget allows
+        best = next((index for index in ranked if index not in chosen), None)
+        if best is not None and remaining > 20:
+            chosen[best] = truncate_to_tokens(paragraphs[best][0], remaining - 2) + " " + OMITTED_MARKER
+            remaining = 0
+        # Leftover budget: informative single lines from paragraphs that were dropped
+        for index, (paragraph, _, _) in enumerate(paragraphs):
+            if index in chosen or remaining <= 0:
+                continue
+            lines = [line for line in paragraph.splitlines() if INFORMATIVE_RE.search(line)]
+            picked = []
+            for line in lines:
+                tokens = count_tokens(line)
+                if tokens <= remaining:
+                    picked.append(line)
+                    remaining -= tokens
+            if picked:
+                chosen[index] = "\n".join(picked)
+        parts = [header] if header else []
+        previous = -1
+        for index in sorted(chosen):
+            if index != previous + 1:
+                parts.append(OMITTED_MARKER)
+            parts.append(chosen[index])
+            previous = index
+        if previous != len(paragraphs) - 1:
+            parts.append(OMITTED_MARKER)
+        result = "\n\n".join(parts)
+        if count_tokens(result) > max_tokens: # Many gaps; markers alone can overshoot
+            result = truncate_to_tokens(result, max_tokens)
+    if agent:
+        token_ledger.record_trim(agent, count_tokens(text), count_tokens(result))
+    return result
+
+
+class TokenLedger:
+    """Per-agent token accounting. Labels look like 'EmailAgent.urgency'; stats() also sums
+    them per agent (the part before the dot)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self._calls = defaultdict(lambda: {"calls": 0, "cached_calls": 0, "prompt_tokens": 0, "total_tokens": 0,
+                                           "input_tokens": 0, "kept_tokens": 0})
+
+    def record_call(self, label: str, prompt_tokens: int, total_tokens: int = 0, cached: bool = False):
+        """One LLM request. `total_tokens` is the billed count (prompt + response) when the API
+        reports it; cached answers cost nothing."""
+        with self._lock:
+            stats = self._calls[label or "unattributed"]
+            stats["calls"] += 1
+            stats["prompt_tokens"] += prompt_tokens
+            if cached:
+                stats["cached_calls"] += 1
+            else:
+                stats["total_tokens"] += total_tokens or prompt_tokens
+
+    def record_trim(self, label: str, input_tokens: int, kept_tokens: int):
+        with self._lock:
+            stats = self._calls[label]
+            stats["input_tokens"] += input_tokens
+            stats["kept_tokens"] += kept_tokens
+
+    def stats(self) -> dict:
+        with self._lock:
+            by_label = {label: dict(values) for label, values in self._calls.items()}
+        by_agent = defaultdict(lambda: defaultdict(int))
+        for label, values in by_label.items():
+            for key, value in values.items():
+                by_agent[label.split(".")[0]][key] += value
+        return {"by_agent": {a: dict(v) for a, v in by_agent.items()}, "by_step": by_label}
+
+
+token_ledger = TokenLedger()
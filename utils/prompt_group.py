@@ -0,0 +1,116 @@
+# utils/prompt_group.py
+import contextvars
+import inspect
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+LLM_MAX_PARALLEL_CALLS = int(os.getenv("LLM_MAX_PARALLEL_CALLS", "8"))
+
+_shared_executor = None
+_shared_executor_lock = threading.Lock()
+
+
+def _get_shared_executor() -> ThreadPoolExecutor:
+    global _shared_executor
+    with _shared_executor_lock:
+        if _shared_executor is None:
+            _shared_executor = ThreadPoolExecutor(max_workers=LLM_MAX_PARALLEL_CALLS,
+                                                  thread_name_prefix="prompt-group")
+        return _shared_executor
+
+
+class PromptGroup:
+    """A small dependency graph of LLM steps. Steps without pending dependencies run
+    concurrently on a shared thread pool; a dependent step starts as soon as the steps
+    it needs have finished and receives their results.
+
+        group = PromptGroup()
+        group.add("intent", lambda r: classify(text))
+        group.add("urgency", lambda r: assess_urgency(text))
+        group.add("summary", lambda r: summarize(text, r["intent"]), depends_on=["intent"])
+        results = group.run()  # {"intent": ..., "urgency": ..., "summary": ...}
+
+    Inside an event loop, steps may return awaitables and `await group.arun()` runs them as
+    tasks on the loop instead of threads.
+    """
+
+    def __init__(self, executor: ThreadPoolExecutor = None):
+        self._steps = {} # name -> (func, depends_on)
+        self._executor = executor
+
+    def add(self, name: str, func, depends_on=()):
+        """Registers a step. `func` is called with a dict of its dependencies' results."""
+        if name in self._steps:
+            raise ValueError(f"Step '{name}' is already part of this group.")
+        self._steps[name] = (func, tuple(depends_on))
+        return self
+
+    def __len__(self):
+        return len(self._steps)
+
+    def _check_dependencies(self):
+        for name, (_, depends_on) in self._steps.items():
+            missing = [d for d in depends_on if d not in self._steps]
+            if missing:
+                raise ValueError(f"Step '{name}' depends on unknown step(s): {', '.join(missing)}")
+
+    def run(self) -> dict:
+        """Runs every step and returns {step name: result}. An exception raised by a step
+        propagates to the caller and its dependents are never started."""
+        self._check_dependencies()
+
+        executor = self._executor or _get_shared_executor()
+        results = {}
+        pending = dict(self._steps)
+        running = {} # future -> step name
+        while pending or running:
+            ready = [name for name, (_, depends_on) in pending.items() if all(d in results for d in depends_on)]
+            if len(ready) == 1 and not running:
+                # Nothing to overlap with; skip the thread hop
+                func, depends_on = pending.pop(ready[0])
+                results[ready[0]] = func({d: results[d] for d in depends_on})
+                continue
+            for name in ready:
+                func, depends_on = pending.pop(name)
+                # Steps run in the caller's context, so their metrics spans join the caller's trace
+                context = contextvars.copy_context()
+                running[executor.submit(context.run, func, {d: results[d] for d in depends_on})] = name
+            if not running:
+                raise ValueError(f"Circular dependencies between steps: {', '.join(pending)}")
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[running.pop(future)] = future.result()
+        return results
+
+    async def arun(self) -> dict:
+        """run() for event loops: each step is a task that starts once its dependencies are done;
+        a step may be a coroutine function or return an awaitable. If a step fails, the steps
+        still running are cancelled and the exception propagates."""
+        import asyncio
+        self._check_dependencies()
+        resolved, remaining = set(), dict(self._steps)
+        while remaining: # Same cycle check as run(), before anything is started
+            ready = [name for name, (_, depends_on) in remaining.items() if all(d in resolved for d in depends_on)]
+            if not ready:
+                raise ValueError(f"Circular dependencies between steps: {', '.join(remaining)}")
+            for name in ready:
+                resolved.add(name)
+                del remaining[name]
+
+        tasks = {}
+
+        async def run_step(func, depends_on):
+            inputs = {d: await tasks[d] for d in depends_on}
+            result = func(inputs)
+            return await result if inspect.isawaitable(result) else result
+
+        for name, (func, depends_on) in self._steps.items():
+            tasks[name] = asyncio.ensure_future(run_step(func, depends_on))
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            raise
+        return {name: task.result() for name, task in tasks.items()}
@@ -0,0 +1,148 @@
+# utils/rate_limiter.py
+import random
+import re
+import threading
+import time
+from collections import deque
+
+# Error kinds returned by classify_error
+RATE_LIMITED = "rate_limited"
+TRANSIENT = "transient"
+FATAL = "fatal"
+
+TRANSIENT_STATUS_CODES = {408, 500, 502, 503, 504}
+TRANSIENT_EXCEPTION_NAMES = {"ServiceUnavailable", "InternalServerError", "DeadlineExceeded", "GatewayTimeout",
+                             "BadGateway", "Aborted", "RetryError", "ConnectionError", "Timeout", "TimeoutError"}
+_RETRY_DELAY_RE = re.compile(r"retry_delay\s*\{\s*seconds:\s*(\d+)")
+
+
+class TokenBucket:
+    """Classic token bucket: holds up to `capacity` tokens and refills at `rate_per_second`."""
+
+    def __init__(self, capacity: float, rate_per_second: float):
+        self.capacity = capacity
+        self.rate_per_second = rate_per_second
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate_per_second)
+        self._updated = now
+
+    def reserve(self, amount: float) -> float:
+        """Takes `amount` tokens, going into debt if needed, and returns how long the caller
+        must wait before the debt is repaid. Reserving (instead of polling) keeps callers FIFO."""
+        amount = min(amount, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= amount
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate_per_second
+
+    def adjust(self, amount: float):
+        """Debits (positive) or credits (negative) tokens after the fact, e.g. once the real
+        token usage of a request is known."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self.capacity, self._tokens - amount)
+
+
+class RateLimiter:
+    """Client-side limit on requests per minute and tokens per minute, shared by all threads
+    calling the model. A limit of 0 disables that dimension."""
+
+    def __init__(self, requests_per_minute: float = 0, tokens_per_minute: float = 0):
+        self.requests = TokenBucket(requests_per_minute, requests_per_minute / 60.0) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute, tokens_per_minute / 60.0) if tokens_per_minute else None
+
+    def reserve(self, estimated_tokens: int = 0) -> float:
+        """Reserves one request carrying `estimated_tokens` and returns the seconds to wait
+        before sending it, without blocking (async callers sleep on their event loop)."""
+        wait = 0.0
+        if self.requests:
+            wait = max(wait, self.requests.reserve(1))
+        if self.tokens and estimated_tokens:
+            wait = max(wait, self.tokens.reserve(estimated_tokens))
+        return wait
+
+    def acquire(self, estimated_tokens: int = 0):
+        """Blocks until one request carrying `estimated_tokens` may be sent."""
+        wait = self.reserve(estimated_tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def record_usage(self, estimated_tokens: int, actual_tokens: int):
+        if self.tokens and actual_tokens:
+            self.tokens.adjust(actual_tokens - estimated_tokens)
+
+
+class RetryBudget:
+    """Caps retries to a fraction of recent requests (plus a small floor), so a struggling
+    backend is not hammered by every caller retrying at once."""
+
+    def __init__(self, ratio: float = 0.2, min_retries_per_window: int = 10, window_seconds: float = 60.0):
+        self.ratio = ratio
+        self.min_retries_per_window = min_retries_per_window
+        self.window_seconds = window_seconds
+        self._requests = deque()
+        self._retries = deque()
+        self._lock = threading.Lock()
+
+    def _trim(self, now: float):
+        for events in (self._requests, self._retries):
+            while events and now - events[0] > self.window_seconds:
+                events.popleft()
+
+    def record_request(self):
+        with self._lock:
+            now = time.monotonic()
+            self._trim(now)
+            self._requests.append(now)
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            self._trim(now)
+            allowed = max(self.min_retries_per_window, self.ratio * len(self._requests))
+            if len(self._retries) >= allowed:
+                return False
+            self._retries.append(now)
+            return True
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter: attempt n waits uniform(0, min(max_delay, base * 2**n))."""
+
+    def __init__(self, max_attempts: int = 4, base_delay: float = 1.0, max_delay: float = 30.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt: int, server_hint: float = None) -> float:
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        if server_hint:
+            # The server told us when quota frees up; never retry earlier than that
+            return min(self.max_delay, server_hint) + backoff * 0.1
+        return backoff
+
+
+def classify_error(exc: Exception) -> str:
+    """Buckets an exception raised by the model client into RATE_LIMITED, TRANSIENT or FATAL."""
+    code = getattr(exc, "code", None)
+    code = code if isinstance(code, int) else None
+    message = str(exc)
+    if code == 429 or type(exc).__name__ in ("ResourceExhausted", "TooManyRequests") or \
+       "429" in message or "quota" in message.lower():
+        return RATE_LIMITED
+    if code in TRANSIENT_STATUS_CODES or type(exc).__name__ in TRANSIENT_EXCEPTION_NAMES or \
+       isinstance(exc, (ConnectionError, TimeoutError)):
+        return TRANSIENT
+    return FATAL
+
+
+def server_retry_delay(exc: Exception):
+    """Seconds the server asked us to wait (e.g. Gemini's 429 'retry_delay'), if any."""
+    match = _RETRY_DELAY_RE.search(str(exc))
+    return float(match.group(1)) if match else None
@@ -0,0 +1,275 @@
+# utils/schema_validation.py
+import math
+import os
+try:
+    import numpy as np # Optional: speeds up range checks and derived totals on large item arrays
+except ImportError:
+    np = None
+
+VECTORIZE_MIN_ITEMS = int(os.getenv("SCHEMA_VECTORIZE_MIN_ITEMS", "1000")) # Switch to column-wise checks
+MAX_ANOMALIES_PER_KIND = int(os.getenv("SCHEMA_MAX_ANOMALIES_PER_KIND", "20"))
+TOTAL_TOLERANCE = 0.01
+_MISSING = object()
+
+
+class AnomalyCollector:
+    """Keeps the first `max_per_kind` messages of each anomaly kind and counts the rest,
+    so a file with 50,000 bad rows does not produce 50,000 strings."""
+
+    def __init__(self, max_per_kind: int = MAX_ANOMALIES_PER_KIND):
+        self.max_per_kind = max_per_kind
+        self.messages = []
+        self.counts = {}
+
+    def add(self, kind: str, message: str):
+        count = self.counts.get(kind, 0) + 1
+        self.counts[kind] = count
+        if count <= self.max_per_kind:
+            self.messages.append(message)
+
+    def __len__(self):
+        return sum(self.counts.values())
+
+    def to_list(self) -> list:
+        summary = [f"... {count - self.max_per_kind} more '{kind}' anomalies not listed ({count} in total)"
+                   for kind, count in self.counts.items() if count > self.max_per_kind]
+        return self.messages + summary
+
+
+def _coerce(value, expected):
+    """Returns (value, ok, coerced). Lossless numeric conversions (int -> float, 2.0 -> 2)
+    are applied silently; numeric strings are converted and flagged as coerced."""
+    if expected is None:
+        return value, True, False
+    if expected in (int, float):
+        if isinstance(value, bool):
+            return value, False, False
+        if expected is float and isinstance(value, (int, float)):
+            return float(value), True, False
+        if expected is int:
+            if isinstance(value, int):
+                return value, True, False
+            if isinstance(value, float) and value.is_integer():
+                return int(value), True, False
+        if isinstance(value, str):
+            try:
+                number = float(value.strip())
+            except ValueError:
+                return value, False, False
+            if expected is float:
+                return number, True, True
+            if number.is_integer():
+                return int(number), True, True
+        return value, False, False
+    return value, isinstance(value, expected), False
+
+
+class FieldSpec:
+    """Compiled check for one field. A spec is either a type (e.g. `float`) or a dict such as
+    {"type": float, "min": 0, "max": None, "schema": {...nested dict schema...},
+     "item_schema": {...schema of each element of a list...}}."""
+
+    __slots__ = ("name", "type", "minimum", "maximum", "schema", "item_schema")
+
+    def __init__(self, name: str, spec):
+        self.name = name
+        if isinstance(spec, dict):
+            self.type = spec.get("type")
+            self.minimum = spec.get("min")
+            self.maximum = spec.get("max")
+            self.schema = CompiledSchema(spec["schema"]) if "schema" in spec else None
+            self.item_schema = CompiledSchema({"item_schema": spec["item_schema"]}) if "item_schema" in spec else None
+        else:
+            self.type = spec
+            self.minimum = self.maximum = self.schema = self.item_schema = None
+
+    @property
+    def has_range(self) -> bool:
+        return self.minimum is not None or self.maximum is not None
+
+    def out_of_range(self, value) -> bool:
+        return (self.minimum is not None and value < self.minimum) or \
+               (self.maximum is not None and value > self.maximum)
+
+    def check(self, value, where: str, anomalies: AnomalyCollector, check_range: bool = True):
+        """Validates one value and returns it, coerced if needed."""
+        value, ok, coerced = _coerce(value, self.type)
+        if not ok:
+            anomalies.add("type_mismatch",
+                          f"{where}: Expected type {self.type.__name__}, got {type(value).__name__}")
+            return value
+        if coerced:
+            anomalies.add("coerced", f"{where}: Coerced string to {self.type.__name__}")
+        if check_range and self.has_range and isinstance(value, (int, float)) and self.out_of_range(value):
+            anomalies.add("out_of_range", f"{where}: Value {value} outside [{self.minimum}, {self.maximum}]")
+        if self.schema is not None and isinstance(value, dict):
+            value = self.schema.validate_record(value, where, anomalies)
+        if self.item_schema is not None and isinstance(value, list):
+            value = self.item_schema.validate_items(value, anomalies)
+        return value
+
+
+class ValidationResult:
+    __slots__ = ("data", "anomalies", "derived")
+
+    def __init__(self, data: dict, anomalies: list, derived: dict):
+        self.data = data
+        self.anomalies = anomalies
+        self.derived = derived
+
+
+class CompiledSchema:
+    """A target schema compiled once into field checks. Understands the JSONAgent schema
+    dict: required_fields / optional_fields, optional field_types for top-level fields,
+    item_schema for the elements of `items_field`, and total_check for a derived total."""
+
+    def __init__(self, spec: dict, name: str = None):
+        self.name = name
+        self.required = tuple(spec.get("required_fields", ()))
+        self.optional = tuple(spec.get("optional_fields", ()))
+        self.fields = {k: FieldSpec(k, v) for k, v in spec.get("field_types", {}).items()}
+        self.items_field = spec.get("items_field", "items")
+        self.item_fields = {k: FieldSpec(k, v) for k, v in spec.get("item_schema", {}).items()}
+        self.total_check = spec.get("total_check") # {"total_field", "quantity", "unit_price"}
+
+    def validate(self, data: dict) -> ValidationResult:
+        anomalies = AnomalyCollector()
+        reformatted_data = {}
+        for field in self.required:
+            if field in data:
+                reformatted_data[field] = data[field]
+            else:
+                anomalies.add("missing_field", f"Missing required field: {field}")
+        for field in self.optional:
+            if field in data:
+                reformatted_data[field] = data[field]
+        for name, spec in self.fields.items():
+            if name in reformatted_data:
+                reformatted_data[name] = spec.check(reformatted_data[name], f"Field '{name}'", anomalies)
+        if self.item_fields and self.items_field in reformatted_data:
+            items = reformatted_data[self.items_field]
+            if not isinstance(items, list):
+                anomalies.add("invalid_items", f"Field '{self.items_field}' should be a list.")
+            else:
+                reformatted_data[self.items_field] = self.validate_items(items, anomalies)
+        for key in data:
+            if key not in reformatted_data:
+                reformatted_data[key] = data[key]
+                anomalies.add("unexpected_field", f"Unexpected field found: {key} (included as-is)")
+        if not len(anomalies) and not reformatted_data:
+            anomalies.add("no_match", "Input JSON does not match any fields in the target schema.")
+        derived = self._derived_totals(reformatted_data, anomalies) if self.total_check else {}
+        return ValidationResult(reformatted_data, anomalies.to_list(), derived)
+
+    def validate_record(self, record: dict, where: str, anomalies: AnomalyCollector) -> dict:
+        """Nested-object validation: reports into the caller's collector."""
+        result = self.validate(record)
+        for message in result.anomalies:
+            anomalies.add("nested", f"{where}: {message}")
+        return result.data
+
+    def validate_items(self, items: list, anomalies: AnomalyCollector) -> list:
+        if len(items) >= VECTORIZE_MIN_ITEMS:
+            return self._validate_items_columnar(items, anomalies)
+        return self._validate_items_rows(items, anomalies)
+
+    def _validate_items_rows(self, items: list, anomalies: AnomalyCollector) -> list:
+        validated = items
+        for i, item in enumerate(items):
+            if not isinstance(item, dict):
+                anomalies.add("invalid_item", f"Item at index {i} is not a dictionary.")
+                continue
+            new_item = None
+            for key, spec in self.item_fields.items():
+                if key not in item:
+                    anomalies.add("missing_item_field", f"Item at index {i} missing field: {key}")
+                    continue
+                value = spec.check(item[key], f"Item at index {i}, field '{key}'", anomalies)
+                if value is not item[key]:
+                    new_item = new_item or dict(item)
+                    new_item[key] = value
+            if new_item is not None:
+                if validated is items:
+                    validated = list(items) # Copy-on-write: the caller's list is never modified
+                validated[i] = new_item
+        return validated
+
+    def _validate_items_columnar(self, items: list, anomalies: AnomalyCollector) -> list:
+        """Checks one field at a time across all items. A column whose values all already
+        have the expected type is accepted with a single set() over its types; only columns
+        containing mismatches are walked element by element."""
+        positions = []
+        for i, item in enumerate(items):
+            if isinstance(item, dict):
+                positions.append(i)
+            else:
+                anomalies.add("invalid_item", f"Item at index {i} is not a dictionary.")
+        validated = items
+        for key, spec in self.item_fields.items():
+            column = [items[i].get(key, _MISSING) for i in positions]
+            value_types = set(map(type, column))
+            fast = spec.type is not None and value_types == {spec.type} and spec.schema is None and spec.item_schema is None
+            if not fast:
+                for j, value in enumerate(column):
+                    i = positions[j]
+                    if value is _MISSING:
+                        anomalies.add("missing_item_field", f"Item at index {i} missing field: {key}")
+                        continue
+                    checked = spec.check(value, f"Item at index {i}, field '{key}'", anomalies, check_range=False)
+                    if checked is not value:
+                        if validated is items:
+                            validated = list(items)
+                        if validated[i] is items[i]:
+                            validated[i] = dict(items[i])
+                        validated[i][key] = checked
+                        column[j] = checked
+            if spec.has_range:
+                self._check_column_range(spec, key, column, positions, anomalies)
+        return validated
+
+    @staticmethod
+    def _check_column_range(spec: FieldSpec, key: str, column: list, positions: list, anomalies: AnomalyCollector):
+        numeric = [isinstance(v, (int, float)) and not isinstance(v, bool) for v in column]
+        if np is not None:
+            values = np.array([v if ok else np.nan for v, ok in zip(column, numeric)], dtype=float)
+            bad = np.zeros(len(values), dtype=bool)
+            if spec.minimum is not None:
+                bad |= values < spec.minimum
+            if spec.maximum is not None:
+                bad |= values > spec.maximum
+            bad_indexes = np.flatnonzero(bad).tolist()
+        else:
+            bad_indexes = [j for j, (v, ok) in enumerate(zip(column, numeric)) if ok and spec.out_of_range(v)]
+        for j in bad_indexes:
+            anomalies.add("out_of_range", f"Item at index {positions[j]}, field '{key}': "
+                                          f"Value {column[j]} outside [{spec.minimum}, {spec.maximum}]")
+
+    def _derived_totals(self, data: dict, anomalies: AnomalyCollector) -> dict:
+        items = data.get(self.items_field)
+        if not isinstance(items, list):
+            return {}
+        quantity_key = self.total_check.get("quantity", "quantity")
+        price_key = self.total_check.get("unit_price", "unit_price")
+        pairs = [(item.get(quantity_key), item.get(price_key)) for item in items if isinstance(item, dict)]
+        pairs = [(q, p) for q, p in pairs
+                 if isinstance(q, (int, float)) and isinstance(p, (int, float))
+                 and not isinstance(q, bool) and not isinstance(p, bool)]
+        if np is not None and len(pairs) >= VECTORIZE_MIN_ITEMS:
+            matrix = np.array(pairs, dtype=float)
+            items_total = float(np.dot(matrix[:, 0], matrix[:, 1]))
+        else:
+            items_total = math.fsum(q * p for q, p in pairs)
+        derived = {"item_count": len(items), "priced_items": len(pairs), "items_total": round(items_total, 2)}
+        total_field = self.total_check.get("total_field", "total_amount")
+        stated_total = data.get(total_field)
+        if isinstance(stated_total, (int, float)) and not isinstance(stated_total, bool):
+            derived["total_matches"] = abs(items_total - stated_total) <= TOTAL_TOLERANCE + 1e-9 * abs(stated_total)
+            if not derived["total_matches"]:
+                anomalies.add("total_mismatch", f"Field '{total_field}' is {stated_total}, but the items add up "
+                                                f"to {round(items_total, 2)} (sum of {quantity_key} * {price_key})")
+        return derived
+
+
+def compile_schemas(target_schemas: dict) -> dict:
+    """{intent: schema dict} -> {intent: CompiledSchema}."""
+    return {intent: CompiledSchema(spec, name=intent) for intent, spec in target_schemas.items()}
@@ -0,0 +1,51 @@
+# utils/structured_output.py
+import json
+import re
+
+_FENCE_RE = re.compile(r"^```(?:json)?\s*|\s*```$", re.IGNORECASE)
+
+
+def parse_json_object(text: str):
+    """Parses a JSON object out of an LLM response, tolerating markdown code fences and
+    surrounding chatter. Returns None if no object can be decoded."""
+    if not text:
+        return None
+    cleaned = _FENCE_RE.sub("", text.strip())
+    start = cleaned.find("{")
+    if start == -1:
+        return None
+    try:
+        obj, _ = json.JSONDecoder().raw_decode(cleaned[start:])
+    except json.JSONDecodeError:
+        return None
+    return obj if isinstance(obj, dict) else None
+
+
+def validate_structured(obj: dict, schema: dict):
+    """Checks `obj` against a flat schema of the form
+    {"field": {"type": str, "enum": [...], "required": True}}.
+    Enum values are matched case-insensitively and normalized to their canonical spelling.
+    Returns (normalized_dict, errors)."""
+    normalized = {}
+    errors = []
+    for field, spec in schema.items():
+        if field not in obj or obj[field] in (None, ""):
+            if spec.get("required", True):
+                errors.append(f"Missing field: {field}")
+            continue
+        value = obj[field]
+        expected_type = spec.get("type", str)
+        if not isinstance(value, expected_type):
+            errors.append(f"Field '{field}': Expected type {expected_type.__name__}, got {type(value).__name__}")
+            continue
+        if isinstance(value, str):
+            value = value.strip()
+        allowed = spec.get("enum")
+        if allowed:
+            canonical = {a.lower(): a for a in allowed}
+            if str(value).lower() not in canonical:
+                errors.append(f"Field '{field}': '{value}' is not one of {', '.join(allowed)}")
+                continue
+            value = canonical[str(value).lower()]
+        normalized[field] = value
+    return normalized, errors
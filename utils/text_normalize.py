@@ -0,0 +1,89 @@
+# utils/text_normalize.py
+import re
+
+HEADER_RE = re.compile(r"^(?:from|to|cc|bcc|sent|date|reply-to|subject)\s*:.*$", re.IGNORECASE)
+SUBJECT_PREFIX_RE = re.compile(r"^(?:\s*(?:re|fwd?|aw|wg)\s*:\s*)+", re.IGNORECASE)
+# Lines that introduce a quoted earlier message; everything after them is the old thread
+REPLY_MARKER_RE = re.compile(
+    r"^(?:on .{0,200}wrote:\s*$|-{2,}\s*original message\s*-{2,}|_{5,}\s*$|from:\s.+\s+sent:\s)",
+    re.IGNORECASE)
+FORWARD_MARKER_RE = re.compile(r"^-{2,}\s*forwarded message\s*-{2,}$|^begin forwarded message:$", re.IGNORECASE)
+SIGNATURE_MARKER_RE = re.compile(
+    r"^(?:--\s*|thanks,?|thank you,?|best,?|regards,?|best regards,?|kind regards,?|sincerely,?|cheers,?"
+    r"|sent from my \w+.*)$", re.IGNORECASE)
+WHITESPACE_RE = re.compile(r"\s+")
+# A line after a sign-off that is still message content: a digit (order numbers, quantities,
+# also phone numbers) or sentence punctuation
+SIGNATURE_CONTENT_RE = re.compile(r"\d|[.!?;:](?:\s|$)")
+MAX_SIGNATURE_LINE_CHARS = 60
+
+
+def strip_quoted_replies(text: str) -> str:
+    """Drops '>'-quoted lines and everything after a reply marker ('On ... wrote:',
+    '-----Original Message-----'). Forwarded messages are kept: their body is the content."""
+    kept = []
+    for line in text.splitlines():
+        stripped = line.strip()
+        if REPLY_MARKER_RE.match(stripped):
+            break
+        if stripped.startswith(">") or FORWARD_MARKER_RE.match(stripped):
+            continue
+        kept.append(line)
+    return "\n".join(kept)
+
+
+def _looks_like_signature(lines) -> bool:
+    """True when the lines after a sign-off are a short name/contact block: a few short lines
+    without digits or sentences."""
+    lines = [line.strip() for line in lines if line.strip()]
+    return len(lines) <= 4 and all(
+        len(line) <= MAX_SIGNATURE_LINE_CHARS and not SIGNATURE_CONTENT_RE.search(line) for line in lines)
+
+
+def strip_signature(text: str) -> str:
+    """Cuts a trailing sign-off block ('Thanks,', 'Best regards,', '-- ') from the last
+    few lines of the message, but only when what follows the sign-off looks like a signature;
+    'Thanks,' followed by e.g. an order line is left alone."""
+    lines = text.rstrip().splitlines()
+    search_from = max(0, len(lines) - 8)
+    for i in range(len(lines) - 1, search_from - 1, -1):
+        if SIGNATURE_MARKER_RE.match(lines[i].strip()):
+            if _looks_like_signature(lines[i + 1:]):
+                return "\n".join(lines[:i]).rstrip()
+            break
+    return "\n".join(lines)
+
+
+def split_headers(text: str):
+    """Separates leading 'Header: value' lines (blank lines between them allowed) from the
+    body. Returns (headers dict with lowercased names, body)."""
+    headers = {}
+    lines = text.splitlines()
+    i = 0
+    while i < len(lines):
+        line = lines[i].strip()
+        if line and not HEADER_RE.match(line):
+            break
+        if line:
+            name, _, value = line.partition(":")
+            headers.setdefault(name.strip().lower(), value.strip())
+        i += 1
+    return headers, "\n".join(lines[i:])
+
+
+def normalize_for_matching(text: str, strip_signatures: bool = True) -> str:
+    """Canonical form used for duplicate detection: the sender and the subject (without
+    Re:/Fwd:) plus the body without other headers, quoted replies or (unless strip_signatures
+    is False) signature, lowercased with collapsed whitespace. The sender is kept so the same
+    text from two people never matches exactly. For a forwarded copy, the forwarded original is
+    what gets normalized."""
+    lines = text.splitlines()
+    for i, line in enumerate(lines):
+        if FORWARD_MARKER_RE.match(line.strip()):
+            return normalize_for_matching("\n".join(lines[i + 1:]), strip_signatures)
+    headers, body = split_headers(text)
+    subject = SUBJECT_PREFIX_RE.sub("", headers.get("subject", ""))
+    body = strip_quoted_replies(body)
+    if strip_signatures:
+        body = strip_signature(body)
+    return WHITESPACE_RE.sub(" ", f"{headers.get('from', '')}\n{subject}\n{body}").strip().lower()